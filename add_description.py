@@ -1,6 +1,8 @@
-from app import app, db
+from app import init_app, db
 from sqlalchemy import text
 
+app = init_app()
+
 with app.app_context():
     try:
         db.session.execute(text('ALTER TABLE products ADD COLUMN description TEXT'))
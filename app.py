@@ -1,14 +1,45 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, jsonify, abort, session, flash
+import hashlib
+import json
+import re
+import secrets
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from flask import Flask, render_template, request, redirect, url_for, jsonify, abort, session, flash, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import contains_eager, joinedload, lazyload, load_only
 from dotenv import load_dotenv
-import google.generativeai as genai
 from werkzeug.security import generate_password_hash, check_password_hash
 from thefuzz import fuzz
 from functools import wraps
 from flask_uploads import UploadSet, configure_uploads, IMAGES
+import search_fts
+import geo_index
+import recommendations
+from periodic_jobs import PeriodicJob
+from product_index import ProductSearchIndex
+from query_stats import QueryStats
+from hll import HyperLogLog
+from write_behind import WriteBehindBuffer
+from response_cache import MemoryResponseCache, SQLiteResponseCache, cache_key
+from chat_state import MemoryChatStateStore, SQLiteChatStateStore, record_turn, set_results
+from chat_intents import ChatMatcher
+from fuzzy_index import FuzzyNameIndex
+from semantic_index import SemanticProductIndex
+from image_pipeline import ImagePipeline, variant_path
+from upload_store import UploadStore, setup_upload_refs
+from static_assets import StaticAssets, build_assets
+from pagination import InvalidCursor, decode_cursor, encode_cursor
+from inventory import take_stock, return_stock
+import sqlite_profile
+import click
+from markupsafe import Markup, escape
+from jinja2 import FileSystemBytecodeCache
 
 load_dotenv()
 
@@ -23,12 +54,99 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'comunia-secret-key-2025')
 app.config['UPLOADED_IMAGES_DEST'] = os.path.join(BASEDIR, 'static', 'uploads')
 app.config['UPLOADED_IMAGES_ALLOW'] = IMAGES
 
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+# Plantillas compiladas a bytecode en disco: los workers nuevos no vuelven a compilar Jinja
+app.config.setdefault('JINJA_BYTECODE_CACHE_DIR', os.path.join(BASEDIR, '.jinja_cache'))
+
+# Perfil de conexión de SQLite (WAL, busy_timeout, mmap...) y tamaño del pool; ver sqlite_profile.py
+app.config.setdefault('SQLITE_PRAGMAS', sqlite_profile.DEFAULT_PRAGMAS)
+
+# Las extensiones y los objetos que dependen de la configuración se inicializan en
+# init_app() (al final de este archivo), no al importar el módulo.
+db = SQLAlchemy()
+migrate = Migrate()
+query_stats = QueryStats()  # Consultas SQL por endpoint y detección de N+1
+static_assets = StaticAssets()  # CSS/JS con huella, precomprimidos y con caché inmutable
 
 # CONFIGURACIÓN DE SUBIDAS
 images = UploadSet('images', IMAGES)
-configure_uploads(app, images)
+
+# Variantes redimensionadas (WebP/JPEG) de las imágenes subidas, generadas en un pool de procesos
+app.config.setdefault('IMAGE_PIPELINE_ENABLED', True)
+app.config.setdefault('IMAGE_PIPELINE_WORKERS', 2)
+IMAGE_PIPELINE = None  # ImagePipeline, se crea en init_app()
+
+# Subidas guardadas por hash de contenido, con conteo de referencias (ver upload_store.py)
+app.config.setdefault('UPLOAD_GC_GRACE_SECONDS', 3600)
+UPLOAD_STORE = None  # UploadStore, se crea en init_app()
+
+@app.template_global()
+def responsive_image(filename, alt='', sizes='100vw', class_='', style=''):
+    """
+    <img> de una imagen subida con srcset/sizes (WebP con respaldo JPEG) y placeholder
+    borroso. Si la imagen aún no tiene variantes, usa el original.
+    """
+    original = url_for('static', filename='uploads/' + filename)
+    manifest = IMAGE_PIPELINE.manifest(filename)
+    if not manifest:
+        return Markup('<img src="{}" alt="{}" class="{}" style="{}" loading="lazy" decoding="async">').format(
+            original, alt, class_, style)
+
+    def srcset(ext):
+        return ', '.join(f"{url_for('static', filename='uploads/' + variant_path(filename, w, ext))} {w}w"
+                         for w in manifest['widths'])
+
+    fallback = url_for('static', filename='uploads/' + variant_path(filename, manifest['widths'][-1], 'jpg'))
+    placeholder_style = f"background: center / cover no-repeat url('{manifest['placeholder']}'); {style}"
+    return Markup(
+        '<picture>'
+        '<source type="image/webp" srcset="{webp}" sizes="{sizes}">'
+        '<img src="{src}" srcset="{jpg}" sizes="{sizes}" alt="{alt}" class="{class_}" style="{style}" '
+        'width="{width}" height="{height}" loading="lazy" decoding="async">'
+        '</picture>'
+    ).format(webp=srcset('webp'), jpg=srcset('jpg'), sizes=sizes, src=fallback, alt=alt, class_=class_,
+             style=placeholder_style, width=manifest['width'], height=manifest['height'])
+
+@app.cli.command('process-images')
+@click.option('--force', is_flag=True, help='Regenerar también las imágenes ya procesadas.')
+def process_images_command(force):
+    """Genera variantes y placeholders para las imágenes existentes en static/uploads."""
+    done, errors = IMAGE_PIPELINE.backfill(force=force)
+    print(f"✅ {done} imágenes procesadas.")
+    for name, error in errors:
+        print(f"  ⚠️  {name}: {error}")
+
+@app.cli.command('compile-templates')
+def compile_templates_command():
+    """Compila todas las plantillas al caché de bytecode de Jinja (JINJA_BYTECODE_CACHE_DIR)."""
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    print(f"✅ {len(names)} plantillas compiladas.")
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Genera en static/dist las copias con huella (y .gz/.br) de static/css y static/js."""
+    manifest = build_assets(app.static_folder)
+    static_assets.load(manifest)
+    for original, hashed in sorted(manifest.items()):
+        print(f"  {original} -> {hashed}")
+    print(f"✅ {len(manifest)} recursos con huella.")
+
+@app.cli.command('gc-uploads')
+@click.option('--dedupe', is_flag=True, help='Unificar antes las copias idénticas de un mismo archivo.')
+@click.option('--dry-run', is_flag=True, help='Solo listar los archivos que se borrarían.')
+@click.option('--grace', type=int, default=None, help='Segundos sin referencias antes de borrar (por defecto UPLOAD_GC_GRACE_SECONDS).')
+def gc_uploads_command(dedupe, dry_run, grace):
+    """Borra de static/uploads los archivos que ya no usa ningún negocio ni producto."""
+    if dedupe and not dry_run:
+        for copy, kept in UPLOAD_STORE.dedupe().items():
+            print(f"  {copy} -> {kept}")
+    removed = UPLOAD_STORE.collect(dry_run=dry_run, grace=grace)
+    for name in removed:
+        print(f"  {'(se borraría) ' if dry_run else ''}{name}")
+    stats = UPLOAD_STORE.stats()
+    print(f"✅ {len(removed)} archivos {'sin referencias' if dry_run else 'borrados'}. "
+          f"Quedan {stats['files']} archivos ({stats['bytes'] / 1024 / 1024:.1f} MB).")
 
 # Helper table for the many-to-many relationship between users and favorite businesses
 favorites = db.Table('favorites',
@@ -61,7 +179,11 @@ class Business(db.Model):
     products = db.relationship('Product', backref='business', lazy=True, cascade="all, delete-orphan")
     favorited_by = db.relationship('User', secondary=favorites, lazy='subquery', backref=db.backref('favorite_businesses', lazy=True))
     viewed_by = db.relationship('User', secondary=business_views, lazy='subquery', backref=db.backref('viewed_businesses', lazy=True))
+    rating = db.relationship('BusinessRating', uselist=False, lazy='joined', cascade="all, delete-orphan")
+    visit_sketches = db.relationship('BusinessVisitSketch', lazy=True, cascade="all, delete-orphan")
+    ai_suggestions = db.relationship('AISuggestionCache', lazy=True, cascade="all, delete-orphan")
     is_active = db.Column(db.Boolean, default=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=db.func.now())
 
 class Review(db.Model):
     __tablename__ = 'reviews'
@@ -81,6 +203,69 @@ class Review(db.Model):
             'created_at': self.created_at.strftime('%d/%m/%Y') if self.created_at else None
         }
 
+class BusinessRating(db.Model):
+    """Agregado de reseñas por negocio: se actualiza en la misma transacción que cada alta/baja de reseña."""
+    __tablename__ = 'business_ratings'
+    business_id = db.Column(db.Integer, db.ForeignKey('businesses.id'), primary_key=True)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    stars_1 = db.Column(db.Integer, nullable=False, default=0)
+    stars_2 = db.Column(db.Integer, nullable=False, default=0)
+    stars_3 = db.Column(db.Integer, nullable=False, default=0)
+    stars_4 = db.Column(db.Integer, nullable=False, default=0)
+    stars_5 = db.Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def average(self):
+        return round(self.rating_sum / self.review_count, 1) if self.review_count else 0
+
+    def to_dict(self):
+        return {
+            'avg_rating': self.average,
+            'total': self.review_count,
+            'histogram': {n: getattr(self, f'stars_{n}') for n in range(1, 6)}
+        }
+
+class BusinessVisitSketch(db.Model):
+    """
+    Sketch HyperLogLog de visitantes únicos de un negocio (1 KB por fila).
+    `period` es el día ('YYYY-MM-DD') o 'total' para el acumulado histórico.
+    """
+    __tablename__ = 'business_visit_sketches'
+    business_id = db.Column(db.Integer, db.ForeignKey('businesses.id'), primary_key=True)
+    period = db.Column(db.String(10), primary_key=True)
+    registers = db.Column(db.LargeBinary, nullable=False)
+
+class AISuggestionCache(db.Model):
+    """Respuestas de /api/ai/suggestions, por hash del modelo y los datos del negocio usados en el prompt."""
+    __tablename__ = 'ai_suggestion_cache'
+    cache_key = db.Column(db.String(64), primary_key=True)
+    business_id = db.Column(db.Integer, db.ForeignKey('businesses.id'), nullable=False, index=True)
+    model = db.Column(db.String(60), nullable=False)
+    suggestions = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=db.func.now())
+
+class BusinessNeighbor(db.Model):
+    """Negocios similares precalculados (ver recommendations.py): los vecinos de cada negocio por orden."""
+    __tablename__ = 'business_neighbors'
+    business_id = db.Column(db.Integer, db.ForeignKey('businesses.id'), primary_key=True)
+    rank = db.Column(db.SmallInteger, primary_key=True)
+    neighbor_id = db.Column(db.Integer, db.ForeignKey('businesses.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    common_users = db.Column(db.Integer, nullable=False)
+
+class AdminStat(db.Model):
+    """
+    Estadísticas del panel de administración (ver refresh_admin_stats).
+    `period` es el día ('YYYY-MM-DD') de las series diarias o 'total' para los totales.
+    """
+    __tablename__ = 'admin_stats'
+    period = db.Column(db.String(10), primary_key=True)
+    metric = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.Integer, nullable=False)
+
+EMPTY_RATING = {'avg_rating': 0, 'total': 0, 'histogram': {n: 0 for n in range(1, 6)}}
+
 class Product(db.Model):
     __tablename__ = 'products'
     id = db.Column(db.Integer, primary_key=True)
@@ -124,10 +309,17 @@ class Reservation(db.Model):
     product = db.relationship('Product', backref='reservations')
     business = db.relationship('Business', backref='reservations')
 
-with app.app_context():
-    db.create_all()
-    # En bases existentes la tabla 'businesses' puede no tener columnas new (latitude/longitude).
-    # Comprobamos y añadimos columnas faltantes con ALTER TABLE.
+# VERSIÓN DEL ESQUEMA
+# Las tablas, columnas, índices y triggers que falten se crean en upgrade_schema(), que
+# solo corre si PRAGMA user_version es menor que SCHEMA_VERSION: una vez aplicada, el
+# arranque ya no ejecuta DDL. Al cambiar el esquema o los datos derivados, subir SCHEMA_VERSION.
+SCHEMA_VERSION = 5
+
+def add_missing_columns():
+    """
+    En bases existentes la tabla 'businesses' puede no tener columnas new (latitude/longitude).
+    Comprobamos y añadimos columnas faltantes con ALTER TABLE. Devuelve False si falló.
+    """
     try:
         # Para la tabla 'businesses'
         business_cols_info = db.session.execute(text("PRAGMA table_info(businesses)")).fetchall()
@@ -138,6 +330,13 @@ with app.app_context():
             db.session.execute(text("ALTER TABLE businesses ADD COLUMN longitude REAL"))
         if 'nit' not in business_cols:
             db.session.execute(text("ALTER TABLE businesses ADD COLUMN nit VARCHAR(20)"))
+        if 'created_at' not in business_cols:
+            db.session.execute(text("ALTER TABLE businesses ADD COLUMN created_at DATETIME"))
+            # Negocios existentes: tomar como fecha de alta el registro de su dueño
+            db.session.execute(text("""
+                UPDATE businesses SET created_at = (SELECT min(u.created_at) FROM users u WHERE u.business_id = businesses.id)
+                 WHERE created_at IS NULL
+            """))
 
         # Para la tabla 'users'
         user_cols_info = db.session.execute(text("PRAGMA table_info(users)")).fetchall()
@@ -146,9 +345,393 @@ with app.app_context():
             db.session.execute(text("ALTER TABLE users ADD COLUMN ci VARCHAR(20)"))
 
         db.session.commit()
+        return True
     except Exception as e:
         # No detener el arranque si falla esta corrección automática; informar en consola.
+        db.session.rollback()
         print('Advertencia: no se pudo asegurar columnas latitude/longitude en businesses:', e)
+        return False
+
+# AGREGADOS DE RESEÑAS
+def apply_review_to_rating(business_id, rating, delta=1):
+    """Suma (delta > 0) o resta (delta < 0) reseñas de `rating` estrellas en el agregado del negocio."""
+    db.session.execute(sqlite_insert(BusinessRating).values(business_id=business_id).on_conflict_do_nothing())
+    star_column = getattr(BusinessRating, f'stars_{rating}')
+    db.session.execute(
+        db.update(BusinessRating)
+        .where(BusinessRating.business_id == business_id)
+        .values({
+            BusinessRating.review_count: BusinessRating.review_count + delta,
+            BusinessRating.rating_sum: BusinessRating.rating_sum + delta * rating,
+            star_column: star_column + delta,
+        })
+    )
+
+def rebuild_business_ratings():
+    """Recalcula todos los agregados desde la tabla reviews."""
+    db.session.execute(db.delete(BusinessRating))
+    db.session.execute(text("""
+        INSERT INTO business_ratings (business_id, review_count, rating_sum,
+                                      stars_1, stars_2, stars_3, stars_4, stars_5)
+        SELECT r.business_id, count(*), sum(r.rating),
+               sum(r.rating = 1), sum(r.rating = 2), sum(r.rating = 3), sum(r.rating = 4), sum(r.rating = 5)
+          FROM reviews r JOIN businesses b ON b.id = r.business_id
+         GROUP BY r.business_id
+    """))
+    db.session.commit()
+
+@app.cli.command('rebuild-ratings')
+def rebuild_ratings_command():
+    """Recalcula los agregados de reseñas (business_ratings)."""
+    rebuild_business_ratings()
+    print(f"✅ Agregados recalculados para {BusinessRating.query.count()} negocios.")
+
+# VISITANTES ÚNICOS (HyperLogLog por negocio y día)
+VISIT_SKETCH_TOTAL = 'total'
+VISIT_SKETCH_RETENTION_DAYS = 30  # Los sketches diarios más antiguos se eliminan
+
+def visitor_key():
+    """Identificador del visitante: el usuario si hay sesión, si no un id aleatorio guardado en la cookie."""
+    if 'user_id' in session:
+        return f"user:{session['user_id']}"
+    if 'visitor_id' not in session:
+        session['visitor_id'] = secrets.token_hex(8)
+    return f"anon:{session['visitor_id']}"
+
+def record_business_visits(business_id, keys, day):
+    """Agrega los visitantes al sketch del día (`day` en ISO) y al total. No hace commit."""
+    sketches = {s.period: s for s in BusinessVisitSketch.query.filter(
+        BusinessVisitSketch.business_id == business_id,
+        BusinessVisitSketch.period.in_([day, VISIT_SKETCH_TOTAL])
+    )}
+    if day not in sketches:
+        # Primer visitante del día: descartar los días fuera de la ventana de retención
+        cutoff = (date.fromisoformat(day) - timedelta(days=VISIT_SKETCH_RETENTION_DAYS)).isoformat()
+        BusinessVisitSketch.query.filter(
+            BusinessVisitSketch.business_id == business_id,
+            BusinessVisitSketch.period != VISIT_SKETCH_TOTAL,
+            BusinessVisitSketch.period < cutoff
+        ).delete(synchronize_session=False)
+    for period in (day, VISIT_SKETCH_TOTAL):
+        sketch = sketches.get(period)
+        hll = HyperLogLog.from_bytes(sketch.registers) if sketch else HyperLogLog()
+        changed = False
+        for key in keys:
+            changed = hll.add(key) or changed
+        if changed:
+            if sketch:
+                sketch.registers = hll.to_bytes()
+            else:
+                db.session.add(BusinessVisitSketch(business_id=business_id, period=period, registers=hll.to_bytes()))
+
+def visitor_counts(business_id, windows=(7, 30)):
+    """
+    Visitantes únicos estimados: el histórico y, para cada N de `windows`, los de los
+    últimos N días. Una sola consulta trae el total y los días de la ventana más larga.
+    """
+    today = date.today()
+    starts = {days: (today - timedelta(days=days - 1)).isoformat() for days in windows}
+    rows = db.session.query(BusinessVisitSketch.period, BusinessVisitSketch.registers).filter(
+        BusinessVisitSketch.business_id == business_id,
+        db.or_(BusinessVisitSketch.period == VISIT_SKETCH_TOTAL,
+               BusinessVisitSketch.period >= min(starts.values()))
+    )
+    total = HyperLogLog()
+    merged = {days: HyperLogLog() for days in windows}
+    for period, registers in rows:
+        hll = HyperLogLog.from_bytes(registers)
+        if period == VISIT_SKETCH_TOTAL:
+            total.merge(hll)
+            continue
+        for days, start in starts.items():
+            if period >= start:
+                merged[days].merge(hll)
+    return total.count(), {days: hll.count() for days, hll in merged.items()}
+
+def seed_visit_sketches():
+    """Continuidad con el conteo anterior: sembrar los sketches totales desde business_views."""
+    if not BusinessVisitSketch.query.first():
+        seeded = {}
+        for user_id, business_id in db.session.execute(db.select(business_views.c.user_id, business_views.c.business_id)):
+            seeded.setdefault(business_id, HyperLogLog()).add(f"user:{user_id}")
+        for business_id, hll in seeded.items():
+            db.session.add(BusinessVisitSketch(business_id=business_id, period=VISIT_SKETCH_TOTAL, registers=hll.to_bytes()))
+        db.session.commit()
+
+def upgrade_schema():
+    """Crea lo que falte del esquema, siembra los datos derivados y marca SCHEMA_VERSION."""
+    db.create_all()
+    applied = add_missing_columns()
+
+    # Índice FTS5 para la búsqueda de la página principal (se sincroniza con triggers)
+    search_fts.setup_fts(db.session)
+
+    # Índice R*Tree de ubicaciones para /api/businesses/nearby (se sincroniza con triggers)
+    geo_index.setup_geo_index(db.session)
+
+    # Índices de created_at para las series diarias del panel de administración
+    for table in ADMIN_STATS_SERIES_TABLES:
+        db.session.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_created_at ON {table} (created_at)"))
+    # Búsqueda por prefijo en las tablas del panel de administración
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_users_email_lower ON users (lower(email))"))
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_businesses_name_lower ON businesses (lower(name))"))
+    db.session.commit()
+
+    # Conteo de referencias de las subidas (se sincroniza con triggers)
+    if setup_upload_refs(db.session):
+        UPLOAD_STORE.hash_missing()
+
+    # Poblar los agregados la primera vez (tabla recién creada con reseñas existentes)
+    if not BusinessRating.query.first() and Review.query.first():
+        rebuild_business_ratings()
+    seed_visit_sketches()
+
+    if applied:  # Si algo falló, se vuelve a intentar en el próximo arranque
+        db.session.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+        db.session.commit()
+    return applied
+
+def schema_version():
+    return db.session.execute(text("PRAGMA user_version")).scalar()
+
+# El SQLite instalado puede no tener FTS5: entonces la búsqueda usa LIKE (se comprueba en init_app)
+FTS_ENABLED = False
+# Ni R*Tree: entonces /api/businesses/nearby responde 503
+GEO_ENABLED = False
+
+@app.cli.command('upgrade-schema')
+@click.option('--force', is_flag=True, help='Aplicar las comprobaciones aunque la base ya esté al día.')
+def upgrade_schema_command(force):
+    """Aplica las comprobaciones de esquema (tablas, columnas, índices FTS y triggers)."""
+    current = schema_version()
+    if current >= SCHEMA_VERSION and not force:
+        print(f"✅ El esquema ya está en la versión {current}.")
+        return
+    if upgrade_schema():
+        print(f"✅ Esquema actualizado a la versión {SCHEMA_VERSION}.")
+    else:
+        print("⚠️  No se pudo aplicar todo el esquema; revisa las advertencias.")
+
+# EVENTOS DE VISITAS Y FAVORITOS (escritura diferida)
+# Las visitas y los favoritos no se escriben en la petición: se encolan y un hilo
+# los guarda por lotes, así las páginas de perfil no esperan el lock de escritura de SQLite.
+app.config.setdefault('WRITE_BEHIND_ENABLED', True)
+app.config.setdefault('WRITE_BEHIND_INTERVAL_MS', 500)
+app.config.setdefault('WRITE_BEHIND_BATCH_SIZE', 200)
+app.config.setdefault('WRITE_BEHIND_MAX_QUEUE', 10000)
+
+# Favoritos encolados y aún no escritos: (user_id, business_id) -> favorito sí/no
+PENDING_FAVORITES = {}
+_pending_favorites_lock = threading.Lock()
+
+def is_favorite(user_id, business_id):
+    pending = PENDING_FAVORITES.get((user_id, business_id))
+    if pending is not None:
+        return pending
+    return db.session.query(favorites).filter_by(user_id=user_id, business_id=business_id).first() is not None
+
+def flush_engagement_events(events):
+    """Escribe un lote de eventos ('view', ...) y ('favorite', ...) en una sola transacción."""
+    visits = defaultdict(list)
+    viewed = set()
+    favorite_changes = {}
+    for event in events:
+        if event[0] == 'view':
+            _, business_id, key, user_id, day = event
+            visits[(business_id, day)].append(key)
+            if user_id:
+                viewed.add((user_id, business_id))
+        elif event[0] == 'favorite':
+            _, user_id, business_id, favorited = event
+            favorite_changes[(user_id, business_id)] = favorited  # Gana el último
+
+    with app.app_context():
+        try:
+            # Ignorar eventos de negocios/usuarios eliminados mientras estaban en cola
+            business_ids = {b for b, _ in visits} | {b for _, b in viewed} | {b for _, b in favorite_changes}
+            user_ids = {u for u, _ in viewed} | {u for u, _ in favorite_changes}
+            live_businesses = {row[0] for row in db.session.query(Business.id).filter(Business.id.in_(business_ids))}
+            live_users = {row[0] for row in db.session.query(User.id).filter(User.id.in_(user_ids))}
+
+            for (business_id, day), keys in visits.items():
+                if business_id in live_businesses:
+                    record_business_visits(business_id, keys, day)
+
+            rows = [{'user_id': u, 'business_id': b} for u, b in viewed if u in live_users and b in live_businesses]
+            if rows:
+                db.session.execute(sqlite_insert(business_views).values(rows).on_conflict_do_nothing())
+
+            added = [{'user_id': u, 'business_id': b} for (u, b), fav in favorite_changes.items()
+                     if fav and u in live_users and b in live_businesses]
+            removed = [pair for pair, fav in favorite_changes.items() if not fav]
+            if added:
+                db.session.execute(sqlite_insert(favorites).values(added).on_conflict_do_nothing())
+            if removed:
+                db.session.execute(db.delete(favorites).where(
+                    db.tuple_(favorites.c.user_id, favorites.c.business_id).in_(removed)))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    # Sólo tras el commit: mientras el lote se reintenta, is_favorite sigue viendo el valor encolado
+    forget_pending_favorites(('favorite', u, b, fav) for (u, b), fav in favorite_changes.items())
+
+def forget_pending_favorites(events):
+    """Quita de PENDING_FAVORITES los favoritos ya escritos o perdidos (si nadie los cambió después)."""
+    with _pending_favorites_lock:
+        for event in events:
+            if event[0] == 'favorite':
+                _, user_id, business_id, favorited = event
+                if PENDING_FAVORITES.get((user_id, business_id)) == favorited:
+                    del PENDING_FAVORITES[(user_id, business_id)]
+
+ENGAGEMENT_EVENTS = None  # WriteBehindBuffer, se crea en init_app()
+
+# NEGOCIOS SIMILARES
+# Vecinos de cada negocio según los usuarios que los visitan o marcan como favoritos
+# (ver recommendations.py). Se recalculan en segundo plano cada RECOMMEND_REFRESH_SECONDS
+# (ver periodic_jobs.py) o con `flask rebuild-recommendations`.
+app.config.setdefault('RECOMMEND_NEIGHBORS', 10)             # vecinos guardados por negocio
+app.config.setdefault('RECOMMEND_MIN_COMMON_USERS', 2)       # usuarios en común para relacionar dos negocios
+app.config.setdefault('RECOMMEND_MAX_ITEMS_PER_USER', 200)   # negocios que cuentan de un mismo usuario
+app.config.setdefault('RECOMMEND_REFRESH_SECONDS', 6 * 3600)
+RECOMMENDATIONS_JOB = None  # PeriodicJob, se crea en init_app()
+
+def rebuild_recommendations():
+    """
+    Recalcula business_neighbors desde favorites y business_views. Devuelve cuántas filas guardó.
+    Corre en el hilo de RECOMMENDATIONS_JOB (con su propio contexto de la app) o desde el comando.
+    """
+    connection = db.session.connection()
+    views = recommendations.read_pairs(connection, db.select(business_views.c.user_id, business_views.c.business_id))
+    favs = recommendations.read_pairs(connection, db.select(favorites.c.user_id, favorites.c.business_id))
+    source, target, scores, common, rank = recommendations.item_neighbors(
+        *recommendations.interactions(views, favs),
+        k=app.config['RECOMMEND_NEIGHBORS'],
+        min_common=app.config['RECOMMEND_MIN_COMMON_USERS'],
+        max_items_per_user=app.config['RECOMMEND_MAX_ITEMS_PER_USER'])
+
+    # Reemplazar la tabla en una sola transacción: las lecturas ven la versión anterior hasta el commit
+    db.session.execute(db.delete(BusinessNeighbor))
+    columns = (source.tolist(), rank.tolist(), target.tolist(), scores.round(4).tolist(), common.tolist())
+    rows = [{'business_id': b, 'rank': r, 'neighbor_id': n, 'score': sc, 'common_users': c}
+            for b, r, n, sc, c in zip(*columns)]
+    for start in range(0, len(rows), 10000):
+        db.session.execute(db.insert(BusinessNeighbor), rows[start:start + 10000])
+    db.session.commit()
+    return len(rows)
+
+def delete_business_neighbors(business_id):
+    """Quita un negocio eliminado de los vecinos precalculados (antes del commit que lo borra)."""
+    BusinessNeighbor.query.filter(db.or_(BusinessNeighbor.business_id == business_id,
+                                         BusinessNeighbor.neighbor_id == business_id)).delete(synchronize_session=False)
+
+def similar_businesses(business_id, limit, options=()):
+    """[(negocio activo, similitud)] de los vecinos de `business_id`, el más parecido primero."""
+    RECOMMENDATIONS_JOB.maybe_start()
+    return (db.session.query(Business, BusinessNeighbor.score)
+            .join(BusinessNeighbor, BusinessNeighbor.neighbor_id == Business.id)
+            .filter(BusinessNeighbor.business_id == business_id, Business.is_active == True)
+            .options(lazyload(Business.favorited_by), lazyload(Business.viewed_by), *options)
+            .order_by(BusinessNeighbor.rank)
+            .limit(limit)
+            .all())
+
+@app.cli.command('rebuild-recommendations')
+def rebuild_recommendations_command():
+    """Recalcula los negocios similares (business_neighbors); pensado para cron."""
+    started = time.perf_counter()
+    saved = RECOMMENDATIONS_JOB.run_now()
+    print(f"✅ {saved} vecinos guardados en {time.perf_counter() - started:.1f} s.")
+
+# ESTADÍSTICAS DEL PANEL DE ADMINISTRACIÓN
+# El panel lee una foto de los totales y de las series diarias guardada en admin_stats,
+# así su costo no crece con la cantidad de usuarios. La foto se recalcula con SQL por
+# conjuntos (GROUP BY) en segundo plano cada ADMIN_STATS_REFRESH_SECONDS o con
+# `flask refresh-admin-stats`. Los días son de created_at, en UTC.
+app.config.setdefault('ADMIN_STATS_REFRESH_SECONDS', 300)
+app.config.setdefault('ADMIN_STATS_DAYS', 30)  # días de las series diarias
+ADMIN_STATS_JOB = None  # PeriodicJob, se crea en init_app()
+ADMIN_STATS_TOTAL = 'total'
+ADMIN_STATS_SERIES_TABLES = ('users', 'businesses', 'reviews', 'reservations')
+
+def refresh_admin_stats():
+    """Reemplaza la foto de admin_stats en una transacción. Devuelve cuántas filas guardó."""
+    since = (datetime.now(timezone.utc).date() - timedelta(days=app.config['ADMIN_STATS_DAYS'] + 1)).isoformat()
+    db.session.execute(db.delete(AdminStat))
+    db.session.execute(text("""
+        INSERT INTO admin_stats (period, metric, value)
+        SELECT 'total', 'users_' || CASE WHEN is_active THEN 'active' ELSE 'inactive' END, count(*)
+          FROM users GROUP BY is_active
+        UNION ALL
+        SELECT 'total', 'role_' || coalesce(role, 'user'), count(*) FROM users GROUP BY role
+        UNION ALL
+        SELECT 'total', 'businesses_' || CASE WHEN is_active THEN 'active' ELSE 'inactive' END, count(*)
+          FROM businesses GROUP BY is_active
+        UNION ALL
+        SELECT 'total', 'products', count(*) FROM products
+        UNION ALL
+        SELECT 'total', 'reviews', count(*) FROM reviews
+        UNION ALL
+        SELECT 'total', 'reservations_' || status, count(*) FROM reservations GROUP BY status
+        UNION ALL
+        SELECT 'total', 'refreshed_at', CAST(strftime('%s', 'now') AS INTEGER)
+    """))
+    db.session.execute(text("""
+        INSERT INTO admin_stats (period, metric, value)
+        SELECT date(created_at), 'signups', count(*) FROM users
+         WHERE created_at >= :since GROUP BY date(created_at)
+        UNION ALL
+        SELECT date(created_at), 'businesses', count(*) FROM businesses
+         WHERE created_at >= :since GROUP BY date(created_at)
+        UNION ALL
+        SELECT date(created_at), 'reviews', count(*) FROM reviews
+         WHERE created_at >= :since GROUP BY date(created_at)
+        UNION ALL
+        SELECT date(created_at), 'reservations_' || status, count(*) FROM reservations
+         WHERE created_at >= :since GROUP BY date(created_at), status
+    """), {'since': since})
+    db.session.commit()
+    return AdminStat.query.count()
+
+def admin_stats_snapshot():
+    """
+    (totales, series) de la última foto: `totales` es {métrica: valor} y `series`
+    {'days': [...], métrica: [valor por día]} con los últimos ADMIN_STATS_DAYS días.
+    Si todavía no hay foto, se calcula en esta petición.
+    """
+    rows = AdminStat.query.all()
+    if not rows:
+        try:
+            ADMIN_STATS_JOB.run_now()
+        except Exception as e:
+            db.session.rollback()
+            print('Advertencia: no se pudieron calcular las estadísticas del panel:', e)
+        rows = AdminStat.query.all()
+    else:
+        ADMIN_STATS_JOB.maybe_start()
+
+    totals = defaultdict(int)
+    daily = defaultdict(dict)
+    for row in rows:
+        if row.period == ADMIN_STATS_TOTAL:
+            totals[row.metric] = row.value
+        else:
+            daily[row.metric][row.period] = row.value
+    last_day = (datetime.fromtimestamp(totals['refreshed_at'], timezone.utc).date()
+                if totals['refreshed_at'] else datetime.now(timezone.utc).date())
+    days = [(last_day - timedelta(days=n)).isoformat() for n in range(app.config['ADMIN_STATS_DAYS'] - 1, -1, -1)]
+    series = {'days': days}
+    for metric in ('signups', 'businesses', 'reviews', *(f'reservations_{s}' for s in RESERVATION_STATUSES)):
+        series[metric] = [daily[metric].get(day, 0) for day in days]
+    return totals, series
+
+@app.cli.command('refresh-admin-stats')
+def refresh_admin_stats_command():
+    """Recalcula las estadísticas del panel de administración (admin_stats); pensado para cron."""
+    started = time.perf_counter()
+    saved = ADMIN_STATS_JOB.run_now()
+    print(f"✅ {saved} estadísticas guardadas en {time.perf_counter() - started:.2f} s.")
 
 # DECORADORES
 def login_required(f):
@@ -182,13 +765,42 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-# GEMINI (SIN CAMBIOS)
+# GEMINI
+GEMINI_MODEL_NAME = "gemini-2.5-flash"
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-    GEMINI_MODEL = genai.GenerativeModel("gemini-2.5-flash")
-else:
-    GEMINI_MODEL = None
+GEMINI_MODEL = None  # Se crea en el primer uso (ver get_gemini_model)
+_gemini_lock = threading.Lock()
+
+def get_gemini_model():
+    """
+    Modelo de Gemini, o None si no hay GEMINI_API_KEY. google.generativeai se
+    importa aquí y no al cargar app.py: su importación tarda más que el resto del arranque.
+    """
+    global GEMINI_MODEL
+    if GEMINI_MODEL is None and GEMINI_API_KEY:
+        with _gemini_lock:
+            if GEMINI_MODEL is None:
+                import google.generativeai as genai
+                genai.configure(api_key=GEMINI_API_KEY)
+                GEMINI_MODEL = genai.GenerativeModel(GEMINI_MODEL_NAME)
+    return GEMINI_MODEL
+
+# Aciertos/fallos de las cachés de respuestas de Gemini (por proceso)
+CACHE_STATS = defaultdict(lambda: {'hits': 0, 'misses': 0})
+app.config.setdefault('AI_SUGGESTIONS_TTL', 7 * 24 * 3600)  # segundos
+
+# Caché de respuestas de los modos asistente/general del chat ('memory' o 'sqlite')
+app.config.setdefault('CHAT_CACHE_BACKEND', 'memory')
+app.config.setdefault('CHAT_CACHE_MAX_ENTRIES', 1000)
+app.config.setdefault('CHAT_CACHE_TTL', 6 * 3600)  # segundos
+CHAT_RESPONSE_CACHE = None  # Se crea en init_app()
+
+# Estado de la conversación por sesión (última búsqueda, resultados, turnos); 'memory' o 'sqlite'
+app.config.setdefault('CHAT_STATE_BACKEND', 'memory')
+app.config.setdefault('CHAT_STATE_MAX_SESSIONS', 10000)
+app.config.setdefault('CHAT_STATE_TTL', 30 * 60)  # segundos sin actividad
+app.config.setdefault('CHAT_STATE_MAX_TURNS', 6)
+CHAT_STATES = None  # Se crea en init_app()
 
 # RUTAS DE AUTENTICACIÓN (ACTUALIZADO: /join con subida de logo)
 @app.route('/login', methods=['GET', 'POST'], strict_slashes=False)
@@ -285,7 +897,7 @@ def join():
             logo = request.files.get('logo') if 'logo' in request.files else None
             logo_path = None
             if logo and logo.filename:
-                logo_path = images.save(logo)
+                logo_path = UPLOAD_STORE.save(logo)
 
             # 2. Crear usuario y negocio en una transacción
             user = User(email=email, role='user', ci=ci) # Añadido 'ci'
@@ -360,16 +972,27 @@ def register_client():
     return render_template('register_client.html')
 
 
-@app.route('/', strict_slashes=False)
-def home():
-    search_query = request.args.get('search', '').strip()
-    category_filter = request.args.get('category', '').strip()
-    
-    # Inicia la consulta con negocios activos
+# LISTADO PAGINADO DE NEGOCIOS (keyset: sin OFFSET, cada página sigue a la última fila vista)
+app.config.setdefault('BUSINESS_PAGE_SIZE', 24)
+BUSINESS_PAGE_MAX = 100
+
+def filtered_businesses(search_query='', category_filter=''):
+    """
+    Negocios activos con los filtros de la portada. Devuelve (consulta, fts):
+    `fts` es la subconsulta (id, score) de FTS5 si hay búsqueda, o None.
+    """
     query = Business.query.filter(Business.is_active == True)
-    
-    if search_query:
-        # MEJORA: Buscar también en los productos
+
+    fts = None
+    if search_query and FTS_ENABLED:
+        # Búsqueda en el índice FTS5 (negocio + productos), con su puntaje BM25
+        fts = search_fts.ranked_subquery(search_query)
+        if fts is None:
+            query = query.filter(db.false())
+        else:
+            query = query.join(fts, fts.c.id == Business.id)
+    elif search_query:
+        # Sin FTS5: buscar también en los productos con LIKE.
         # Hacemos un outerjoin para incluir los productos en la búsqueda
         # y usamos distinct() para no repetir negocios si varios productos coinciden.
         query = query.outerjoin(Product).filter(
@@ -380,11 +1003,87 @@ def home():
                 Product.description.ilike(f'%{search_query}%')
             )
         ).distinct()
-    
+
     if category_filter and category_filter != 'Todas las categorías':
         query = query.filter(Business.category == category_filter)
+    return query, fts
 
-    businesses = query.order_by(Business.id.desc()).all()
+def business_page(search_query='', category_filter='', cursor=None, limit=None, options=()):
+    """
+    Una página del listado. Con búsqueda FTS5 se ordena por relevancia y el
+    cursor es (score, id); si no, por id descendente y el cursor es el id.
+    Devuelve (negocios, cursor_siguiente o None). Lanza InvalidCursor.
+
+    Limitación: el score de bm25() depende de todo business_fts (número de
+    documentos, largo promedio, frecuencia de cada término). Si un negocio se
+    crea, edita o borra entre una página y la siguiente, los scores cambian y
+    esa búsqueda puede repetir o saltarse negocios. El listado sin búsqueda
+    (por id) no tiene este problema.
+    """
+    limit = min(limit or app.config['BUSINESS_PAGE_SIZE'], BUSINESS_PAGE_MAX)
+    query, fts = filtered_businesses(search_query, category_filter)
+    try:
+        if fts is not None:
+            query = query.with_entities(Business, fts.c.score)
+            if cursor:
+                after = decode_cursor(cursor, ('score', 'id'))
+                query = query.filter(db.tuple_(fts.c.score, Business.id) >
+                                     db.tuple_(float(after['score']), int(after['id'])))
+            query = query.order_by(fts.c.score, Business.id)
+        else:
+            if cursor:
+                query = query.filter(Business.id < int(decode_cursor(cursor, ('id',))['id']))
+            query = query.order_by(Business.id.desc())
+    except (TypeError, ValueError) as e:
+        raise InvalidCursor(str(e)) from None
+
+    rows = query.options(*options).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if fts is not None:
+        businesses = [business for business, _score in rows]
+        next_cursor = encode_cursor({'score': rows[-1][1], 'id': rows[-1][0].id}) if has_more else None
+    else:
+        businesses = rows
+        next_cursor = encode_cursor({'id': rows[-1].id}) if has_more else None
+    return businesses, next_cursor
+
+@app.route('/', strict_slashes=False)
+def home():
+    search_query = request.args.get('search', '').strip()
+    category_filter = request.args.get('category', '').strip()
+    cursor = request.args.get('cursor') or None
+
+    try:
+        businesses, next_cursor = business_page(search_query, category_filter, cursor)
+    except InvalidCursor:
+        cursor = None
+        businesses, next_cursor = business_page(search_query, category_filter)
+
+    # Sin resultados exactos: negocios con nombres (o productos) parecidos, en una sola página
+    approximate = False
+    if search_query and not businesses and not cursor:
+        ranking = {business_id: rank for rank, business_id in
+                   enumerate(fuzzy_business_ids(search_query, app.config['BUSINESS_PAGE_SIZE']))}
+        if ranking:
+            query = Business.query.filter(Business.id.in_(list(ranking)), Business.is_active == True)
+            if category_filter and category_filter != 'Todas las categorías':
+                query = query.filter(Business.category == category_filter)
+            businesses = sorted(query.all(), key=lambda b: ranking[b.id])
+            approximate = bool(businesses)
+
+    # "Cargar más": solo las tarjetas; el cursor siguiente va en una cabecera
+    if request.args.get('partial'):
+        response = app.make_response(render_template('_business_cards.html', businesses=businesses))
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
+
+    total_results = None
+    if approximate:
+        total_results = len(businesses)
+    elif search_query or category_filter:
+        total_results = filtered_businesses(search_query, category_filter)[0].order_by(None).count()
     
     categories = ["Gastronomía", "Moda y Ropa", "Servicios Profesionales", 
                   "Belleza y Cuidado Personal", "Hogar y Decoración", 
@@ -393,65 +1092,197 @@ def home():
     return render_template('index.html', businesses=businesses, 
                          categories=categories, 
                          search_query=search_query,
-                         category_filter=category_filter)
+                         category_filter=category_filter,
+                         next_cursor=next_cursor,
+                         total_results=total_results,
+                         approximate=approximate)
+
+# Campos que puede pedir /api/businesses?fields=... (columnas a cargar, serializador)
+BUSINESS_API_FIELDS = {
+    'id': ((), lambda b: b.id),
+    'name': ((Business.name,), lambda b: b.name),
+    'description': ((Business.description,), lambda b: b.description),
+    'category': ((Business.category,), lambda b: b.category),
+    'location': ((Business.location,), lambda b: b.location),
+    'phone': ((Business.phone,), lambda b: b.phone),
+    'whatsapp': ((Business.whatsapp,), lambda b: b.whatsapp),
+    'latitude': ((Business.latitude,), lambda b: b.latitude),
+    'longitude': ((Business.longitude,), lambda b: b.longitude),
+    'logo_url': ((Business.logo,), lambda b: url_for('static', filename='uploads/' + b.logo) if b.logo else None),
+    'rating': ((), lambda b: b.rating.to_dict() if b.rating else EMPTY_RATING),
+    'profile_url': ((), lambda b: url_for('profile', id=b.id)),
+}
+BUSINESS_API_DEFAULT_FIELDS = ('id', 'name', 'category', 'location', 'logo_url', 'rating')
+
+def business_api_fields():
+    """
+    Lee ?fields= y devuelve (campos, opciones de carga, respuesta_de_error).
+    Las opciones cargan solo las columnas (y la relación rating) que se van a devolver.
+    """
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()] or list(BUSINESS_API_DEFAULT_FIELDS)
+    unknown = [f for f in fields if f not in BUSINESS_API_FIELDS]
+    if unknown:
+        return None, None, (jsonify({"error": f"Campos desconocidos: {', '.join(unknown)}",
+                                     "fields": list(BUSINESS_API_FIELDS)}), 400)
+    columns = [column for f in fields for column in BUSINESS_API_FIELDS[f][0]]
+    options = [load_only(Business.id, *columns)]
+    if 'rating' not in fields:
+        options.append(lazyload(Business.rating))
+    return fields, options, None
+
+def parse_location(lat, lng):
+    """(lat, lng) como floats dentro de rango; ValueError si faltan o no son válidos."""
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        raise ValueError("lat y lng deben ser números") from None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError("lat debe estar entre -90 y 90 y lng entre -180 y 180")
+    return lat, lng
+
+@app.route('/api/businesses', methods=['GET'], strict_slashes=False)
+def api_businesses():
+    """
+    Listado paginado de negocios activos (mismos filtros y orden que la portada).
+    Parámetros: search, category, cursor, limit (máx. 100) y fields (lista separada por comas).
+    Con search el orden es por relevancia y, si los negocios cambian mientras se
+    pagina, una página puede repetir u omitir resultados (ver business_page).
+    """
+    fields, options, error = business_api_fields()
+    if error:
+        return error
+    try:
+        limit = int(request.args.get('limit', app.config['BUSINESS_PAGE_SIZE']))
+    except ValueError:
+        return jsonify({"error": "limit debe ser un número"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit debe ser mayor que cero"}), 400
+
+    try:
+        businesses, next_cursor = business_page(
+            request.args.get('search', '').strip(), request.args.get('category', '').strip(),
+            request.args.get('cursor') or None, limit, options)
+    except InvalidCursor:
+        return jsonify({"error": "Cursor inválido"}), 400
+
+    return jsonify({
+        "businesses": [{f: BUSINESS_API_FIELDS[f][1](b) for f in fields} for b in businesses],
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None,
+    })
+
+@app.route('/api/businesses/nearby', methods=['GET'], strict_slashes=False)
+def api_businesses_nearby():
+    """
+    Negocios activos cerca de un punto, el más cercano primero, con `distance_km`.
+    Parámetros: lat y lng (obligatorios), k (cuántos, máx. 100), radius_km
+    (opcional: solo dentro de ese radio) y fields como /api/businesses.
+    """
+    if not GEO_ENABLED:
+        return jsonify({"error": "Búsqueda por cercanía no disponible"}), 503
+    try:
+        lat, lng = parse_location(request.args.get('lat'), request.args.get('lng'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    fields, options, error = business_api_fields()
+    if error:
+        return error
+    try:
+        k = min(int(request.args.get('k', app.config['BUSINESS_PAGE_SIZE'])), BUSINESS_PAGE_MAX)
+        radius_km = request.args.get('radius_km')
+        radius_km = float(radius_km) if radius_km else None
+    except ValueError:
+        return jsonify({"error": "k y radius_km deben ser números"}), 400
+    if k < 1 or (radius_km is not None and not radius_km > 0):
+        return jsonify({"error": "k y radius_km deben ser mayores que cero"}), 400
+
+    nearby = geo_index.nearest(db.session, lat, lng, k, max_radius_km=radius_km)
+    businesses = {b.id: b for b in Business.query.filter(Business.id.in_([i for i, _ in nearby])).options(*options)}
+    return jsonify({
+        "businesses": [{**{f: BUSINESS_API_FIELDS[f][1](businesses[i]) for f in fields},
+                        "distance_km": round(distance, 3)}
+                       for i, distance in nearby if i in businesses],
+        "count": len(nearby),
+    })
+
+@app.route('/api/businesses/<int:business_id>/similar', methods=['GET'], strict_slashes=False)
+def api_similar_businesses(business_id):
+    """
+    Negocios parecidos a uno dado según quienes los visitan y guardan como favoritos,
+    el más parecido primero, con `score` (similitud coseno, 0-1).
+    Parámetros: limit (máx. RECOMMEND_NEIGHBORS) y fields como /api/businesses.
+    """
+    if not db.session.query(Business.id).filter_by(id=business_id).first():
+        return jsonify({"error": "Negocio no encontrado"}), 404
+    fields, options, error = business_api_fields()
+    if error:
+        return error
+    try:
+        limit = min(int(request.args.get('limit', app.config['RECOMMEND_NEIGHBORS'])), app.config['RECOMMEND_NEIGHBORS'])
+    except ValueError:
+        return jsonify({"error": "limit debe ser un número"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit debe ser mayor que cero"}), 400
+
+    similar = similar_businesses(business_id, limit, options)
+    return jsonify({
+        "business_id": business_id,
+        "similar": [{**{f: BUSINESS_API_FIELDS[f][1](b) for f in fields}, "score": round(score, 3)}
+                    for b, score in similar],
+        "count": len(similar),
+    })
 
 @app.route('/profile/<int:id>', strict_slashes=False)
 def profile(id):
     business = Business.query.get_or_404(id)
-    products = Product.query.filter_by(business_id=id).all()
-    reviews_query = Review.query.filter_by(business_id=id).order_by(Review.created_at.desc()).all()
-    
-    avg_rating = db.session.query(db.func.avg(Review.rating)).filter_by(business_id=id).scalar() or 0
     
     is_owner = False
     is_favorited = False
     reservations_for_owner = []
     
-    # Si el usuario es el dueño, cargar las reservas de su negocio
-    if 'user_id' in session and User.query.get(session['user_id']) and User.query.get(session['user_id']).business_id == id:
+    user = User.query.get(session['user_id']) if 'user_id' in session else None
+    
+    # Si el usuario es el dueño, cargar las reservas de su negocio (con cliente y producto en la misma consulta)
+    if user and user.business_id == id:
         is_owner = True
-        reservations_for_owner = db.session.query(Reservation).join(Product).filter(Product.business_id == id).order_by(Reservation.created_at.desc()).all()
+        reservations_for_owner = (db.session.query(Reservation).join(Product)
+                                  .filter(Product.business_id == id)
+                                  .options(contains_eager(Reservation.product), joinedload(Reservation.user))
+                                  .order_by(Reservation.created_at.desc()).all())
     
     # Lógica de conteo de visitas y estado de favorito/dueño
-    if 'user_id' in session:
-        user = User.query.get(session['user_id'])
-        if user:
-            # Esta comprobación ya se hace arriba, pero la mantenemos por si el flujo cambia
-            if not is_owner and user.business_id == id:
-                 is_owner = True
-                 # Recargar reservas si se detecta que es dueño aquí
-                 if not reservations_for_owner:
-                    reservations_for_owner = db.session.query(Reservation).join(Product).filter(Product.business_id == id).order_by(Reservation.created_at.desc()).all()
+    if user and is_favorite(user.id, id):
+        is_favorited = True
+    
+    # Contar la visita (usuarios y anónimos) si no es el dueño; se escribe en segundo plano
+    if not is_owner:
+        ENGAGEMENT_EVENTS.put(('view', id, visitor_key(), user.id if user else None, date.today().isoformat()))
 
-            
-            if business in user.favorite_businesses:
-                is_favorited = True
-            
-            # Contar la visita solo si el usuario no es el dueño y no ha visitado antes
-            if not is_owner and business not in user.viewed_businesses:
-                user.viewed_businesses.append(business)
-                db.session.commit()
+    products = Product.query.filter_by(business_id=id).all()
+    reviews_query = Review.query.filter_by(business_id=id).order_by(Review.created_at.desc()).all()
+    rating = business.rating.to_dict() if business.rating else EMPTY_RATING
 
-    view_count = len(business.viewed_by)
-    return render_template('profile.html', business=business, products=products,
+    view_count, windows = visitor_counts(id)
+    visitors = {f'{days}d': count for days, count in windows.items()}
+    similar = [b for b, _score in similar_businesses(id, 4, options=[load_only(
+        Business.id, Business.name, Business.category, Business.location, Business.logo)])]
+    return render_template('profile.html', business=business, products=products, similar=similar,
                          reviews=[r.to_dict() for r in reviews_query],
-                         avg_rating=round(avg_rating, 1), view_count=view_count,
+                         avg_rating=rating['avg_rating'], rating=rating,
+                         view_count=view_count, visitors=visitors,
                          is_owner=is_owner, reservations=reservations_for_owner,
                          is_favorited=is_favorited)
 
 @app.route('/api/business/<int:business_id>/favorite', methods=['POST'], strict_slashes=False)
 @login_required
 def toggle_favorite(business_id):
-    user = User.query.get(session['user_id'])
-    business = Business.query.get_or_404(business_id)
-    if business in user.favorite_businesses:
-        user.favorite_businesses.remove(business)
-        db.session.commit()
-        return jsonify({"success": True, "favorited": False})
-    else:
-        user.favorite_businesses.append(business)
-        db.session.commit()
-        return jsonify({"success": True, "favorited": True})
+    user_id = session['user_id']
+    Business.query.get_or_404(business_id)
+    with _pending_favorites_lock:
+        favorited = not is_favorite(user_id, business_id)
+        PENDING_FAVORITES[(user_id, business_id)] = favorited
+    ENGAGEMENT_EVENTS.put(('favorite', user_id, business_id, favorited))
+    return jsonify({"success": True, "favorited": favorited})
 
 @app.route('/profile/<int:id>/update_logo', methods=['POST'], strict_slashes=False)
 @owner_required
@@ -463,13 +1294,8 @@ def update_logo(id):
         return redirect(url_for('profile', id=id))
 
     try:
-        # Borrar logo antiguo si existe
-        if business.logo:
-            old_logo_path = images.path(business.logo)
-            if os.path.exists(old_logo_path):
-                os.remove(old_logo_path)
-        
-        business.logo = images.save(logo)
+        # El logo anterior pierde una referencia; `flask gc-uploads` lo borra si nadie más lo usa
+        business.logo = UPLOAD_STORE.save(logo)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -494,6 +1320,12 @@ def edit_business(id):
         # Aquí podrías usar `flash` para un mejor feedback, pero por ahora redirigimos.
         return redirect(url_for('profile', id=id))
 
+    # Las sugerencias de IA dependen del nombre y la descripción: invalidar la caché si cambian
+    if name != business.name or description != business.description:
+        AISuggestionCache.query.filter_by(business_id=id).delete()
+
+    # La descripción del negocio es parte del texto de todos sus productos en la búsqueda por significado
+    description_changed = business.description != description
     business.name = name
     business.description = description
     business.category = category
@@ -503,12 +1335,32 @@ def edit_business(id):
     business.latitude = float(latitude) if latitude else None
     business.longitude = float(longitude) if longitude else None
     db.session.commit()
+    PRODUCT_INDEX.rename_business(business.id, business.name)
+    FUZZY_INDEX.upsert('business', business.id, business.name)
+    if description_changed:
+        SEMANTIC_INDEX.invalidate()
     return redirect(url_for('profile', id=id))
 
+def ai_suggestions_cache_key(business):
+    """Hash de todo lo que determina el prompt: modelo, nombre, descripción y ubicación."""
+    parts = (GEMINI_MODEL_NAME, business.name, business.description, business.location or "")
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
 @app.route('/api/ai/suggestions/<int:id>', methods=['GET'], strict_slashes=False)
 def ai_suggestions(id):
     business = Business.query.get_or_404(id)
-    if not GEMINI_MODEL:
+    cache_key = ai_suggestions_cache_key(business)
+    cached = AISuggestionCache.query.filter(
+        AISuggestionCache.cache_key == cache_key,
+        AISuggestionCache.created_at >= db.func.datetime('now', f"-{int(app.config['AI_SUGGESTIONS_TTL'])} seconds")
+    ).first()
+    if cached:
+        CACHE_STATS['ai_suggestions']['hits'] += 1
+        return jsonify({"business_id": business.id, "suggestions": cached.suggestions, "cached": True})
+    CACHE_STATS['ai_suggestions']['misses'] += 1
+
+    model = get_gemini_model()
+    if not model:
         return jsonify({"error": "Gemini no configurado. Define GEMINI_API_KEY en .env"}), 500
 
     prompt = (
@@ -518,225 +1370,291 @@ def ai_suggestions(id):
         "Formato:\n- Título breve\n- 2 a 3 bullets con acciones concretas (menciona redes locales, hashtags, alianzas, ferias/mercados cruceños)."
     )
     try:
-        resp = GEMINI_MODEL.generate_content(prompt)
+        resp = model.generate_content(prompt)
         text = resp.text.strip() if hasattr(resp, "text") else "No hay respuesta."
-        return jsonify({"business_id": business.id, "suggestions": text})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    # Guardar en caché (reemplaza respuestas anteriores de este negocio). Dos peticiones
+    # simultáneas pueden llegar aquí con la misma clave: la segunda actualiza la fila.
+    try:
+        AISuggestionCache.query.filter(AISuggestionCache.business_id == business.id,
+                                       AISuggestionCache.cache_key != cache_key).delete(synchronize_session=False)
+        db.session.execute(
+            sqlite_insert(AISuggestionCache)
+            .values(cache_key=cache_key, business_id=business.id, model=GEMINI_MODEL_NAME, suggestions=text)
+            .on_conflict_do_update(index_elements=[AISuggestionCache.cache_key],
+                                   set_={'model': GEMINI_MODEL_NAME, 'suggestions': text,
+                                         'created_at': db.func.now()})
+        )
+        db.session.commit()
+    except Exception as e:
+        # La respuesta ya está generada: devolverla aunque no se haya podido guardar
+        db.session.rollback()
+        print('Advertencia: no se pudo guardar la sugerencia de IA en caché:', e)
+    return jsonify({"business_id": business.id, "suggestions": text, "cached": False})
+
+BOLD_RE = re.compile(r'\*\*(.*?)\*\*')
+
 def format_gemini_response(text):
     """Convierte Markdown simple (negritas) a HTML."""
-    import re
-    text = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', text)
+    text = BOLD_RE.sub(r'<strong>\1</strong>', text)
     return text
 
-# --- NUEVA VARIABLE GLOBAL (fuera de la función)
-last_search_query = ""
+class BoldStreamFormatter:
+    """
+    Aplica format_gemini_response a un texto que llega por fragmentos.
 
-@app.route('/api/chat', methods=['POST'], strict_slashes=False)
-def chat():
-    global last_search_query
-    
-    if not GEMINI_MODEL:
-        return jsonify({"error": "Gemini no configurado. Define GEMINI_API_KEY en .env"}), 500
+    Como `.` no cruza saltos de línea, cada línea se formatea por separado. Dentro de la
+    línea en curso se emite todo hasta un `**` todavía sin cerrar (o un `*` final que
+    podría ser la mitad de uno); eso se retiene hasta que llega el cierre o la línea
+    termina. La concatenación de lo emitido es igual a format_gemini_response(texto).
+    """
 
-    data = request.get_json(silent=True) or {}
-    user_msg = (data.get('message') or "").strip()
-    if not user_msg:
-        return jsonify({"error": "Falta 'message'"}), 400
+    def __init__(self):
+        self.line = ''
+        self.emitted = 0  # Longitud ya emitida del HTML de la línea en curso
+
+    def feed(self, text):
+        out = []
+        *complete, self.line = (self.line + text).split('\n')
+        if complete:
+            # La primera línea completa es la que estaba en curso
+            first = format_gemini_response(complete[0])
+            out.append(first[self.emitted:])
+            out.extend('\n' + format_gemini_response(line) for line in complete[1:])
+            out.append('\n')
+            self.emitted = 0
+        safe = format_gemini_response(self.line[:self._safe_length()])
+        out.append(safe[self.emitted:])
+        self.emitted = len(safe)
+        return ''.join(out)
+
+    def finish(self):
+        html = format_gemini_response(self.line)[self.emitted:]
+        self.line, self.emitted = '', 0
+        return html
+
+    def _safe_length(self):
+        last_end = 0
+        for match in BOLD_RE.finditer(self.line):
+            last_end = match.end()
+        pending = self.line.find('**', last_end)
+        if pending >= 0:
+            return pending
+        if len(self.line) > last_end and self.line.endswith('*'):
+            return len(self.line) - 1
+        return len(self.line)
+
+# Palabras clave de intención y categorías del chat, compiladas una vez (ver chat_intents.py)
+CHAT_MATCHER = ChatMatcher.from_file()
+
+# Índice de productos del chat (uno por worker, se construye en la primera búsqueda
+# y se reconstruye en segundo plano, ver product_index.py)
+PRODUCT_INDEX = ProductSearchIndex(app_context=app.app_context)
+
+def get_product_index():
+    PRODUCT_INDEX.ensure_built(lambda: db.session.query(
+        Product.id, Product.name, Product.description, Product.stock,
+        Product.business_id, Business.name
+    ).outerjoin(Business, Product.business_id == Business.id).all())
+    return PRODUCT_INDEX
+
+# Búsqueda con errores de tipeo ("pisa" -> "pizza"), último recurso del chat y de la portada
+app.config.setdefault('FUZZY_MIN_SCORE', 75)       # similitud mínima de fuzz.ratio (0-100)
+app.config.setdefault('FUZZY_MAX_CANDIDATES', 50)  # nombres puntuados por consulta
+app.config.setdefault('FUZZY_MAX_MS', 30)          # tiempo máximo por consulta
+FUZZY_INDEX = None  # FuzzyNameIndex, se crea en init_app()
+
+def get_fuzzy_index():
+    def load_rows():
+        products = (db.session.query(Product.id, Product.name).join(Business)
+                    .filter(Business.is_active == True))
+        businesses = db.session.query(Business.id, Business.name).filter(Business.is_active == True)
+        return ([('product', id, name) for id, name in products] +
+                [('business', id, name) for id, name in businesses])
+    FUZZY_INDEX.ensure_built(load_rows)
+    return FUZZY_INDEX
+
+# Búsqueda por significado ("algo para el dolor de espalda" -> masaje, reiki), ver semantic_index.py:
+# en una búsqueda sin coincidencias literales y, con un umbral más estricto, en mensajes sin
+# palabra de búsqueda ni de consejo
+app.config.setdefault('SEMANTIC_INDEX_DIR', os.path.join(BASEDIR, '.semantic_index'))
+app.config.setdefault('SEMANTIC_MAX_AGE', 300)              # segundos hasta reconstruir la matriz
+app.config.setdefault('SEMANTIC_MIN_SCORE', 0.08)           # similitud mínima en una búsqueda del chat
+app.config.setdefault('SEMANTIC_MIN_SCORE_IMPLICIT', 0.16)  # ...en un mensaje sin palabra de búsqueda
+SEMANTIC_INDEX = None  # SemanticProductIndex, se crea en init_app()
+
+def get_semantic_index():
+    SEMANTIC_INDEX.ensure_built(lambda: db.session.query(
+        Product.id, Product.name, Product.description, Business.description
+    ).outerjoin(Business, Product.business_id == Business.id).all())
+    return SEMANTIC_INDEX
+
+def semantic_chat_products(search_term, min_score):
+    """Productos con stock de negocios activos cuyo texto trata de lo mismo que el término, para el chat."""
+    matches = get_semantic_index().search(search_term, limit=8, min_score=min_score)
+    if not matches:
+        return []
+    scores = dict(matches)
+    products = (Product.query.join(Business)
+                .filter(Product.id.in_(list(scores)), Product.stock > 0, Business.is_active == True)
+                .options(contains_eager(Product.business))
+                .all())
+    found_products = [{'product': p, 'business': p.business, 'score': scores[p.id]} for p in products]
+    found_products.sort(key=lambda x: (-x['score'], x['product'].id))
+    return found_products
+
+def fuzzy_chat_results(search_term):
+    """Productos con stock (o, si no hay, negocios) con nombre parecido al término, para el chat."""
+    matches = get_fuzzy_index().search(search_term, kind='product', limit=8)
+    if matches:
+        scores = {product_id: score for _kind, product_id, score in matches}
+        products = (Product.query.join(Business)
+                    .filter(Product.id.in_(list(scores)), Product.stock > 0, Business.is_active == True)
+                    .options(contains_eager(Product.business))
+                    .all())
+        found_products = [{'product': p, 'business': p.business, 'score': scores[p.id]} for p in products]
+        found_products.sort(key=lambda x: (-x['score'], x['product'].id))
+        if found_products:
+            return found_products, []
+    matches = get_fuzzy_index().search(search_term, kind='business', limit=3)
+    ranking = {business_id: rank for rank, (_kind, business_id, _score) in enumerate(matches)}
+    businesses = Business.query.filter(Business.id.in_(list(ranking)), Business.is_active == True).all()
+    return [], sorted(businesses, key=lambda b: ranking[b.id])
+
+def fuzzy_business_ids(search_query, limit):
+    """Ids de negocios cuyo nombre o el de alguno de sus productos se parece a la búsqueda, mejor primero."""
+    matches = get_fuzzy_index().search(search_query, limit=limit)
+    product_ids = [key_id for kind, key_id, _score in matches if kind == 'product']
+    owners = dict(db.session.query(Product.id, Product.business_id).filter(Product.id.in_(product_ids))) if product_ids else {}
+    business_ids = []
+    for kind, key_id, _score in matches:
+        business_id = key_id if kind == 'business' else owners.get(key_id)
+        if business_id is not None and business_id not in business_ids:
+            business_ids.append(business_id)
+    return business_ids
+
+# Negocios de una categoría que se traen para ordenarlos por cercanía (se muestran 5)
+CHAT_NEARBY_POOL = 50
+
+def sort_by_distance(found_products, found_businesses, location):
+    """
+    Ordena los resultados del chat por distancia a `location` (lat, lng), los negocios
+    sin coordenadas al final y, a igual distancia, en el orden de relevancia.
+    De los productos solo se conservan los que puntúan al menos la mitad del mejor,
+    para que uno cercano que apenas coincide no tape a los buenos.
+    Devuelve (productos, negocios, {business_id: km o None}).
+    """
+    distances = {}
+
+    def distance(business):
+        if business.id not in distances:
+            has_point = business.latitude is not None and business.longitude is not None
+            distances[business.id] = (geo_index.haversine_km(location[0], location[1],
+                                                             business.latitude, business.longitude)
+                                      if has_point else None)
+        km = distances[business.id]
+        return (km is None, km or 0)
+
+    if found_products:
+        best = found_products[0]['score']
+        found_products = [item for item in found_products if item['score'] >= best / 2]
+    found_products = sorted(found_products, key=lambda item: distance(item['business']))
+    found_businesses = sorted(found_businesses, key=distance)
+    return found_products, found_businesses, distances
+
+def chat_session_id():
+    """Id de la conversación del visitante, guardado en su cookie de sesión."""
+    if 'chat_sid' not in session:
+        session['chat_sid'] = secrets.token_urlsafe(16)
+    return session['chat_sid']
+
+def remember_chat_turn(session_id, state, user_msg, reply):
+    """Guarda el mensaje y la respuesta (en texto plano) en el estado de la conversación."""
+    max_turns = CHAT_STATES.max_turns
+    record_turn(state, 'user', user_msg, max_turns)
+    record_turn(state, 'bot', re.sub(r'<[^>]+>|\s+', ' ', reply).strip(), max_turns)
+    CHAT_STATES.save(session_id, state)
+
+def plan_chat_reply(user_msg, state, location=None):
+    """
+    Decide cómo responder un mensaje del chat. `state` es el estado de la
+    conversación de este visitante (ver chat_state.py) y se actualiza aquí.
+    Con `location` (lat, lng) del cliente, los resultados de búsqueda más cercanos van primero.
+    - Modo búsqueda: devuelve {'reply': html} con la respuesta completa (no usa Gemini).
+    - Modos asistente/general: devuelve {'mode', 'prompt', 'default', 'suffix', 'fallback'}
+      para que /api/chat o /api/chat/stream llamen a Gemini.
+    """
+    last_search_query = state['last_query']
 
-    # --- DETECCIÓN DE MODO: BÚSQUEDA vs ASISTENTE ---
+    # --- DETECCIÓN DE MODO: BÚSQUEDA vs ASISTENTE (palabras clave en chat_intents.json) ---
     user_msg_lower = user_msg.lower()
-    
-    # Palabras clave para MODO BÚSQUEDA (productos/servicios)
-    search_keywords = ['busco', 'quiero', 'necesito', 'tienes', 'vendes', 'comprar', 'precio de', 
-                      'cuanto cuesta', 'hay', 'donde encontrar', 'encontrar', 'dónde', 'consigo', 
-                      'recomiendame', 'recomiéndame', 'producto', 'servicio', 'venta']
-    
-    # Palabras clave para MODO ASISTENTE (consejos/ayuda)
-    assistant_keywords = ['consejo', 'consejos', 'ayuda', 'cómo', 'como', 'qué', 'que', 'por qué', 
-                         'porque', 'mejora', 'mejorar', 'sugerencia', 'sugerencias', 'tips', 'tip', 
-                         'recomendación', 'recomendaciones', 'idea', 'ideas', 'estrategia', 
-                         'qué hacer', 'que hacer', 'cómo mejorar', 'como mejorar', 'ayudame', 
-                         'ayúdame', 'orientación', 'guía', 'advice', 'help']
-    
-    # Detectar si es una búsqueda de producto
-    is_product_search = any(keyword in user_msg_lower for keyword in search_keywords)
-    
-    # Detectar si es una consulta de asistencia
-    is_assistant_query = any(keyword in user_msg_lower for keyword in assistant_keywords)
-    
-    # Detectar si es un "sí" a una búsqueda anterior
-    is_affirmative = user_msg_lower in ['si', 'sí', 'sii', 'claro', 'dale', 'ok', 'sí quiero', 
-                                       'por supuesto', 'adelante', 'yes', 'y']
+    intent = CHAT_MATCHER.match(user_msg)
+    is_product_search = intent['search']
+    is_assistant_query = intent['assistant']
+    # "sí" a una búsqueda anterior
+    is_affirmative = intent['affirmative']
+
+    # Sin palabra de búsqueda ni de consejo pero hablando de algo que se vende ("algo para el
+    # dolor de espalda"): solo productos muy parecidos, con el umbral estricto
+    implicit_products = []
+    if not (is_product_search or is_assistant_query or is_affirmative):
+        implicit_products = semantic_chat_products(user_msg, app.config['SEMANTIC_MIN_SCORE_IMPLICIT'])
 
     # --- MODO BÚSQUEDA (Mantener lógica actual) ---
-    if is_product_search or (is_affirmative and last_search_query):
+    if is_product_search or implicit_products or (is_affirmative and last_search_query):
         # MANEJO DE "SÍ" PARA REINTENTAR BÚSQUEDA
         if is_affirmative and last_search_query:
             search_term = last_search_query
+            possible_category = CHAT_MATCHER.category(search_term)
         elif is_affirmative and not last_search_query:
-            return jsonify({"reply": "¡Perfecto! ¿Qué producto o servicio estás buscando exactamente? 😊"})
+            return {'reply': "¡Perfecto! ¿Qué producto o servicio estás buscando exactamente? 😊"}
+        elif implicit_products:
+            search_term = user_msg
+            possible_category = None
         else:
-            # EXTRAER TÉRMINO DE BÚSQUEDA
-            search_terms = user_msg_lower
-            
-            # Primero intentar extraer después de palabras clave
-            extracted_term = ""
-            for keyword in search_keywords:
-                if keyword in user_msg_lower:
-                    parts = user_msg_lower.split(keyword, 1)
-                    if len(parts) > 1:
-                        extracted_term = parts[1].strip()
-                        break
-            
-            if not extracted_term:
-                extracted_term = user_msg
-            
-            # Limpiar el término
-            stop_words = ['una', 'un', 'de', 'del', 'la', 'el', 'en', 'con', 'para', 'por', 
-                         'a', 'y', 'o', 'algun', 'alguna', 'algunos', 'por favor', 'favor', 'gracias']
-            words = extracted_term.split()
-            cleaned_words = [word for word in words if word not in stop_words and len(word) > 1]
-            search_term = ' '.join(cleaned_words).strip()
-            
-            if not search_term:
-                search_term = user_msg
+            # Término después de la palabra clave de búsqueda, sin palabras vacías
+            search_term = intent['term']
+            possible_category = intent['category']
 
         # GUARDAR ÚLTIMA BÚSQUEDA
         if search_term and not is_affirmative:
-            last_search_query = search_term
+            state['last_query'] = search_term
 
         # BÚSQUEDA EN BASE DE DATOS (lógica existente)
-        found_products = []
+        found_products = implicit_products
         found_businesses = []
         
-        if len(search_term) >= 2:
+        if len(search_term) >= 2 and not implicit_products:
             # PRIMERO: Búsqueda PRECISA en productos
             search_words = search_term.lower().split()
             
-            # Buscar productos que coincidan con ALGUNA palabra del término de búsqueda
-            all_products = Product.query.filter(Product.stock > 0).all()
-            
-            for product in all_products:
-                product_name_lower = product.name.lower()
-                product_desc_lower = (product.description or "").lower()
-                business_name_lower = product.business.name.lower() if product.business else ""
-                
-                # Calcular puntuación de coincidencia
-                score = 0
-                
-                # Coincidencia exacta en nombre (máxima prioridad)
-                if search_term.lower() in product_name_lower:
-                    score += 10
-                # Coincidencia con todas las palabras en nombre
-                elif all(word in product_name_lower for word in search_words if len(word) > 2):
-                    score += 8
-                # Coincidencia con alguna palabra en nombre
-                elif any(word in product_name_lower for word in search_words if len(word) > 2):
-                    score += 5
-                # Coincidencia en descripción
-                if search_term.lower() in product_desc_lower:
-                    score += 3
-                # Coincidencia con palabras en descripción
-                elif any(word in product_desc_lower for word in search_words if len(word) > 2):
-                    score += 2
-                # Coincidencia en nombre del negocio
-                if search_term.lower() in business_name_lower:
-                    score += 2
-                
-                # Solo incluir productos con puntuación significativa
-                if score >= 3:
-                    business = Business.query.get(product.business_id)
-                    if business and business.is_active:
-                        found_products.append({
-                            'product': product,
-                            'business': business,
-                            'score': score
-                        })
+            # Candidatos del índice invertido, ya puntuados y ordenados (mejores primero)
+            ranked = get_product_index().search(search_term)
+            scores = dict(ranked)
             
-            # Ordenar por puntuación (mejores resultados primero)
-            found_products.sort(key=lambda x: x['score'], reverse=True)
+            if ranked:
+                # Una sola consulta para los productos y sus negocios activos
+                products = (Product.query.join(Business)
+                            .filter(Product.id.in_(list(scores)), Product.stock > 0, Business.is_active == True)
+                            .options(contains_eager(Product.business))
+                            .all())
+                found_products = [{'product': p, 'business': p.business, 'score': scores[p.id]} for p in products]
+                found_products.sort(key=lambda x: (-x['score'], x['product'].id))
             
+            # Sin coincidencias literales en una búsqueda explícita: productos que tratan de lo mismo
+            if not found_products and (intent['own_term'] or is_affirmative):
+                found_products = semantic_chat_products(search_term, app.config['SEMANTIC_MIN_SCORE'])
+
             # SEGUNDO: Si no hay productos, buscar negocios por categoría
             if not found_products:
-                # Mapeo expandido de categorías
-                category_map = {
-                    # Tecnología
-                    'laptop': 'Tecnología', 'computadora': 'Tecnología', 'pc': 'Tecnología', 
-                    'ordenador': 'Tecnología', 'portatil': 'Tecnología', 'notebook': 'Tecnología',
-                    'celular': 'Tecnología', 'smartphone': 'Tecnología', 'movil': 'Tecnología', 'teléfono': 'Tecnología',
-                    'tablet': 'Tecnología', 'ipad': 'Tecnología', 'tecnologia': 'Tecnología',
-                    'impresora': 'Tecnología', 'monitor': 'Tecnología', 'teclado': 'Tecnología',
-                    
-                    # Servicios Legales
-                    'abogado': 'Servicios Profesionales', 'abogada': 'Servicios Profesionales',
-                    'divorcio': 'Servicios Profesionales', 'divorciarse': 'Servicios Profesionales',
-                    'legal': 'Servicios Profesionales', 'ley': 'Servicios Profesionales',
-                    'juicio': 'Servicios Profesionales', 'demanda': 'Servicios Profesionales',
-                    'asesor': 'Servicios Profesionales', 'asesoria': 'Servicios Profesionales',
-                    'abogacia': 'Servicios Profesionales', 'derecho': 'Servicios Profesionales',
-                    'abogados': 'Servicios Profesionales',
-                    
-                    # Contabilidad
-                    'contador': 'Servicios Profesionales', 'contadora': 'Servicios Profesionales',
-                    'impuesto': 'Servicios Profesionales', 'tributario': 'Servicios Profesionales',
-                    'declaracion': 'Servicios Profesionales', 'fiscal': 'Servicios Profesionales',
-                    'contabilidad': 'Servicios Profesionales',
-                    
-                    # Comida
-                    'comida': 'Gastronomía', 'restaurante': 'Gastronomía', 'alimento': 'Gastronomía',
-                    'pizza': 'Gastronomía', 'hamburguesa': 'Gastronomía', 'sushi': 'Gastronomía',
-                    'comida rapida': 'Gastronomía', 'almuerzo': 'Gastronomía', 'cena': 'Gastronomía',
-                    'desayuno': 'Gastronomía', 'comida china': 'Gastronomía',
-                    
-                    # Ropa
-                    'ropa': 'Moda y Ropa', 'vestido': 'Moda y Ropa', 'zapato': 'Moda y Ropa',
-                    'camisa': 'Moda y Ropa', 'pantalon': 'Moda y Ropa', 'jeans': 'Moda y Ropa',
-                    'calzado': 'Moda y Ropa', 'moda': 'Moda y Ropa', 'blusa': 'Moda y Ropa',
-                    
-                    # Belleza
-                    'belleza': 'Belleza y Cuidado Personal', 'estetica': 'Belleza y Cuidado Personal', 
-                    'spa': 'Belleza y Cuidado Personal', 'salon': 'Belleza y Cuidado Personal',
-                    'corte': 'Belleza y Cuidado Personal', 'pelo': 'Belleza y Cuidado Personal',
-                    'peluqueria': 'Belleza y Cuidado Personal', 'manicura': 'Belleza y Cuidado Personal',
-                    'foto': 'Belleza y Cuidado Personal', 'fotografia': 'Belleza y Cuidado Personal',
-                    'estudio': 'Belleza y Cuidado Personal',
-                    
-                    # Salud
-                    'salud': 'Salud y Bienestar', 'medico': 'Salud y Bienestar', 'farmacia': 'Salud y Bienestar',
-                    'doctor': 'Salud y Bienestar', 'clinica': 'Salud y Bienestar', 'hospital': 'Salud y Bienestar',
-                    
-                    # Educación
-                    'educacion': 'Educación', 'clase': 'Educación', 'curso': 'Educación',
-                    'profesor': 'Educación', 'tutor': 'Educación', 'enseñanza': 'Educación',
-                    'yoga': 'Educación', 'clases': 'Educación',
-                    
-                    # Servicios Generales
-                    'servicio': 'Servicios Profesionales', 'reparacion': 'Servicios Profesionales', 
-                    'mantenimiento': 'Servicios Profesionales', 'tecnico': 'Servicios Profesionales',
-                    
-                    # Hogar
-                    'hogar': 'Hogar y Decoración', 'mueble': 'Hogar y Decoración', 
-                    'decoracion': 'Hogar y Decoración', 'casa': 'Hogar y Decoración'
-                }
-                
-                # Buscar categoría coincidente
-                possible_category = None
-                for keyword, category in category_map.items():
-                    if any(word == keyword for word in search_words):
-                        possible_category = category
-                        break
-                    elif any(keyword in word for word in search_words):
-                        possible_category = category
-                        break
-                
                 # Buscar negocios por categoría o nombre
                 if possible_category:
                     found_businesses = Business.query.filter(
                         Business.category.ilike(f'%{possible_category}%'),
                         Business.is_active == True
-                    ).limit(5).all()
+                    ).limit(CHAT_NEARBY_POOL if location else 5).all()
                 else:
                     # Búsqueda general en negocios por nombre o descripción
                     business_query = Business.query.filter(Business.is_active == True)
@@ -753,6 +1671,22 @@ def chat():
                         business_query = business_query.filter(db.or_(*or_filters))
                         found_businesses = business_query.limit(3).all()
 
+        # TERCERO: Sin coincidencias exactas, tolerar errores de tipeo ("pisa" -> "pizza")
+        approximate = False
+        if not found_products and not found_businesses and len(search_term) >= 3:
+            found_products, found_businesses = fuzzy_chat_results(search_term)
+            approximate = bool(found_products or found_businesses)
+
+        # Con la ubicación del cliente, los más cercanos primero
+        distances = {}
+        if location:
+            found_products, found_businesses, distances = sort_by_distance(found_products, found_businesses, location)
+            found_businesses = found_businesses[:5]
+
+        def distance_text(business):
+            km = distances.get(business.id)
+            return "" if km is None else f"<br>📏 a {km:.1f} km de ti"
+
         # CONSTRUIR RESPUESTA DE BÚSQUEDA
         response_html = ""
         found_results = False
@@ -789,7 +1723,7 @@ def chat():
                         💰 <strong>Precio: {p.price:.2f} Bs</strong><br>
                         {stock_text}<br>
                         📝 {product_desc}<br>
-                        🏪 <strong>Local:</strong> {b.name}
+                        🏪 <strong>Local:</strong> {b.name}{distance_text(b)}
                     </div>
                     {button}
                 </div>
@@ -824,7 +1758,7 @@ def chat():
                     <div class='detalle' style='margin: 8px 0; color: #555;'>
                         📍 <strong>Ubicación:</strong> {business.location}<br>
                         🏷️ <strong>Categoría:</strong> {business.category}<br>
-                        📝 {business_desc}
+                        📝 {business_desc}{distance_text(business)}
                     </div>
                     {button}
                 </div>
@@ -835,7 +1769,7 @@ def chat():
             if is_affirmative:
                 response_html = f"""
                 <div style='padding: 15px; background: #fff3cd; border: 1px solid #ffeaa7; border-radius: 8px; color: #856404;'>
-                    🤔 No encontré resultados relevantes para '<strong>{last_search_query}</strong>'. 
+                    🤔 No encontré resultados relevantes para '<strong>{state['last_query']}</strong>'. 
                     <br><br>
                     <strong>💡 Sugerencias para mejorar tu búsqueda:</strong>
                     <ul style='margin: 8px 0; padding-left: 20px;'>
@@ -859,9 +1793,16 @@ def chat():
                 </div>
                 """
 
+        if found_products:
+            set_results(state, 'product', [item['product'].id for item in found_products[:4]])
+        else:
+            set_results(state, 'business', [business.id for business in found_businesses])
+
         # RESPUESTA FINAL PARA BÚSQUEDA
         if found_results:
-            if found_products:
+            if approximate:
+                intro = f"🤔 No encontré '{search_term}' tal cual, pero quizás buscabas esto:\n\n"
+            elif found_products:
                 intro = f"¡Perfecto! 🔍 Encontré estos productos de '{search_term}' para ti:\n\n"
             else:
                 intro = f"¡Genial! 🏢 Encontré estos negocios relacionados con '{search_term}':\n\n"
@@ -870,7 +1811,7 @@ def chat():
         else:
             reply = response_html
 
-        return jsonify({"reply": format_gemini_response(reply)})
+        return {'reply': reply}
 
     # --- MODO ASISTENTE (Nuevo para consejos y ayuda) ---
     elif is_assistant_query:
@@ -902,18 +1843,14 @@ def chat():
         Si la pregunta no está relacionada con negocios o emprendimiento, sugiere amablemente cómo puedes ayudar en ese ámbito.
         """
 
-        try:
-            resp = GEMINI_MODEL.generate_content(assistant_prompt)
-            reply = resp.text.strip() if hasattr(resp, "text") else "¡Claro! Estoy aquí para ayudarte con tu negocio. ¿En qué aspecto específico necesitas consejos? 💼"
-            
+        return {
+            'mode': 'asistente',
+            'prompt': assistant_prompt,
+            'default': "¡Claro! Estoy aquí para ayudarte con tu negocio. ¿En qué aspecto específico necesitas consejos? 💼",
             # Añadir mensaje de contexto sobre búsqueda
-            reply += "\n\n💡 *¿Buscas productos o servicios específicos? Solo dime 'busco [lo que necesites]' y te ayudo a encontrar.*"
-            
-        except Exception as e:
-            print(f"Error con Gemini en modo asistente: {e}")
-            reply = "¡Claro! Estoy aquí para ayudarte con consejos para tu negocio. ¿En qué área necesitas ayuda: marketing, ventas, redes sociales o gestión? 💼"
-
-        return jsonify({"reply": format_gemini_response(reply)})
+            'suffix': "\n\n💡 *¿Buscas productos o servicios específicos? Solo dime 'busco [lo que necesites]' y te ayudo a encontrar.*",
+            'fallback': "¡Claro! Estoy aquí para ayudarte con consejos para tu negocio. ¿En qué área necesitas ayuda: marketing, ventas, redes sociales o gestión? 💼"
+        }
 
     # --- MODO CONVERSACIÓN GENERAL (por defecto) ---
     else:
@@ -945,21 +1882,139 @@ def chat():
         Si no estás seguro, ofrece ayudar a buscar productos o servicios.
         """
 
+        # Añadir sugerencia de búsqueda si es relevante
+        if any(word in user_msg_lower for word in ['hola', 'hello', 'hi', 'buenas']):
+            suffix = ""
+        else:
+            suffix = "\n\n🔍 *¿Buscas algo específico? Puedo ayudarte a encontrar productos y servicios locales. Solo dime 'busco [lo que necesites]'.*"
+
+        return {
+            'mode': 'general',
+            'prompt': general_prompt,
+            'default': "¡Hola! Soy GuIA, tu asistente de Comuni IA. ¿En qué puedo ayudarte hoy? 😊",
+            'suffix': suffix,
+            'fallback': "¡Hola! Soy Gu-IA de Comuni IA. Puedo ayudarte a encontrar productos locales o darte consejos para tu negocio. ¿En qué te puedo ayudar? 🛍️"
+        }
+
+
+def read_chat_message():
+    """Valida el cuerpo de /api/chat y /api/chat/stream. Devuelve (mensaje, respuesta_de_error)."""
+    if not get_gemini_model():
+        return None, (jsonify({"error": "Gemini no configurado. Define GEMINI_API_KEY en .env"}), 500)
+
+    data = request.get_json(silent=True) or {}
+    user_msg = (data.get('message') or "").strip()
+    if not user_msg:
+        return None, (jsonify({"error": "Falta 'message'"}), 400)
+    return user_msg, None
+
+def read_chat_location():
+    """(lat, lng) opcionales del cuerpo del chat; None si el cliente no los envía o no son válidos."""
+    data = request.get_json(silent=True) or {}
+    if data.get('lat') is None or data.get('lng') is None:
+        return None
+    try:
+        return parse_location(data['lat'], data['lng'])
+    except ValueError:
+        return None
+
+@app.route('/api/chat', methods=['POST'], strict_slashes=False)
+def chat():
+    user_msg, error = read_chat_message()
+    if error:
+        return error
+
+    session_id = chat_session_id()
+    state = CHAT_STATES.load(session_id)
+    plan = plan_chat_reply(user_msg, state, read_chat_location())
+    if 'reply' in plan:
+        remember_chat_turn(session_id, state, user_msg, plan['reply'])
+        return jsonify({"reply": format_gemini_response(plan['reply'])})
+
+    # Preguntas repetidas ("hola", "cómo mejorar mis ventas") salen de la caché
+    key = cache_key(plan['mode'], user_msg)
+    gemini_reply = CHAT_RESPONSE_CACHE.get(key) if key else None
+    if gemini_reply is None:
         try:
-            resp = GEMINI_MODEL.generate_content(general_prompt)
-            gemini_reply = resp.text.strip() if hasattr(resp, "text") else "¡Hola! Soy GuIA, tu asistente de Comuni IA. ¿En qué puedo ayudarte hoy? 😊"
-            
-            # Añadir sugerencia de búsqueda si es relevante
-            if any(word in user_msg_lower for word in ['hola', 'hello', 'hi', 'buenas']):
-                reply = gemini_reply
+            started = time.perf_counter()
+            resp = get_gemini_model().generate_content(plan['prompt'])
+            if hasattr(resp, "text"):
+                gemini_reply = resp.text.strip()
+                if key:
+                    CHAT_RESPONSE_CACHE.set(key, gemini_reply, (time.perf_counter() - started) * 1000)
             else:
-                reply = f"{gemini_reply}\n\n🔍 *¿Buscas algo específico? Puedo ayudarte a encontrar productos y servicios locales. Solo dime 'busco [lo que necesites]'.*"
-                
+                gemini_reply = plan['default']
+        except Exception as e:
+            print(f"Error con Gemini en modo {plan['mode']}: {e}")
+            remember_chat_turn(session_id, state, user_msg, plan['fallback'])
+            return jsonify({"reply": format_gemini_response(plan['fallback'])})
+
+    remember_chat_turn(session_id, state, user_msg, gemini_reply)
+    return jsonify({"reply": format_gemini_response(gemini_reply + plan['suffix'])})
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'], strict_slashes=False)
+def chat_stream():
+    """
+    Igual que /api/chat pero responde con Server-Sent Events: los modos asistente y
+    general reenvían los fragmentos de Gemini a medida que llegan ('chunk' con el HTML
+    a añadir), y el modo búsqueda envía la respuesta completa en un solo 'chunk'.
+    Si Gemini falla a mitad de camino se envía 'replace' con el mensaje de respaldo.
+    """
+    user_msg, error = read_chat_message()
+    if error:
+        return error
+
+    session_id = chat_session_id()
+    state = CHAT_STATES.load(session_id)
+    plan = plan_chat_reply(user_msg, state, read_chat_location())
+
+    def generate():
+        if 'reply' in plan:
+            remember_chat_turn(session_id, state, user_msg, plan['reply'])
+            yield sse_event('chunk', {'html': format_gemini_response(plan['reply'])})
+            yield sse_event('done', {})
+            return
+
+        formatter = BoldStreamFormatter()
+        key = cache_key(plan['mode'], user_msg)
+        cached = CHAT_RESPONSE_CACHE.get(key) if key else None
+        if cached is not None:
+            remember_chat_turn(session_id, state, user_msg, cached)
+            yield sse_event('chunk', {'html': formatter.feed(cached + plan['suffix']) + formatter.finish()})
+            yield sse_event('done', {})
+            return
+
+        received = []
+        try:
+            started = time.perf_counter()
+            for chunk in get_gemini_model().generate_content(plan['prompt'], stream=True):
+                text = getattr(chunk, 'text', '') or ''
+                if not received:
+                    text = text.lstrip()
+                if text:
+                    received.append(text)
+                html = formatter.feed(text)
+                if html:
+                    yield sse_event('chunk', {'html': html})
+            if received and key:
+                CHAT_RESPONSE_CACHE.set(key, ''.join(received).strip(), (time.perf_counter() - started) * 1000)
+            tail = formatter.feed(plan['suffix'] if received else plan['default'] + plan['suffix'])
+            tail += formatter.finish()
+            if tail:
+                yield sse_event('chunk', {'html': tail})
+            remember_chat_turn(session_id, state, user_msg, ''.join(received).strip() or plan['default'])
         except Exception as e:
-            print(f"Error con Gemini en modo general: {e}")
-            reply = "¡Hola! Soy Gu-IA de Comuni IA. Puedo ayudarte a encontrar productos locales o darte consejos para tu negocio. ¿En qué te puedo ayudar? 🛍️"
+            print(f"Error con Gemini en modo {plan['mode']} (stream): {e}")
+            remember_chat_turn(session_id, state, user_msg, plan['fallback'])
+            yield sse_event('replace', {'html': format_gemini_response(plan['fallback'])})
+        yield sse_event('done', {})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-        return jsonify({"reply": format_gemini_response(reply)})
 #gemini chat endpoint
 
 # RUTAS DE PRODUCTOS (ACTUALIZADO: subida de imagen)
@@ -976,7 +2031,7 @@ def add_product(business_id):
     
     if image and image.filename:
         try:
-            image_path = images.save(image)
+            image_path = UPLOAD_STORE.save(image)
         except Exception as e:
             return jsonify({"error": f"Error al subir imagen: {str(e)}"}), 500
     
@@ -986,6 +2041,10 @@ def add_product(business_id):
     product = Product(business_id=business_id, name=name, price=price, stock=stock, image_url=image_path)
     db.session.add(product)
     db.session.commit()
+    PRODUCT_INDEX.upsert(product.id, product.name, product.description, product.stock,
+                         business.id, business.name)
+    SEMANTIC_INDEX.upsert(product.id, product.name, product.description, business.description)
+    FUZZY_INDEX.upsert('product', product.id, product.name)
     
     return jsonify({
         "success": True,
@@ -1008,6 +2067,9 @@ def manage_product(product_id):
             if request.method == 'DELETE':
                 db.session.delete(product)
                 db.session.commit()
+                PRODUCT_INDEX.remove(product_id)
+                SEMANTIC_INDEX.remove(product_id)
+                FUZZY_INDEX.remove('product', product_id)
                 return jsonify({"success": True})
             elif request.method == 'PUT':
                 name = request.form.get('name', '').strip()
@@ -1021,12 +2083,8 @@ def manage_product(product_id):
                 image = request.files.get('image') if 'image' in request.files else None
                 if image and image.filename:
                     try:
-                        # Si hay una imagen anterior, la borramos
-                        if product.image_url:
-                            old_image_path = images.path(product.image_url)
-                            if os.path.exists(old_image_path):
-                                os.remove(old_image_path)
-                        product.image_url = images.save(image)
+                        # La imagen anterior pierde una referencia (se recolecta con `flask gc-uploads`)
+                        product.image_url = UPLOAD_STORE.save(image)
                     except Exception as e:
                         return jsonify({"error": f"Error al subir imagen: {str(e)}"}), 500
                 
@@ -1035,6 +2093,10 @@ def manage_product(product_id):
                 product.description = description
                 product.stock = stock
                 db.session.commit()
+                PRODUCT_INDEX.upsert(product.id, product.name, product.description, product.stock,
+                                     product.business_id, product.business.name)
+                SEMANTIC_INDEX.upsert(product.id, product.name, product.description, product.business.description)
+                FUZZY_INDEX.upsert('product', product.id, product.name)
                 return jsonify({"success": True})
     
     abort(403) # abort() es manejado por el errorhandler y devuelve JSON
@@ -1060,6 +2122,7 @@ def add_review(business_id):
     
     review = Review(business_id=business_id, author=author, rating=rating, comment=comment)
     db.session.add(review)
+    apply_review_to_rating(business_id, rating)
     db.session.commit()
     
     return jsonify({"success": True, "review": review.to_dict()})
@@ -1067,36 +2130,54 @@ def add_review(business_id):
 @app.route('/api/reviews/<int:business_id>', methods=['GET'], strict_slashes=False)
 def get_reviews(business_id):
     reviews = Review.query.filter_by(business_id=business_id).order_by(Review.created_at.desc()).all()
-    avg_rating = db.session.query(db.func.avg(Review.rating)).filter_by(business_id=business_id).scalar() or 0
+    rating = db.session.get(BusinessRating, business_id)
     
     return jsonify({
         "reviews": [r.to_dict() for r in reviews],
-        "avg_rating": round(avg_rating, 1),
-        "total": len(reviews)
+        **(rating.to_dict() if rating else EMPTY_RATING)
     })
 
 # RUTAS ADMIN
 @app.route('/admin/dashboard', strict_slashes=False)
 @admin_required
 def admin_dashboard():
-    # Estadísticas para el dashboard
+    # Estadísticas para el dashboard (foto de admin_stats, ver refresh_admin_stats)
+    totals, series = admin_stats_snapshot()
     stats = {
-        'total_users': User.query.count(),
-        'total_businesses': Business.query.count(),
-        'total_products': Product.query.count(),
-        'total_reviews': Review.query.count()
+        'total_users': totals['users_active'] + totals['users_inactive'],
+        'total_businesses': totals['businesses_active'] + totals['businesses_inactive'],
+        'total_products': totals['products'],
+        'total_reviews': totals['reviews'],
+        'active_users': totals['users_active'],
+        'inactive_users': totals['users_inactive'],
+        'active_businesses': totals['businesses_active'],
+        'inactive_businesses': totals['businesses_inactive'],
+        'reservations': {status: totals[f'reservations_{status}'] for status in RESERVATION_STATUSES},
+        'refreshed_at': (datetime.fromtimestamp(totals['refreshed_at'], timezone.utc)
+                         if totals['refreshed_at'] else None),
     }
-    
-    # Lista de todos los negocios con el email del dueño
-    businesses_with_owners = db.session.query(Business, User.email).outerjoin(User, Business.id == User.business_id).order_by(Business.id.desc()).all()
-    
-    # Lista de todos los usuarios
-    all_users = User.query.order_by(User.created_at.desc()).all()
 
+    # Las tablas de usuarios y negocios se cargan por páginas desde /admin/api/users y /admin/api/businesses
     return render_template('admin_dashboard.html', 
                            stats=stats, 
-                           businesses_with_owners=businesses_with_owners,
-                           all_users=all_users)
+                           series=series)
+
+@app.route('/admin/query_stats', strict_slashes=False)
+@admin_required
+def admin_query_stats():
+    """Consultas SQL por endpoint (conteo, tiempo y peticiones con posible N+1)."""
+    return jsonify(query_stats.snapshot())
+
+@app.route('/admin/cache_stats', strict_slashes=False)
+@admin_required
+def admin_cache_stats():
+    """Aciertos y fallos de las cachés de respuestas de Gemini en este proceso, sesiones de chat, índice semántico y eventos diferidos."""
+    stats = {name: dict(stats) for name, stats in CACHE_STATS.items()}
+    stats['chat'] = CHAT_RESPONSE_CACHE.stats()
+    stats['chat_sessions'] = CHAT_STATES.stats()
+    stats['semantic_index'] = SEMANTIC_INDEX.stats()
+    stats['write_behind'] = ENGAGEMENT_EVENTS.stats()
+    return jsonify(stats)
 
 @app.route('/admin/toggle_business_status/<int:id>', methods=['POST'], strict_slashes=False)
 @admin_required
@@ -1119,6 +2200,7 @@ def toggle_business_status(id):
                 user.business_id = None
 
         db.session.commit()
+        FUZZY_INDEX.invalidate()
         return jsonify({"success": True, "message": f"Negocio '{business.name}' {action}."})
     except Exception as e:
         db.session.rollback()
@@ -1153,6 +2235,209 @@ def toggle_user_status(user_id):
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+# TABLAS DEL PANEL DE ADMINISTRACIÓN
+# Las tablas de usuarios y negocios se cargan por páginas desde estos endpoints (paginación
+# por clave, como /api/businesses). La búsqueda es por prefijo del email o del nombre, con
+# un rango sobre los índices de lower(email) y lower(name).
+ADMIN_PAGE_SIZE = 50
+ADMIN_PAGE_MAX = 200
+ADMIN_BULK_MAX = 500  # ids por acción masiva
+# Órdenes posibles: nombre -> (expresión, descendente); el id desempata
+ADMIN_USER_SORTS = {
+    'newest': (User.id, True),
+    'oldest': (User.id, False),
+    'email': (db.func.lower(User.email), False),
+}
+ADMIN_BUSINESS_SORTS = {
+    'newest': (Business.id, True),
+    'oldest': (Business.id, False),
+    'name': (db.func.lower(Business.name), False),
+}
+
+def prefix_filter(expression, prefix):
+    """`expression` empieza con `prefix` (ya en minúsculas), como rango para que use el índice."""
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return db.and_(expression >= prefix, expression < upper)
+
+def admin_page(query, id_column, sort):
+    """
+    Una página de `query` (filas de columnas) según ?sort=, ?cursor= y ?limit=.
+    Devuelve (filas, cursor_siguiente o None). Lanza ValueError o InvalidCursor.
+    """
+    try:
+        limit = int(request.args.get('limit', ADMIN_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("limit debe ser un número") from None
+    if limit < 1:
+        raise ValueError("limit debe ser mayor que cero")
+    limit = min(limit, ADMIN_PAGE_MAX)
+    expression, descending = sort
+    query = query.add_columns(expression.label('sort_key'))
+    cursor = request.args.get('cursor')
+    if cursor:
+        after = decode_cursor(cursor, ('key', 'id'))
+        try:
+            key, last_id = after['key'], int(after['id'])
+        except (TypeError, ValueError) as e:
+            raise InvalidCursor(str(e)) from None
+        position = db.tuple_(expression, id_column)
+        query = query.filter(position < db.tuple_(key, last_id) if descending else position > db.tuple_(key, last_id))
+    order = (expression.desc(), id_column.desc()) if descending else (expression, id_column)
+    rows = query.order_by(*order).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor({'key': rows[-1].sort_key, 'id': rows[-1].id}) if has_more else None
+    return rows, next_cursor
+
+def admin_status_filter(query, column):
+    """Aplica ?status=active|inactive. ValueError si el valor no es válido."""
+    status = request.args.get('status', '')
+    if status not in ('', 'active', 'inactive'):
+        raise ValueError("status debe ser active o inactive")
+    return query.filter(column == (status == 'active')) if status else query
+
+@app.route('/admin/api/users', strict_slashes=False)
+@admin_required
+def admin_api_users():
+    """
+    Usuarios para la tabla del panel, por páginas.
+    Parámetros: q (prefijo del email), role, status (active/inactive),
+    sort (newest, oldest, email), cursor y limit (máx. 200).
+    """
+    sort = ADMIN_USER_SORTS.get(request.args.get('sort', 'newest'))
+    if sort is None:
+        return jsonify({"error": "Orden desconocido", "sorts": list(ADMIN_USER_SORTS)}), 400
+    query = db.session.query(User.id, User.email, User.role, User.is_active, User.created_at, User.business_id)
+    prefix = request.args.get('q', '').strip().lower()
+    if prefix:
+        query = query.filter(prefix_filter(db.func.lower(User.email), prefix))
+    if request.args.get('role'):
+        query = query.filter(User.role == request.args['role'])
+    try:
+        query = admin_status_filter(query, User.is_active)
+        rows, next_cursor = admin_page(query, User.id, sort)
+    except InvalidCursor:
+        return jsonify({"error": "Cursor inválido"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "users": [{
+            'id': row.id,
+            'email': row.email,
+            'role': row.role,
+            'is_active': row.is_active,
+            'created_at': row.created_at.strftime('%d/%m/%Y') if row.created_at else None,
+            'business_id': row.business_id,
+            'delete_url': url_for('delete_user', user_id=row.id) if row.role != 'admin' else None,
+        } for row in rows],
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None,
+    })
+
+@app.route('/admin/api/businesses', strict_slashes=False)
+@admin_required
+def admin_api_businesses():
+    """
+    Negocios (activos e inactivos) con el email del dueño, por páginas.
+    Parámetros: q (prefijo del nombre), category, status (active/inactive),
+    sort (newest, oldest, name), cursor y limit (máx. 200).
+    """
+    sort = ADMIN_BUSINESS_SORTS.get(request.args.get('sort', 'newest'))
+    if sort is None:
+        return jsonify({"error": "Orden desconocido", "sorts": list(ADMIN_BUSINESS_SORTS)}), 400
+    query = (db.session.query(Business.id, Business.name, Business.category, Business.is_active,
+                              Business.created_at, User.email.label('owner_email'))
+             .outerjoin(User, User.business_id == Business.id))
+    prefix = request.args.get('q', '').strip().lower()
+    if prefix:
+        query = query.filter(prefix_filter(db.func.lower(Business.name), prefix))
+    if request.args.get('category'):
+        query = query.filter(Business.category == request.args['category'])
+    try:
+        query = admin_status_filter(query, Business.is_active)
+        rows, next_cursor = admin_page(query, Business.id, sort)
+    except InvalidCursor:
+        return jsonify({"error": "Cursor inválido"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "businesses": [{
+            'id': row.id,
+            'name': row.name,
+            'category': row.category,
+            'is_active': row.is_active,
+            'created_at': row.created_at.strftime('%d/%m/%Y') if row.created_at else None,
+            'owner_email': row.owner_email,
+            'profile_url': url_for('profile', id=row.id),
+            'delete_url': url_for('delete_business', id=row.id),
+        } for row in rows],
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None,
+    })
+
+def bulk_status_request():
+    """Lee {"ids": [...], "active": true|false} del cuerpo JSON. Devuelve (ids, activo, respuesta_de_error)."""
+    data = request.get_json(silent=True) or {}
+    ids, active = data.get('ids'), data.get('active')
+    if not isinstance(active, bool):
+        return None, None, (jsonify({"error": "active debe ser true o false"}), 400)
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        return None, None, (jsonify({"error": "ids debe ser una lista de números"}), 400)
+    if len(ids) > ADMIN_BULK_MAX:
+        return None, None, (jsonify({"error": f"Como máximo {ADMIN_BULK_MAX} ids por acción"}), 400)
+    return sorted(set(ids)), active, None
+
+@app.route('/admin/businesses/bulk_status', methods=['POST'], strict_slashes=False)
+@admin_required
+def bulk_business_status():
+    """
+    Activa o desactiva varios negocios con un solo UPDATE.
+    Como en toggle_business_status, al desactivar se desvincula a los dueños.
+    """
+    ids, active, error = bulk_status_request()
+    if error:
+        return error
+    try:
+        updated = db.session.execute(
+            db.update(Business).where(Business.id.in_(ids)).values(is_active=active)
+        ).rowcount
+        if not active:
+            db.session.execute(db.update(User).where(User.business_id.in_(ids)).values(business_id=None))
+        db.session.commit()
+        FUZZY_INDEX.invalidate()
+        return jsonify({"success": True, "updated": updated,
+                        "message": f"{updated} negocios {'reactivados' if active else 'desactivados'}."})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/admin/users/bulk_status', methods=['POST'], strict_slashes=False)
+@admin_required
+def bulk_user_status():
+    """
+    Activa o desactiva varios usuarios con un solo UPDATE (los administradores no se tocan).
+    Como en toggle_user_status, al desactivar también se desactivan sus negocios.
+    """
+    ids, active, error = bulk_status_request()
+    if error:
+        return error
+    targets = db.and_(User.id.in_(ids), User.role != 'admin')
+    try:
+        updated = db.session.execute(db.update(User).where(targets).values(is_active=active)).rowcount
+        if not active:
+            owned = db.select(User.business_id).where(targets, User.business_id.is_not(None))
+            db.session.execute(db.update(Business).where(Business.id.in_(owned)).values(is_active=False))
+        db.session.commit()
+        if not active:
+            FUZZY_INDEX.invalidate()
+        return jsonify({"success": True, "updated": updated,
+                        "message": f"{updated} usuarios {'reactivados' if active else 'desactivados'}."})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
 # ============================================
 # NUEVAS RUTAS DE ELIMINACIÓN PERMANENTE
 # ============================================
@@ -1173,41 +2458,47 @@ def delete_user(user_id):
     
     try:
         # 1. Si el usuario tiene un negocio asociado
+        deleted_business_id = user.business_id
         if user.business_id:
             business = Business.query.get(user.business_id)
+            user.business_id = None  # Desvincularlo antes de borrar el negocio (clave foránea)
             if business:
-                # Eliminar productos del negocio
+                # Eliminar las reservas y los productos del negocio
+                Reservation.query.filter_by(business_id=business.id).delete()
                 Product.query.filter_by(business_id=business.id).delete()
                 
-                # Eliminar reseñas del negocio
+                # Eliminar reseñas del negocio (su agregado se borra en cascada con el negocio)
                 Review.query.filter_by(business_id=business.id).delete()
                 
                 # Limpiar relaciones many-to-many
                 business.favorited_by.clear()  # Eliminar de favoritos
                 business.viewed_by.clear()      # Eliminar vistas
                 
-                # Eliminar logo si existe
-                if business.logo:
-                    try:
-                        logo_path = images.path(business.logo)
-                        if os.path.exists(logo_path):
-                            os.remove(logo_path)
-                    except Exception as e:
-                        print(f"Advertencia: No se pudo eliminar el logo: {e}")
-                
-                # Eliminar el negocio
+                # Eliminar el negocio (el logo y las imágenes de productos quedan sin
+                # referencias y los borra `flask gc-uploads`)
+                delete_business_neighbors(business.id)
                 db.session.delete(business)
         
-        # 2. Eliminar reseñas hechas por el usuario (usando el email como autor)
+        # 2. Eliminar reseñas hechas por el usuario (usando el email como autor),
+        # descontándolas de los agregados de cada negocio
+        authored = (db.session.query(Review.business_id, Review.rating, db.func.count())
+                    .filter_by(author=user.email).group_by(Review.business_id, Review.rating).all())
+        for review_business_id, review_rating, n in authored:
+            apply_review_to_rating(review_business_id, review_rating, -n)
         Review.query.filter_by(author=user.email).delete()
         
-        # 3. Limpiar relaciones many-to-many del usuario
+        # 3. Eliminar las reservas hechas por el usuario y limpiar sus relaciones many-to-many
+        Reservation.query.filter_by(user_id=user.id).delete()
         user.favorite_businesses.clear()
         user.viewed_businesses.clear()
         
         # 4. Eliminar el usuario
         db.session.delete(user)
         db.session.commit()
+        if deleted_business_id:
+            PRODUCT_INDEX.remove_business(deleted_business_id)
+            SEMANTIC_INDEX.invalidate()
+            FUZZY_INDEX.invalidate()
         
         return jsonify({'success': True, 'message': f'Usuario "{user.email}" eliminado correctamente'})
     
@@ -1226,10 +2517,11 @@ def delete_business(id):
     business = Business.query.get_or_404(id)
     
     try:
-        # 1. Eliminar productos del negocio
+        # 1. Eliminar las reservas y los productos del negocio
+        Reservation.query.filter_by(business_id=id).delete()
         Product.query.filter_by(business_id=id).delete()
         
-        # 2. Eliminar reseñas del negocio
+        # 2. Eliminar reseñas del negocio (su agregado se borra en cascada con el negocio)
         Review.query.filter_by(business_id=id).delete()
         
         # 3. Desvincular al dueño del negocio (si existe)
@@ -1241,18 +2533,13 @@ def delete_business(id):
         business.favorited_by.clear()  # Eliminar de favoritos de usuarios
         business.viewed_by.clear()      # Eliminar registro de vistas
         
-        # 5. Eliminar archivos de imagen si existen
-        if business.logo:
-            try:
-                logo_path = images.path(business.logo)
-                if os.path.exists(logo_path):
-                    os.remove(logo_path)
-            except Exception as e:
-                print(f"Advertencia: No se pudo eliminar el logo: {e}")
-        
-        # 6. Eliminar el negocio
+        # 5. Eliminar el negocio (sus imágenes quedan sin referencias y las borra `flask gc-uploads`)
+        delete_business_neighbors(id)
         db.session.delete(business)
         db.session.commit()
+        PRODUCT_INDEX.remove_business(id)
+        SEMANTIC_INDEX.invalidate()
+        FUZZY_INDEX.invalidate()
         
         return jsonify({'success': True, 'message': f'Negocio "{business.name}" eliminado correctamente'})
     
@@ -1284,10 +2571,12 @@ def create_reservation():
 
     product = Product.query.get_or_404(product_id)
 
-    if product.stock < quantity:
-        return jsonify({'success': False, 'error': f'Stock insuficiente. Solo quedan {product.stock} unidades.'}), 400
-
     try:
+        # Reducir el stock en una sola sentencia condicional (sin sobreventa con reservas concurrentes)
+        if not take_stock(db.session, product.id, quantity):
+            db.session.rollback()
+            return jsonify({'success': False, 'error': f'Stock insuficiente. Solo quedan {product.stock} unidades.'}), 400
+
         # Crear la reserva
         reservation = Reservation(
             user_id=session['user_id'],
@@ -1296,17 +2585,17 @@ def create_reservation():
             quantity=quantity,
             notes=notes
         )
-        # Reducir el stock
-        product.stock -= quantity
-
         db.session.add(reservation)
         db.session.commit()
+        PRODUCT_INDEX.set_stock(product.id, product.stock)
 
         return jsonify({'success': True, 'message': '¡Reserva creada con éxito!'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': f'Error al procesar la reserva: {str(e)}'}), 500
 
+RESERVATION_STATUSES = ('pendiente', 'confirmada', 'rechazada', 'completada')
+
 @app.route('/api/reservations/<int:reservation_id>/status', methods=['POST'], strict_slashes=False)
 @login_required
 def update_reservation_status(reservation_id):
@@ -1318,8 +2607,34 @@ def update_reservation_status(reservation_id):
         abort(403)
 
     new_status = request.json.get('status')
-    reservation.status = new_status
+    if new_status not in RESERVATION_STATUSES:
+        return jsonify({'success': False, 'error': 'Estado de reserva no válido.'}), 400
+
+    # Cambio de estado condicional: si otra petición lo cambió antes, no se ajusta el stock dos veces
+    old_status = reservation.status
+    changed = db.session.execute(
+        db.update(Reservation)
+        .where(Reservation.id == reservation.id, Reservation.status == old_status)
+        .values(status=new_status)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not changed:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': 'La reserva cambió mientras tanto. Recarga la página.'}), 409
+
+    stock_changed = False
+    if new_status == 'rechazada' and old_status != 'rechazada':
+        # Al rechazar, las unidades vuelven al stock
+        stock_changed = return_stock(db.session, reservation.product_id, reservation.quantity)
+    elif old_status == 'rechazada' and new_status != 'rechazada':
+        # Reactivar una reserva rechazada vuelve a descontar, solo si hay stock
+        if not take_stock(db.session, reservation.product_id, reservation.quantity):
+            db.session.rollback()
+            return jsonify({'success': False, 'error': 'Stock insuficiente para reactivar la reserva.'}), 400
+        stock_changed = True
     db.session.commit()
+    if stock_changed:
+        PRODUCT_INDEX.set_stock(reservation.product_id, reservation.product.stock)
 
     return jsonify({'success': True, 'message': f'Reserva actualizada a {new_status}.'})
 
@@ -1329,7 +2644,9 @@ def my_reservations():
     """Página para que el cliente vea el estado de sus reservas."""
     user_id = session['user_id']
     # Hacemos un join para poder acceder fácilmente al nombre del producto y del negocio
-    reservations = db.session.query(Reservation).filter_by(user_id=user_id).order_by(Reservation.created_at.desc()).all()
+    reservations = (db.session.query(Reservation).filter_by(user_id=user_id)
+                    .options(joinedload(Reservation.product), joinedload(Reservation.business))
+                    .order_by(Reservation.created_at.desc()).all())
     
     return render_template('my_reservations.html', reservations=reservations)
 
@@ -1352,5 +2669,111 @@ def server_error(e):
 def forbidden(e):
     return jsonify(error="No tienes permiso para realizar esta acción"), 403
 
+# ============================================
+# INICIALIZACIÓN DE LA APLICACIÓN
+# ============================================
+
+def init_app(config=None):
+    """
+    Inicializa la app del módulo (`app`, única por proceso) y la devuelve: aplica
+    `config` (y las variables de entorno FLASK_*, p. ej. FLASK_SQLALCHEMY_DATABASE_URI)
+    e inicializa las extensiones, el esquema y los objetos que dependen de la
+    configuración.
+
+    No es una fábrica de apps (no hay create_app): las rutas, los hooks, los
+    comandos CLI y los objetos globales están ligados a `app` al importar el
+    módulo, así que no se pueden crear dos apps aisladas en un mismo proceso.
+    Llamarla otra vez sin `config` devuelve la misma app ya inicializada; con
+    otra `config`, lanza RuntimeError. Para varias configuraciones (p. ej. otra
+    base de datos) se usa un proceso nuevo con variables FLASK_*, como hace
+    benchmarks/check_multiworker.py.
+    """
+    global IMAGE_PIPELINE, UPLOAD_STORE, ENGAGEMENT_EVENTS, CHAT_RESPONSE_CACHE, CHAT_STATES, FUZZY_INDEX
+    global SEMANTIC_INDEX, RECOMMENDATIONS_JOB, ADMIN_STATS_JOB
+    global FTS_ENABLED, GEO_ENABLED
+    if 'sqlalchemy' in app.extensions:
+        if config:
+            raise RuntimeError("init_app() ya se llamó en este proceso; no se puede cambiar la configuración")
+        return app
+
+    app.config.from_prefixed_env()
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', sqlite_profile.engine_options(app.config['SQLITE_PRAGMAS']))
+
+    if app.config['JINJA_BYTECODE_CACHE_DIR']:
+        os.makedirs(app.config['JINJA_BYTECODE_CACHE_DIR'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR'])
+
+    db.init_app(app)
+    migrate.init_app(app, db)
+    query_stats.init_app(app)
+    static_assets.init_app(app)
+    configure_uploads(app, images)
+
+    IMAGE_PIPELINE = ImagePipeline(app.config['UPLOADED_IMAGES_DEST'],
+                                   workers=app.config['IMAGE_PIPELINE_WORKERS'],
+                                   enabled=app.config['IMAGE_PIPELINE_ENABLED'])
+    UPLOAD_STORE = UploadStore(images, lambda: db.engine, pipeline=IMAGE_PIPELINE,
+                               grace=app.config['UPLOAD_GC_GRACE_SECONDS'])
+    ENGAGEMENT_EVENTS = WriteBehindBuffer(
+        flush_engagement_events,
+        interval_ms=app.config['WRITE_BEHIND_INTERVAL_MS'],
+        batch_size=app.config['WRITE_BEHIND_BATCH_SIZE'],
+        maxsize=app.config['WRITE_BEHIND_MAX_QUEUE'],
+        enabled=app.config['WRITE_BEHIND_ENABLED'],
+        on_lost=forget_pending_favorites,
+    )
+    if app.config['CHAT_CACHE_BACKEND'] == 'sqlite':
+        CHAT_RESPONSE_CACHE = SQLiteResponseCache(lambda: db.engine,
+                                                  max_entries=app.config['CHAT_CACHE_MAX_ENTRIES'],
+                                                  ttl=app.config['CHAT_CACHE_TTL'])
+    else:
+        CHAT_RESPONSE_CACHE = MemoryResponseCache(max_entries=app.config['CHAT_CACHE_MAX_ENTRIES'],
+                                                  ttl=app.config['CHAT_CACHE_TTL'])
+    chat_state_options = {'max_sessions': app.config['CHAT_STATE_MAX_SESSIONS'],
+                          'ttl': app.config['CHAT_STATE_TTL'],
+                          'max_turns': app.config['CHAT_STATE_MAX_TURNS']}
+    if app.config['CHAT_STATE_BACKEND'] == 'sqlite':
+        CHAT_STATES = SQLiteChatStateStore(lambda: db.engine, **chat_state_options)
+    else:
+        CHAT_STATES = MemoryChatStateStore(**chat_state_options)
+    FUZZY_INDEX = FuzzyNameIndex(max_candidates=app.config['FUZZY_MAX_CANDIDATES'],
+                                 min_score=app.config['FUZZY_MIN_SCORE'],
+                                 max_ms=app.config['FUZZY_MAX_MS'],
+                                 stop_words=CHAT_MATCHER.stop_words,
+                                 app_context=app.app_context)
+    SEMANTIC_INDEX = SemanticProductIndex(app.config['SEMANTIC_INDEX_DIR'],
+                                          max_age=app.config['SEMANTIC_MAX_AGE'],
+                                          stop_words=CHAT_MATCHER.stop_words,
+                                          related_terms=CHAT_MATCHER.related_terms,
+                                          app_context=app.app_context)
+    RECOMMENDATIONS_JOB = PeriodicJob('recommendations', app.config['RECOMMEND_REFRESH_SECONDS'],
+                                      rebuild_recommendations, lambda: db.engine, app_context=app.app_context)
+    ADMIN_STATS_JOB = PeriodicJob('admin_stats', app.config['ADMIN_STATS_REFRESH_SECONDS'],
+                                  refresh_admin_stats, lambda: db.engine, app_context=app.app_context)
+
+    with app.app_context():
+        sqlite_profile.install(db.engine, app.config['SQLITE_PRAGMAS'])
+        if schema_version() < SCHEMA_VERSION:
+            upgrade_schema()
+        FTS_ENABLED = search_fts.fts_ready(db.session)
+        GEO_ENABLED = geo_index.geo_ready(db.session)
+        db.session.remove()
+        # Con preload_app el maestro abrió conexiones: no dejarlas en el pool que heredan los workers
+        db.engine.dispose()
+
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+    return app
+
+def _after_fork_in_child():
+    """
+    En cada worker nuevo (prefork), descartar sin cerrarlas las conexiones SQLite
+    heredadas del padre y el pool de procesos de imágenes: no se comparten entre procesos.
+    """
+    with app.app_context():
+        db.engine.dispose(close=False)
+    if IMAGE_PIPELINE is not None:
+        IMAGE_PIPELINE.after_fork()
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    init_app().run(debug=True)
\ No newline at end of file
@@ -0,0 +1,189 @@
+"""
+Detección de intención y categoría del chat: las listas y bucles que
+plan_chat_reply reconstruía en cada mensaje frente a ChatMatcher
+(chat_intents.py), compilado una vez desde chat_intents.json.
+
+Compara ambas versiones sobre un corpus de mensajes: deben coincidir en la
+intención, el término extraído y la categoría (los campos de la lógica
+anterior; `own_term` es nuevo), salvo en los casos de DIFERENCIAS, que son
+cambios buscados (palabras completas, sin tildes, consejos que no son
+búsquedas) y se comprueban uno por uno. Después mide microsegundos por
+mensaje.
+
+Uso:
+    python benchmarks/bench_chat_intents.py [--repeat 200]
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from chat_intents import ChatMatcher
+
+
+def legacy_match(user_msg):
+    """Lógica anterior de plan_chat_reply, copiada tal cual (listas creadas en cada llamada)."""
+    user_msg_lower = user_msg.lower()
+    search_keywords = ['busco', 'quiero', 'necesito', 'tienes', 'vendes', 'comprar', 'precio de',
+                      'cuanto cuesta', 'hay', 'donde encontrar', 'encontrar', 'dónde', 'consigo',
+                      'recomiendame', 'recomiéndame', 'producto', 'servicio', 'venta']
+    assistant_keywords = ['consejo', 'consejos', 'ayuda', 'cómo', 'como', 'qué', 'que', 'por qué',
+                         'porque', 'mejora', 'mejorar', 'sugerencia', 'sugerencias', 'tips', 'tip',
+                         'recomendación', 'recomendaciones', 'idea', 'ideas', 'estrategia',
+                         'qué hacer', 'que hacer', 'cómo mejorar', 'como mejorar', 'ayudame',
+                         'ayúdame', 'orientación', 'guía', 'advice', 'help']
+    is_product_search = any(keyword in user_msg_lower for keyword in search_keywords)
+    is_assistant_query = any(keyword in user_msg_lower for keyword in assistant_keywords)
+    is_affirmative = user_msg_lower in ['si', 'sí', 'sii', 'claro', 'dale', 'ok', 'sí quiero',
+                                       'por supuesto', 'adelante', 'yes', 'y']
+
+    search_term = ''
+    possible_category = None
+    if is_product_search:
+        extracted_term = ""
+        for keyword in search_keywords:
+            if keyword in user_msg_lower:
+                parts = user_msg_lower.split(keyword, 1)
+                if len(parts) > 1:
+                    extracted_term = parts[1].strip()
+                    break
+        if not extracted_term:
+            extracted_term = user_msg
+        stop_words = ['una', 'un', 'de', 'del', 'la', 'el', 'en', 'con', 'para', 'por',
+                     'a', 'y', 'o', 'algun', 'alguna', 'algunos', 'por favor', 'favor', 'gracias']
+        words = extracted_term.split()
+        cleaned_words = [word for word in words if word not in stop_words and len(word) > 1]
+        search_term = ' '.join(cleaned_words).strip()
+        if not search_term:
+            search_term = user_msg
+
+        search_words = search_term.lower().split()
+        category_map = {
+            'laptop': 'Tecnología', 'computadora': 'Tecnología', 'pc': 'Tecnología',
+            'ordenador': 'Tecnología', 'portatil': 'Tecnología', 'notebook': 'Tecnología',
+            'celular': 'Tecnología', 'smartphone': 'Tecnología', 'movil': 'Tecnología', 'teléfono': 'Tecnología',
+            'tablet': 'Tecnología', 'ipad': 'Tecnología', 'tecnologia': 'Tecnología',
+            'impresora': 'Tecnología', 'monitor': 'Tecnología', 'teclado': 'Tecnología',
+            'abogado': 'Servicios Profesionales', 'abogada': 'Servicios Profesionales',
+            'divorcio': 'Servicios Profesionales', 'divorciarse': 'Servicios Profesionales',
+            'legal': 'Servicios Profesionales', 'ley': 'Servicios Profesionales',
+            'juicio': 'Servicios Profesionales', 'demanda': 'Servicios Profesionales',
+            'asesor': 'Servicios Profesionales', 'asesoria': 'Servicios Profesionales',
+            'abogacia': 'Servicios Profesionales', 'derecho': 'Servicios Profesionales',
+            'abogados': 'Servicios Profesionales',
+            'contador': 'Servicios Profesionales', 'contadora': 'Servicios Profesionales',
+            'impuesto': 'Servicios Profesionales', 'tributario': 'Servicios Profesionales',
+            'declaracion': 'Servicios Profesionales', 'fiscal': 'Servicios Profesionales',
+            'contabilidad': 'Servicios Profesionales',
+            'comida': 'Gastronomía', 'restaurante': 'Gastronomía', 'alimento': 'Gastronomía',
+            'pizza': 'Gastronomía', 'hamburguesa': 'Gastronomía', 'sushi': 'Gastronomía',
+            'comida rapida': 'Gastronomía', 'almuerzo': 'Gastronomía', 'cena': 'Gastronomía',
+            'desayuno': 'Gastronomía', 'comida china': 'Gastronomía',
+            'ropa': 'Moda y Ropa', 'vestido': 'Moda y Ropa', 'zapato': 'Moda y Ropa',
+            'camisa': 'Moda y Ropa', 'pantalon': 'Moda y Ropa', 'jeans': 'Moda y Ropa',
+            'calzado': 'Moda y Ropa', 'moda': 'Moda y Ropa', 'blusa': 'Moda y Ropa',
+            'belleza': 'Belleza y Cuidado Personal', 'estetica': 'Belleza y Cuidado Personal',
+            'spa': 'Belleza y Cuidado Personal', 'salon': 'Belleza y Cuidado Personal',
+            'corte': 'Belleza y Cuidado Personal', 'pelo': 'Belleza y Cuidado Personal',
+            'peluqueria': 'Belleza y Cuidado Personal', 'manicura': 'Belleza y Cuidado Personal',
+            'foto': 'Belleza y Cuidado Personal', 'fotografia': 'Belleza y Cuidado Personal',
+            'estudio': 'Belleza y Cuidado Personal',
+            'salud': 'Salud y Bienestar', 'medico': 'Salud y Bienestar', 'farmacia': 'Salud y Bienestar',
+            'doctor': 'Salud y Bienestar', 'clinica': 'Salud y Bienestar', 'hospital': 'Salud y Bienestar',
+            'educacion': 'Educación', 'clase': 'Educación', 'curso': 'Educación',
+            'profesor': 'Educación', 'tutor': 'Educación', 'enseñanza': 'Educación',
+            'yoga': 'Educación', 'clases': 'Educación',
+            'servicio': 'Servicios Profesionales', 'reparacion': 'Servicios Profesionales',
+            'mantenimiento': 'Servicios Profesionales', 'tecnico': 'Servicios Profesionales',
+            'hogar': 'Hogar y Decoración', 'mueble': 'Hogar y Decoración',
+            'decoracion': 'Hogar y Decoración', 'casa': 'Hogar y Decoración'
+        }
+        for keyword, category in category_map.items():
+            if any(word == keyword for word in search_words):
+                possible_category = category
+                break
+            elif any(keyword in word for word in search_words):
+                possible_category = category
+                break
+
+    return {'search': is_product_search, 'assistant': is_assistant_query, 'affirmative': is_affirmative,
+            'term': search_term, 'category': possible_category}
+
+
+PREFIXES = ['busco', 'quiero', 'necesito', 'tienes', 'vendes', 'quiero comprar', 'precio de', 'cuanto cuesta',
+            'donde encontrar', 'consigo', 'recomiendame', 'necesito un producto para', 'busco el servicio de']
+OBJECTS = ['una pizza', 'laptop gamer', 'un abogado de divorcio', 'zapatos de cuero', 'clases de yoga',
+           'un contador', 'comida', 'una tablet samsung', 'corte de pelo', 'un medico', 'muebles para el hogar',
+           'algun celular barato', 'la mejor hamburguesa', 'un tutor de matemáticas', 'impresora por favor',
+           'reparacion de heladera', 'sushi', 'un vestido rojo', 'fotos de boda', 'torta de chocolate']
+OTHERS = ['hola', 'buenas tardes', 'consejos para vender más', 'cómo mejorar mi negocio', 'qué me recomiendas',
+          'ayuda con redes sociales', 'ideas para promociones', 'estrategia de precios', 'gracias', 'sí', 'si',
+          'ok', 'dale', 'claro', 'sí quiero', 'adelante', 'quién eres', 'help', 'tips de marketing',
+          'hay pizza', 'productos de limpieza', 'servicios de limpieza', 'venta de autos']
+CORPUS = [f"{p} {o}" for p, o in itertools.product(PREFIXES, OBJECTS)] + OTHERS
+
+# Cambios buscados respecto de la lógica anterior: (mensaje, campo, antes, ahora)
+DIFERENCIAS = [
+    # Palabras completas: 'hay' ya no se encuentra dentro de otra palabra
+    ('mayhay tienda', 'search', True, False),
+    ('que hayas tenido un buen día', 'search', True, False),
+    # ... ni 'que' dentro de 'aquel' o 'como' dentro de 'cómoda'
+    ('aquel local', 'assistant', True, False),
+    # Sin tildes: 'dónde'/'donde' y 'tecnología'/'tecnologia' son la misma palabra
+    ('donde consigo tecnología', 'category', None, 'Tecnología'),
+    ('busco un teléfono', 'category', 'Tecnología', 'Tecnología'),
+    ('busco un telefono', 'category', None, 'Tecnología'),
+    ('necesito un médico', 'category', None, 'Salud y Bienestar'),
+    ('¿sí?', 'affirmative', False, True),
+    # Categorías al comienzo de palabra: 'spa' ya no está dentro de 'espada'
+    ('busco una espada', 'category', 'Belleza y Cuidado Personal', None),
+    # Palabras vacías sin tildes: 'algún' se descarta como 'algun'
+    ('busco algún celular', 'term', 'algún celular', 'celular'),
+    # Pide consejo y la palabra de búsqueda ('venta') no trae qué buscar: va al asistente
+    ('¿Cómo mejorar mis ventas?', 'search', True, False),
+    ('¿Cómo mejorar mis ventas?', 'term', 's?', ''),
+    # ... pero con algo que buscar sigue siendo una búsqueda
+    ('¿Cómo consigo una pizza?', 'search', True, True),
+]
+
+
+def comparable(result):
+    """Los campos que también devuelve legacy_match."""
+    return {key: value for key, value in result.items() if key != 'own_term'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    matcher = ChatMatcher.from_file()
+    build_ms = (time.perf_counter() - started) * 1000
+
+    mismatches = [(message, legacy_match(message), comparable(matcher.match(message))) for message in CORPUS
+                  if legacy_match(message) != comparable(matcher.match(message))]
+    for message, old, new in mismatches:
+        print(f"❌ {message!r}\n   antes: {old}\n   ahora: {new}")
+    assert not mismatches, f"{len(mismatches)} mensajes del corpus cambiaron de resultado"
+
+    for message, field, before, after in DIFERENCIAS:
+        assert legacy_match(message)[field] == before, (message, field, legacy_match(message)[field])
+        assert matcher.match(message)[field] == after, (message, field, matcher.match(message)[field])
+    print(f"✅ {len(CORPUS)} mensajes con el mismo resultado; {len(DIFERENCIAS)} diferencias buscadas comprobadas\n")
+
+    print(f"{'versión':<24}{'µs/mensaje':>12}")
+    for name, fn in (('listas por mensaje', legacy_match), ('ChatMatcher', matcher.match)):
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            for message in CORPUS:
+                fn(message)
+        per_message = (time.perf_counter() - started) / (args.repeat * len(CORPUS)) * 1e6
+        print(f"{name:<24}{per_message:>12.1f}")
+    print(f"\nCompilar ChatMatcher desde chat_intents.json: {build_ms:.1f} ms (una vez al importar)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Microbenchmark: búsqueda de productos del chat con el recorrido completo
+(lógica anterior de chat()) frente al índice invertido de product_index.
+
+Con términos cortos ('tv') el índice también recorre todo el catálogo: la
+regla de puntuación devuelve todos los productos con stock. Al final mide
+la búsqueda más lenta mientras otro hilo reconstruye el índice.
+
+Uso:
+    python benchmarks/bench_chat_search.py
+"""
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from product_index import ProductSearchIndex, score_product, MIN_SCORE
+
+SIZES = [1_000, 10_000, 100_000]
+QUERIES = ['pizza', 'laptop gamer', 'corte de cabello', 'abogado', 'tv', 'xyzzy']
+
+WORDS = ("pizza laptop cafe torta corte cabello abogado divorcio yoga clase curso "
+         "vestido zapato blusa jeans sofa lampara mesa alfombra celular teclado "
+         "monitor masaje reiki tinte barba manicure contador impuesto").split()
+FILLER = ("artesanal calidad premium fresco oferta santa cruz entrega rapida "
+          "hecho local garantia nuevo clasico moderno elegante").split()
+
+
+def make_rows(n, seed=42):
+    rng = random.Random(seed)
+    rows = []
+    business_names = {}
+    for product_id in range(1, n + 1):
+        name = ' '.join(rng.choice(WORDS + FILLER) for _ in range(rng.randint(1, 3))).title()
+        description = ' '.join(rng.choice(WORDS + FILLER * 3) for _ in range(rng.randint(8, 20)))
+        business_id = rng.randint(1, max(1, n // 20))
+        if business_id not in business_names:
+            business_names[business_id] = f"Negocio {rng.choice(WORDS)} {business_id}"
+        rows.append((product_id, name, description, rng.randint(0, 30),
+                     business_id, business_names[business_id]))
+    return rows
+
+
+def scan(rows, search_term):
+    """Recorrido completo, como hacía chat() antes del índice."""
+    search_term = search_term.lower()
+    search_words = search_term.split()
+    results = []
+    for product_id, name, description, stock, _business_id, business_name in rows:
+        if stock <= 0:
+            continue
+        score = score_product(search_term, search_words, name.lower(),
+                              (description or "").lower(), business_name.lower())
+        if score >= MIN_SCORE:
+            results.append((product_id, score))
+    results.sort(key=lambda item: (-item[1], item[0]))
+    return results
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    print(f"{'productos':>10} {'consulta':>18} {'scan ms':>10} {'índice ms':>10} {'x':>7}")
+    for size in SIZES:
+        rows = make_rows(size)
+        index = ProductSearchIndex()
+        build_start = time.perf_counter()
+        index.rebuild(rows)
+        build_ms = (time.perf_counter() - build_start) * 1000
+        repeat = max(1, 20_000 // size)
+        for query in QUERIES:
+            scan_ms, expected = timed(lambda: scan(rows, query), repeat)
+            index_ms, got = timed(lambda: index.search(query), repeat)
+            assert got == expected, f"resultados distintos para '{query}'"
+            print(f"{size:>10} {query:>18} {scan_ms:>10.2f} {index_ms:>10.2f} {scan_ms / index_ms:>6.1f}x")
+        print(f"{size:>10} {'(construcción)':>18} {'':>10} {build_ms:>10.1f}")
+
+    # Búsquedas mientras se reconstruye el índice más grande (la construcción no toma el lock)
+    builder = threading.Thread(target=index.rebuild, args=(rows,))
+    builder.start()
+    slowest = 0.0
+    searches = 0
+    while builder.is_alive():
+        started = time.perf_counter()
+        index.search('pizza')
+        slowest = max(slowest, time.perf_counter() - started)
+        searches += 1
+    builder.join()
+    print(f"\nDurante una reconstrucción de {len(rows)} productos: {searches} búsquedas, "
+          f"la más lenta {slowest * 1000:.1f} ms (construcción: {build_ms:.0f} ms)")
+
+
+if __name__ == '__main__':
+    main()
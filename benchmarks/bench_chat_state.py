@@ -0,0 +1,99 @@
+"""
+Estado del chat por sesión con miles de usuarios: memoria y velocidad de
+MemoryChatStateStore y SQLiteChatStateStore (chat_state.py).
+
+Simula `--users` visitantes que llegan de a poco y conversan varios turnos
+(cargar estado, buscar, guardar). Informa, cada cierto número de usuarios,
+la memoria ocupada por el almacén en memoria (tracemalloc) y cuántas
+sesiones guarda cada almacén: con `--max-sessions` ambos deben quedarse
+acotados aunque los usuarios sigan llegando.
+
+Uso:
+    python benchmarks/bench_chat_state.py [--users 50000] [--max-sessions 10000] [--turns 4]
+"""
+import argparse
+import os
+import random
+import secrets
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import sqlite_profile
+from chat_state import MemoryChatStateStore, SQLiteChatStateStore, record_turn, set_results
+
+QUERIES = ['pizza', 'laptop gamer', 'abogado de divorcio', 'zapatos de cuero', 'clases de yoga', 'torta de chocolate']
+REPLY = "Encontré estos productos para ti: " + "detalle del producto, precio y local. " * 20
+
+
+def converse(store, session_id, turns, rng):
+    for _ in range(turns):
+        state = store.load(session_id)
+        query = rng.choice(QUERIES)
+        state['last_query'] = query
+        set_results(state, 'product', rng.sample(range(1, 5000), 4))
+        record_turn(state, 'user', f"busco {query}", store.max_turns)
+        record_turn(state, 'bot', REPLY, store.max_turns)
+        store.save(session_id, state)
+
+
+def run(store, users, turns, checkpoints, measure_memory):
+    rng = random.Random(3)
+    rows = []
+    if measure_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    for n in range(1, users + 1):
+        converse(store, secrets.token_urlsafe(16), turns, rng)
+        if n in checkpoints:
+            memory = tracemalloc.get_traced_memory()[0] / 1e6 if measure_memory else None
+            rows.append((n, store.size(), memory))
+    elapsed = time.perf_counter() - started
+    if measure_memory:
+        tracemalloc.stop()
+    return rows, users * turns / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--max-sessions', type=int, default=10000)
+    parser.add_argument('--turns', type=int, default=4)
+    args = parser.parse_args()
+    checkpoints = {args.users * k // 5 for k in range(1, 6)}
+
+    print(f"{args.users} usuarios x {args.turns} turnos, máximo {args.max_sessions} sesiones\n")
+    memory_rows, memory_rate = run(MemoryChatStateStore(max_sessions=args.max_sessions),
+                                   args.users, args.turns, checkpoints, measure_memory=True)
+
+    workdir = tempfile.mkdtemp(prefix='bench_chat_state_')
+    try:
+        engine = create_engine(f"sqlite:///{os.path.join(workdir, 'bench.db')}", **sqlite_profile.engine_options())
+        sqlite_profile.install(engine)
+        sqlite_rows, sqlite_rate = run(SQLiteChatStateStore(lambda: engine, max_sessions=args.max_sessions),
+                                       args.users, args.turns, checkpoints, measure_memory=False)
+        engine.dispose()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'usuarios':>10}{'sesiones (mem)':>16}{'MB (mem)':>10}{'filas (sqlite)':>16}")
+    for (n, memory_sessions, mb), (_, sqlite_sessions, _) in zip(memory_rows, sqlite_rows):
+        print(f"{n:>10}{memory_sessions:>16}{mb:>10.1f}{sqlite_sessions:>16}")
+    print(f"\nturnos/s: memoria {memory_rate:.0f}, sqlite {sqlite_rate:.0f}")
+
+    assert all(sessions <= args.max_sessions for _, sessions, _ in memory_rows)
+    # SQLite limpia cada PRUNE_EVERY escrituras: puede pasarse como mucho en ese margen
+    assert all(sessions <= args.max_sessions + SQLiteChatStateStore.PRUNE_EVERY for _, sessions, _ in sqlite_rows)
+    peak = [mb for n, _, mb in memory_rows if n >= args.max_sessions]
+    if len(peak) > 1:
+        assert peak[-1] < peak[0] * 1.1, "la memoria siguió creciendo con el número de usuarios"
+    print("✅ Memoria y sesiones acotadas por max_sessions.")
+
+
+if __name__ == '__main__':
+    main()
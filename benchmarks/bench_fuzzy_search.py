@@ -0,0 +1,113 @@
+"""
+Búsqueda con errores de tipeo: comparar la consulta con fuzz.ratio contra
+todos los nombres del catálogo frente a FuzzyNameIndex (fuzzy_index.py),
+que primero reduce a `max_candidates` nombres con el índice de trigramas.
+
+Genera un catálogo sintético, consultas con errores de tipeo sobre nombres
+reales del catálogo, e informa latencia p50/p95 por consulta y qué parte de
+los resultados de la comparación completa recupera el índice (mejor
+puntaje y los 5 mejores puntajes; con empates los ids pueden variar), y
+cuánto cuesta aplicar un nombre editado (upsert) frente a reconstruir.
+
+Uso:
+    python benchmarks/bench_fuzzy_search.py [--names 20000] [--queries 300]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from fuzzy_index import FuzzyNameIndex, phonetic_words
+from thefuzz import fuzz
+
+WORDS = ['pizza', 'hamburguesa', 'abogado', 'laptop', 'celular', 'zapatos', 'vestido', 'torta', 'chocolate',
+         'cappuccino', 'masaje', 'yoga', 'curso', 'manicure', 'tinte', 'barba', 'jardinería', 'maceta',
+         'lámpara', 'alfombra', 'teclado', 'auriculares', 'pantalla', 'batería', 'membresía', 'fotografía',
+         'boda', 'quinceañera', 'contable', 'impuestos', 'divorcio', 'chaqueta', 'polera', 'bolso', 'cuero',
+         'sándwich', 'lasaña', 'café', 'empanada', 'salteña', 'helado', 'jugo', 'licuado', 'sushi', 'tacos']
+ADJECTIVES = ['grande', 'premium', 'clásico', 'express', 'casero', 'moderno', 'deportivo', 'elegante',
+              'mensual', 'familiar', 'especial', 'integral', 'natural', 'rápido', 'económico']
+
+
+def typo(word, rng):
+    """Un error de tipeo: borrar, duplicar o cambiar una letra, o un cambio de ortografía (z/s, v/b, h)."""
+    kind = rng.choice(['delete', 'double', 'swap', 'spelling'])
+    i = rng.randrange(1, len(word) - 1)
+    if kind == 'delete':
+        return word[:i] + word[i + 1:]
+    if kind == 'double':
+        return word[:i] + word[i] + word[i:]
+    if kind == 'swap':
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    for a, b in (('z', 's'), ('s', 'z'), ('v', 'b'), ('b', 'v'), ('gue', 'ge'), ('h', '')):
+        if a in word:
+            return word.replace(a, b, 1)
+    return word[:i] + word[i + 1:]
+
+
+def brute_force(names, query, min_score, limit):
+    query_words = phonetic_words(query)
+    results = []
+    for key, name in names.items():
+        words = phonetic_words(name)
+        if words and query_words:
+            score = sum(max(fuzz.ratio(q, w) for w in words) for q in query_words) / len(query_words)
+            if score >= min_score:
+                results.append((key[0], key[1], round(score)))
+    results.sort(key=lambda item: (-item[2], item[1]))
+    return results[:limit]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--names', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=300)
+    args = parser.parse_args()
+
+    rng = random.Random(5)
+    names = {('product', i): f"{rng.choice(WORDS).title()} {rng.choice(ADJECTIVES)} {rng.randint(1, 999)}"
+             for i in range(1, args.names + 1)}
+    queries = [typo(rng.choice(WORDS), rng) for _ in range(args.queries)]
+
+    index = FuzzyNameIndex(max_ms=1000)
+    started = time.perf_counter()
+    index.rebuild([(kind, key_id, name) for (kind, key_id), name in names.items()])
+    build_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    index.upsert('product', 1, 'Pizza renombrada 1')
+    names[('product', 1)] = 'Pizza renombrada 1'
+    upsert_ms = (time.perf_counter() - started) * 1000
+
+    timings = {'fuzz.ratio contra todo': [], 'FuzzyNameIndex': []}
+    top1 = top5 = comparable = 0
+    for query in queries:
+        started = time.perf_counter()
+        expected = brute_force(names, query, index.min_score, 5)
+        timings['fuzz.ratio contra todo'].append(time.perf_counter() - started)
+        started = time.perf_counter()
+        found = index.search(query, limit=5)
+        timings['FuzzyNameIndex'].append(time.perf_counter() - started)
+        if expected:
+            comparable += 1
+            top1 += bool(found) and found[0][2] == expected[0][2]
+            top5 += [r[2] for r in found] == [r[2] for r in expected]
+
+    print(f"{args.names} nombres, {args.queries} consultas con errores de tipeo; índice construido en {build_ms:.0f} ms, "
+          f"un nombre editado (upsert) en {upsert_ms:.2f} ms\n")
+    print(f"{'estrategia':<26}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, values in timings.items():
+        print(f"{name:<26}{percentile(values, 50) * 1000:>10.2f}{percentile(values, 95) * 1000:>10.2f}")
+    print(f"\nConsultas con resultado en la comparación completa: {comparable}")
+    print(f"El índice encuentra el mejor puntaje en {top1 / comparable:.0%} de las consultas "
+          f"y los mismos 5 mejores puntajes en {top5 / comparable:.0%}")
+
+
+if __name__ == '__main__':
+    main()
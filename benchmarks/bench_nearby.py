@@ -0,0 +1,126 @@
+"""
+Búsqueda por cercanía: recorrer todos los negocios calculando la distancia
+haversine frente al índice R*Tree de geo_index.py (business_geo).
+
+Crea en un SQLite temporal una tabla `businesses` mínima con negocios
+sintéticos alrededor de Santa Cruz, instala el índice y sus triggers, y
+compara ambas estrategias para consultas de radio y de k más cercanos desde
+puntos al azar de la ciudad, y de k más cercanos desde una zona sin negocios
+(alrededor de La Paz, a ~550 km). Comprueba que devuelven los mismos
+negocios e informa latencia p50/p95 por consulta.
+
+Uso:
+    python benchmarks/bench_nearby.py [--businesses 100000] [--queries 100]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+import geo_index
+
+CENTER = (-17.7833, -63.1821)  # Santa Cruz de la Sierra
+FAR_CENTER = (-16.5000, -68.1500)  # La Paz: ningún negocio cerca
+SPREAD = 0.15                  # grados (~16 km) alrededor del centro
+TARGET_MS = 10
+
+
+def full_scan(session, lat, lng, radius_km=None, k=None):
+    """Distancia a todos los negocios activos con coordenadas; luego filtrar y ordenar."""
+    rows = session.execute(text(
+        "SELECT id, latitude, longitude FROM businesses "
+        "WHERE is_active = 1 AND latitude IS NOT NULL AND longitude IS NOT NULL"))
+    found = [(business_id, geo_index.haversine_km(lat, lng, business_lat, business_lng))
+             for business_id, business_lat, business_lng in rows]
+    if radius_km is not None:
+        found = [item for item in found if item[1] <= radius_km]
+    found.sort(key=lambda item: (item[1], item[0]))
+    return found[:k] if k is not None else found
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--businesses', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--radius', type=float, default=1.0, help='radio en km')
+    parser.add_argument('--k', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(21)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'nearby.db')}")
+        with Session(engine) as session:
+            session.execute(text("CREATE TABLE businesses (id INTEGER PRIMARY KEY, latitude REAL, "
+                                 "longitude REAL, is_active BOOLEAN NOT NULL DEFAULT 1)"))
+            assert geo_index.setup_geo_index(session), "este SQLite no tiene R*Tree"
+            # Los triggers llenan business_geo al insertar (5% sin coordenadas, 5% inactivos)
+            session.execute(
+                text("INSERT INTO businesses (id, latitude, longitude, is_active) VALUES (:id, :lat, :lng, :active)"),
+                [{'id': i,
+                  'lat': None if rng.random() < 0.05 else CENTER[0] + rng.uniform(-SPREAD, SPREAD),
+                  'lng': CENTER[1] + rng.uniform(-SPREAD, SPREAD),
+                  'active': rng.random() >= 0.05}
+                 for i in range(1, args.businesses + 1)])
+            session.commit()
+            indexed = session.execute(text("SELECT count(*) FROM business_geo")).scalar()
+
+            points = [(CENTER[0] + rng.uniform(-SPREAD, SPREAD), CENTER[1] + rng.uniform(-SPREAD, SPREAD))
+                      for _ in range(args.queries)]
+            far_points = [(FAR_CENTER[0] + rng.uniform(-SPREAD, SPREAD), FAR_CENTER[1] + rng.uniform(-SPREAD, SPREAD))
+                          for _ in range(args.queries)]
+            cases = {
+                f'radio {args.radius:g} km': (
+                    points,
+                    lambda lat, lng: full_scan(session, lat, lng, radius_km=args.radius),
+                    lambda lat, lng: geo_index.within_radius(session, lat, lng, args.radius)),
+                f'{args.k} más cercanos': (
+                    points,
+                    lambda lat, lng: full_scan(session, lat, lng, k=args.k),
+                    lambda lat, lng: geo_index.nearest(session, lat, lng, args.k)),
+                f'{args.k} desde La Paz': (
+                    far_points,
+                    lambda lat, lng: full_scan(session, lat, lng, k=args.k),
+                    lambda lat, lng: geo_index.nearest(session, lat, lng, args.k)),
+            }
+
+            print(f"{args.businesses} negocios ({indexed} en el R*Tree), {args.queries} consultas\n")
+            print(f"{'consulta':<20}{'estrategia':<16}{'p50 ms':>10}{'p95 ms':>10}")
+            slow = []
+            for name, (case_points, scan, indexed_query) in cases.items():
+                timings = {'recorrido': [], 'R*Tree': []}
+                for lat, lng in case_points:
+                    started = time.perf_counter()
+                    expected = scan(lat, lng)
+                    timings['recorrido'].append(time.perf_counter() - started)
+                    started = time.perf_counter()
+                    found = indexed_query(lat, lng)
+                    timings['R*Tree'].append(time.perf_counter() - started)
+                    assert [i for i, _ in found] == [i for i, _ in expected], (name, lat, lng)
+                for strategy, values in timings.items():
+                    print(f"{name:<20}{strategy:<16}{percentile(values, 50) * 1000:>10.2f}"
+                          f"{percentile(values, 95) * 1000:>10.2f}")
+                if percentile(timings['R*Tree'], 95) * 1000 > TARGET_MS:
+                    slow.append(name)
+
+        engine.dispose()
+
+    print(f"\n✅ Mismos negocios y en el mismo orden en las {args.queries * len(cases)} consultas")
+    if slow:
+        print(f"⚠️ p95 por encima de {TARGET_MS} ms: {', '.join(slow)}")
+    else:
+        print(f"✅ p95 del R*Tree por debajo de {TARGET_MS} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Prueba de carga: miles de reservas concurrentes del mismo producto sobre un
+archivo SQLite, comparando la lógica anterior de create_reservation (leer el
+stock, comprobarlo en Python y escribir el valor nuevo) con el UPDATE
+condicional de inventory.take_stock.
+
+Verifica que con take_stock no haya sobreventa (stock final = inicial -
+unidades reservadas, y nunca negativo) e informa reservas por segundo.
+
+Uso:
+    python benchmarks/bench_reservations.py [--threads 32] [--attempts 4000] [--stock 1000]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from inventory import take_stock
+
+PRODUCT_ID = 1
+
+
+def make_engine(path, threads):
+    engine = create_engine(f"sqlite:///{path}", pool_size=threads, max_overflow=0,
+                           connect_args={'timeout': 30, 'check_same_thread': False})
+
+    @event.listens_for(engine, 'connect')
+    def _pragmas(dbapi_connection, _record):
+        dbapi_connection.execute('PRAGMA journal_mode=WAL')
+
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE products (id INTEGER PRIMARY KEY, stock INTEGER NOT NULL)"))
+        conn.execute(text("CREATE TABLE reservations (id INTEGER PRIMARY KEY, product_id INTEGER, quantity INTEGER)"))
+    return engine
+
+
+def reserve_naive(session, quantity):
+    """Lógica anterior: SELECT, comprobación en Python y UPDATE con el valor calculado."""
+    stock = session.execute(text("SELECT stock FROM products WHERE id = :id"), {'id': PRODUCT_ID}).scalar()
+    if stock < quantity:
+        return False
+    session.execute(text("UPDATE products SET stock = :stock WHERE id = :id"),
+                    {'stock': stock - quantity, 'id': PRODUCT_ID})
+    return True
+
+
+def reserve_atomic(session, quantity):
+    return take_stock(session, PRODUCT_ID, quantity)
+
+
+def run(strategy, threads, attempts, initial_stock, seed=7):
+    workdir = tempfile.mkdtemp(prefix='bench_reservations_')
+    path = os.path.join(workdir, 'bench.db')
+    engine = make_engine(path, threads)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO products (id, stock) VALUES (:id, :stock)"),
+                     {'id': PRODUCT_ID, 'stock': initial_stock})
+
+    rng = random.Random(seed)
+    quantities = [rng.randint(1, 3) for _ in range(attempts)]
+    counters = {'ok': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(threads)
+
+    def worker(chunk):
+        start_barrier.wait()
+        for quantity in chunk:
+            outcome = 'errors'
+            with Session(engine) as session:
+                try:
+                    if strategy(session, quantity):
+                        session.execute(text("INSERT INTO reservations (product_id, quantity) VALUES (:id, :q)"),
+                                        {'id': PRODUCT_ID, 'q': quantity})
+                        session.commit()
+                        outcome = 'ok'
+                    else:
+                        session.rollback()
+                        outcome = 'rejected'
+                except OperationalError:
+                    session.rollback()
+            with lock:
+                counters[outcome] += 1
+
+    workers = [threading.Thread(target=worker, args=(quantities[i::threads],)) for i in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    with engine.connect() as conn:
+        final_stock = conn.execute(text("SELECT stock FROM products WHERE id = :id"), {'id': PRODUCT_ID}).scalar()
+        reserved = conn.execute(text("SELECT coalesce(sum(quantity), 0) FROM reservations")).scalar()
+    engine.dispose()
+    shutil.rmtree(workdir, ignore_errors=True)
+    # Unidades reservadas que nunca se descontaron del stock (actualizaciones perdidas)
+    oversold = max(0, reserved - (initial_stock - final_stock))
+    return {
+        'elapsed': elapsed,
+        'throughput': attempts / elapsed,
+        'final_stock': final_stock,
+        'reserved': reserved,
+        'consistent': final_stock == initial_stock - reserved and final_stock >= 0,
+        'oversold': oversold,
+        **counters,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--attempts', type=int, default=4000)
+    parser.add_argument('--stock', type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{args.threads} hilos, {args.attempts} intentos de reserva (1-3 u.), stock inicial {args.stock}\n")
+    print(f"{'estrategia':<22}{'seg':>8}{'intentos/s':>12}{'ok':>7}{'sin stock':>11}{'errores':>9}"
+          f"{'reservado':>11}{'stock final':>13}{'sobreventa':>12}")
+    results = {}
+    for name, strategy in (('leer + escribir', reserve_naive), ('UPDATE condicional', reserve_atomic)):
+        r = results[name] = run(strategy, args.threads, args.attempts, args.stock)
+        print(f"{name:<22}{r['elapsed']:>8.2f}{r['throughput']:>12.0f}{r['ok']:>7}{r['rejected']:>11}"
+              f"{r['errors']:>9}{r['reserved']:>11}{r['final_stock']:>13}{r['oversold']:>12}")
+
+    atomic = results['UPDATE condicional']
+    assert atomic['consistent'], "take_stock dejó el stock inconsistente con las reservas"
+    assert atomic['reserved'] <= args.stock, "take_stock vendió más unidades que el stock inicial"
+    print("\n✅ UPDATE condicional: sin sobreventa (stock final = inicial - reservado).")
+
+
+if __name__ == '__main__':
+    main()
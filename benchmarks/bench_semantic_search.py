@@ -0,0 +1,128 @@
+"""
+Búsqueda por significado: puntuar cada producto en un bucle de Python
+(producto punto de diccionarios) frente a SemanticProductIndex
+(semantic_index.py), que hace un único producto matriz-vector con NumPy
+sobre la matriz TF-IDF guardada en disco y abierta con mmap.
+
+Genera un catálogo sintético, construye y publica la matriz en un directorio
+temporal, comprueba que ambas versiones devuelven los mismos 10 mejores
+productos e informa latencia p50/p95 por consulta, tiempo de construcción,
+tamaño en disco, tiempo de carga de un worker nuevo y la búsqueda más lenta
+mientras el worker reconstruye la matriz en segundo plano tras un invalidate().
+
+Uso:
+    python benchmarks/bench_semantic_search.py [--products 50000] [--queries 100]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from chat_intents import ChatMatcher
+from semantic_index import SemanticProductIndex
+
+NOUNS = ['masaje', 'terapia', 'clase', 'curso', 'pizza', 'torta', 'café', 'laptop', 'celular', 'pantalla',
+         'batería', 'corte', 'tinte', 'vestido', 'zapatillas', 'chaqueta', 'sofá', 'lámpara', 'maceta',
+         'contrato', 'divorcio', 'auditoría', 'membresía', 'entrenamiento', 'fotos', 'video', 'boda']
+WORDS = ['relajante', 'espalda', 'tensiones', 'energía', 'calma', 'niveles', 'grupal', 'individual',
+         'horno', 'queso', 'chocolate', 'mantenimiento', 'reparación', 'rápida', 'garantía', 'moderno',
+         'elegante', 'fiesta', 'cuero', 'jardín', 'decoración', 'legal', 'empresa', 'impuestos', 'mensual',
+         'nutrición', 'evento', 'recuerdo', 'profesional', 'calidad', 'precio', 'envío', 'santa', 'cruz']
+QUERIES = ['algo para el dolor de espalda', 'quiero bajar de peso', 'mi computadora está lenta',
+           'regalo de cumpleaños', 'se me rompió el celular', 'algo para el estrés', 'tengo un examen',
+           'zapatillas para correr', 'decorar la sala', 'pizza con queso', 'fotos de boda', 'contador']
+
+
+def sentence(rng, length):
+    return ' '.join(rng.choice(WORDS) for _ in range(length))
+
+
+def loop_search(index, doc_vectors, query, limit, min_score):
+    """Misma puntuación que SemanticProductIndex.search, recorriendo los productos uno a uno."""
+    columns, weights = index.query_vector(query)
+    query_weights = dict(zip(columns.tolist(), weights.tolist()))
+    results = []
+    for product_id, vector in doc_vectors:
+        score = sum(query_weights.get(c, 0.0) * v for c, v in vector)
+        if score >= min_score:
+            results.append((product_id, score))
+    results.sort(key=lambda item: (-item[1], item[0]))
+    return results[:limit]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=100)
+    args = parser.parse_args()
+
+    rng = random.Random(22)
+    rows = [(i, f"{rng.choice(NOUNS).title()} {rng.choice(WORDS)}", sentence(rng, rng.randint(6, 18)),
+             sentence(rng, rng.randint(8, 20))) for i in range(1, args.products + 1)]
+    matcher = ChatMatcher.from_file()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = SemanticProductIndex(tmp, stop_words=matcher.stop_words, related_terms=matcher.related_terms)
+        started = time.perf_counter()
+        index.ensure_built(lambda: rows)
+        build_ms = (time.perf_counter() - started) * 1000
+        disk_mb = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp)) / 1e6
+
+        # Un worker nuevo solo abre los archivos con mmap
+        started = time.perf_counter()
+        worker = SemanticProductIndex(tmp, stop_words=matcher.stop_words, related_terms=matcher.related_terms)
+        worker.ensure_built(lambda: [])
+        load_ms = (time.perf_counter() - started) * 1000
+        assert worker.stats()['rows'] == args.products
+
+        arrays = index._arrays
+        doc_vectors = [(product_id, []) for product_id in arrays['ids'].tolist()]
+        for column in range(len(arrays['indptr']) - 1):
+            start, end = arrays['indptr'][column], arrays['indptr'][column + 1]
+            for row, value in zip(arrays['rows'][start:end].tolist(), arrays['data'][start:end].tolist()):
+                doc_vectors[row][1].append((column, value))
+
+        queries = [rng.choice(QUERIES) for _ in range(args.queries)]
+        timings = {'bucle de Python': [], 'NumPy (mmap)': []}
+        for query in queries:
+            started = time.perf_counter()
+            expected = loop_search(index, doc_vectors, query, 10, 0.05)
+            timings['bucle de Python'].append(time.perf_counter() - started)
+            started = time.perf_counter()
+            found = worker.search(query, limit=10, min_score=0.05)
+            timings['NumPy (mmap)'].append(time.perf_counter() - started)
+            assert [i for i, _ in found] == [i for i, _ in expected], query
+            assert all(abs(a[1] - b[1]) < 1e-4 for a, b in zip(found, expected)), query
+
+        # Búsquedas mientras el worker reconstruye en segundo plano (no toma el lock de búsqueda)
+        generation = worker.stats()['generation']
+        worker.invalidate()
+        worker.ensure_built(lambda: rows)
+        slowest = 0.0
+        searches = 0
+        while worker._thread.is_alive():
+            started = time.perf_counter()
+            worker.search(rng.choice(QUERIES), limit=10, min_score=0.05)
+            slowest = max(slowest, time.perf_counter() - started)
+            searches += 1
+        assert worker.stats()['generation'] != generation
+
+    print(f"{args.products} productos, {args.queries} consultas")
+    print(f"Construcción: {build_ms:.0f} ms; {disk_mb:.1f} MB en disco; carga en un worker nuevo: {load_ms:.1f} ms\n")
+    print(f"{'estrategia':<20}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, values in timings.items():
+        print(f"{name:<20}{percentile(values, 50) * 1000:>10.2f}{percentile(values, 95) * 1000:>10.2f}")
+    print(f"\nDurante una reconstrucción en segundo plano: {searches} búsquedas, la más lenta {slowest * 1000:.1f} ms")
+    print(f"\n✅ Mismos 10 mejores productos en las {args.queries} consultas")
+
+
+if __name__ == '__main__':
+    main()
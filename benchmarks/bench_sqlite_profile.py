@@ -0,0 +1,163 @@
+"""
+Concurrencia lectores/escritores sobre SQLite con los PRAGMA por defecto
+(journal de rollback, synchronous=FULL) frente al perfil de sqlite_profile
+(WAL, synchronous=NORMAL, busy_timeout, mmap...).
+
+Simula varios workers (procesos) sobre un mismo archivo con datos
+sintéticos: los lectores repiten las consultas de la portada y del perfil,
+y los escritores registran visitas con un commit por evento, como hacía
+profile(). Informa operaciones por segundo, latencias y errores
+"database is locked" de cada perfil.
+
+Uso:
+    python benchmarks/bench_sqlite_profile.py [--readers 6] [--writers 2] [--seconds 5]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import sqlite_profile
+
+BUSINESSES = 2_000
+PRODUCTS_PER_BUSINESS = 10
+USERS = 5_000
+
+PROFILES = {
+    'por defecto': None,
+    'sqlite_profile': sqlite_profile.DEFAULT_PRAGMAS,
+}
+
+
+def make_engine(path, pragmas):
+    if pragmas is None:
+        return create_engine(f"sqlite:///{path}")
+    engine = create_engine(f"sqlite:///{path}", **sqlite_profile.engine_options(pragmas, pool_size=2, max_overflow=0))
+    sqlite_profile.install(engine, pragmas)
+    return engine
+
+
+def build_dataset(path, pragmas, seed=1):
+    rng = random.Random(seed)
+    engine = make_engine(path, pragmas)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE businesses (id INTEGER PRIMARY KEY, name TEXT, description TEXT, "
+                          "category TEXT, is_active BOOLEAN NOT NULL)"))
+        conn.execute(text("CREATE TABLE products (id INTEGER PRIMARY KEY, business_id INTEGER NOT NULL "
+                          "REFERENCES businesses(id), name TEXT, price REAL, stock INTEGER)"))
+        conn.execute(text("CREATE INDEX ix_products_business ON products (business_id)"))
+        conn.execute(text("CREATE TABLE business_views (user_id INTEGER, business_id INTEGER, "
+                          "PRIMARY KEY (user_id, business_id))"))
+        conn.execute(text("INSERT INTO businesses VALUES (:id, :name, :description, :category, 1)"), [
+            {'id': i, 'name': f"Negocio {i}", 'description': 'descripción ' * rng.randint(5, 30),
+             'category': rng.choice(['Gastronomía', 'Moda y Ropa', 'Tecnología', 'Otros'])}
+            for i in range(1, BUSINESSES + 1)])
+        conn.execute(text("INSERT INTO products (business_id, name, price, stock) VALUES (:b, :name, :price, :stock)"), [
+            {'b': b, 'name': f"Producto {b}-{j}", 'price': rng.uniform(5, 500), 'stock': rng.randint(0, 50)}
+            for b in range(1, BUSINESSES + 1) for j in range(PRODUCTS_PER_BUSINESS)])
+    engine.dispose()
+
+
+def reader(path, pragmas, seconds, seed, out):
+    rng = random.Random(seed)
+    engine = make_engine(path, pragmas)
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    with engine.connect() as conn:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                if rng.random() < 0.5:
+                    conn.execute(text("SELECT * FROM businesses WHERE is_active = 1 AND id < :cursor "
+                                      "ORDER BY id DESC LIMIT 24"), {'cursor': rng.randint(25, BUSINESSES)}).all()
+                else:
+                    business_id = rng.randint(1, BUSINESSES)
+                    conn.execute(text("SELECT * FROM businesses WHERE id = :id"), {'id': business_id}).all()
+                    conn.execute(text("SELECT * FROM products WHERE business_id = :id"), {'id': business_id}).all()
+                    conn.execute(text("SELECT count(*) FROM business_views WHERE business_id = :id"),
+                                 {'id': business_id}).scalar()
+                conn.rollback()
+                latencies.append(time.perf_counter() - started)
+            except OperationalError:
+                conn.rollback()
+                errors += 1
+    engine.dispose()
+    out.put(('read', latencies, errors))
+
+
+def writer(path, pragmas, seconds, seed, out):
+    rng = random.Random(seed)
+    engine = make_engine(path, pragmas)
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("INSERT OR IGNORE INTO business_views (user_id, business_id) VALUES (:u, :b)"),
+                             {'u': rng.randint(1, USERS), 'b': rng.randint(1, BUSINESSES)})
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            errors += 1
+    engine.dispose()
+    out.put(('write', latencies, errors))
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(pragmas, readers, writers, seconds):
+    workdir = tempfile.mkdtemp(prefix='bench_sqlite_')
+    path = os.path.join(workdir, 'bench.db')
+    try:
+        build_dataset(path, pragmas)
+        out = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=reader, args=(path, pragmas, seconds, i, out)) for i in range(readers)]
+        procs += [multiprocessing.Process(target=writer, args=(path, pragmas, seconds, 1000 + i, out))
+                  for i in range(writers)]
+        for p in procs:
+            p.start()
+        results = {'read': ([], 0), 'write': ([], 0)}
+        for _ in procs:
+            kind, latencies, errors = out.get()
+            results[kind] = (results[kind][0] + latencies, results[kind][1] + errors)
+        for p in procs:
+            p.join()
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--readers', type=int, default=6)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{args.readers} procesos lectores, {args.writers} escritores, {args.seconds:.0f} s por perfil; "
+          f"{BUSINESSES} negocios, {BUSINESSES * PRODUCTS_PER_BUSINESS} productos\n")
+    print(f"{'perfil':<16}{'tipo':<8}{'ops/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'bloqueos':>10}")
+    for name, pragmas in PROFILES.items():
+        results = run(pragmas, args.readers, args.writers, args.seconds)
+        for kind, label in (('read', 'lectura'), ('write', 'escritura')):
+            latencies, errors = results[kind]
+            print(f"{name:<16}{label:<8}{len(latencies) / args.seconds:>9.0f}"
+                  f"{percentile(latencies, 50) * 1000:>9.2f}{percentile(latencies, 95) * 1000:>9.2f}"
+                  f"{percentile(latencies, 99) * 1000:>9.2f}{errors:>10}")
+
+
+if __name__ == '__main__':
+    main()
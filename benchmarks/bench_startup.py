@@ -0,0 +1,68 @@
+"""
+Tiempo de arranque en frío: importar app.py y atender la primera petición,
+cada vez en un proceso nuevo (como un worker recién creado o un script que
+hace `init_app()`).
+
+Informa la mediana y el peor caso de N arranques y si google.generativeai
+llegó a importarse. La primera ejecución aplica el esquema (PRAGMA
+user_version) y llena el caché de bytecode de Jinja; las siguientes miden el
+arranque normal.
+
+Uso:
+    python benchmarks/bench_startup.py [--runs 7] [--path /]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+CHILD = r"""
+import json, sys, time
+started = time.perf_counter()
+import app as appmod
+flask_app = appmod.init_app()
+imported = time.perf_counter()
+response = flask_app.test_client().get(sys.argv[1])
+finished = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (finished - imported) * 1000,
+    'status': response.status_code,
+    'genai_imported': 'google.generativeai' in sys.modules,
+}))
+"""
+
+
+def boot(path):
+    output = subprocess.run([sys.executable, '-W', 'ignore', '-c', CHILD, path], cwd=ROOT,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--path', default='/')
+    args = parser.parse_args()
+
+    first = boot(args.path)
+    runs = [boot(args.path) for _ in range(args.runs)]
+
+    print(f"Primer arranque (aplica esquema y compila plantillas): import {first['import_ms']:.0f} ms, "
+          f"primera petición {first['first_request_ms']:.0f} ms\n")
+    print(f"{'':<20}{'mediana ms':>12}{'máx ms':>10}")
+    for key, label in (('import_ms', 'init_app()'), ('first_request_ms', f"GET {args.path}")):
+        values = [r[key] for r in runs]
+        print(f"{label:<20}{statistics.median(values):>12.0f}{max(values):>10.0f}")
+    total = [r['import_ms'] + r['first_request_ms'] for r in runs]
+    print(f"{'total':<20}{statistics.median(total):>12.0f}{max(total):>10.0f}")
+    print(f"\nstatus {runs[-1]['status']}; google.generativeai importado: "
+          f"{'sí' if any(r['genai_imported'] for r in runs) else 'no'}")
+
+
+if __name__ == '__main__':
+    main()
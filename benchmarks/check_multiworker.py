@@ -0,0 +1,209 @@
+"""
+Verificación del modo multi-worker: arranca gunicorn (gunicorn.conf.py, con
+preload_app) con varios workers sobre una copia de comuni_ia.db y lanza
+peticiones concurrentes de lectura (portada, /api/businesses) y de escritura
+(registro de clientes y reservas del mismo producto).
+
+Comprueba que:
+- todas las respuestas son las esperadas (sin errores 500 ni "database is locked");
+- el proceso maestro no conserva conexiones abiertas a la base (init_app()
+  las cierra antes del fork) y cada worker abre las suyas;
+- al terminar, el stock del producto = inicial - unidades reservadas, y
+  PRAGMA integrity_check / foreign_key_check están limpios.
+
+Si alguna comprobación falla termina con código de salida distinto de 0, así
+que se puede ejecutar tal cual en CI. Cada ejecución arranca un gunicorn nuevo
+porque init_app() no es una fábrica: la configuración se pasa por FLASK_*.
+
+Uso:
+    python benchmarks/check_multiworker.py [--workers 4] [--clients 24] [--reservations 10] [--stock 150]
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def prepare_database(workdir, stock):
+    """Copia la base a `workdir` y fija el stock de un producto. Devuelve (ruta, product_id)."""
+    path = os.path.join(workdir, 'comuni_ia.db')
+    shutil.copy(os.path.join(ROOT, 'comuni_ia.db'), path)
+    with sqlite3.connect(path) as conn:
+        product_id = conn.execute("SELECT p.id FROM products p JOIN businesses b ON b.id = p.business_id "
+                                  "WHERE b.is_active = 1 ORDER BY p.id LIMIT 1").fetchone()[0]
+        conn.execute("UPDATE products SET stock = ? WHERE id = ?", (stock, product_id))
+        conn.execute("DELETE FROM reservations WHERE product_id = ?", (product_id,))
+    return path, product_id
+
+
+def start_server(workdir, db_path, port, workers):
+    env = dict(os.environ,
+               GUNICORN_BIND=f"127.0.0.1:{port}",
+               GUNICORN_WORKERS=str(workers),
+               GUNICORN_LOGLEVEL='warning',
+               FLASK_SQLALCHEMY_DATABASE_URI=f"sqlite:///{db_path}",
+               FLASK_UPLOADED_IMAGES_DEST=os.path.join(workdir, 'uploads'),
+               FLASK_JINJA_BYTECODE_CACHE_DIR=os.path.join(workdir, 'jinja'),
+               FLASK_IMAGE_PIPELINE_ENABLED='false',
+               FLASK_QUERY_STATS_ENABLED='false')
+    os.makedirs(env['FLASK_UPLOADED_IMAGES_DEST'])
+    log = open(os.path.join(workdir, 'gunicorn.log'), 'w')
+    proc = subprocess.Popen([sys.executable, '-W', 'ignore', '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                             '--access-logfile', '/dev/null', 'wsgi:app'],
+                            cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            break
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/businesses?limit=1", timeout=2)
+            return proc
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.3)
+    proc.kill()
+    log.close()
+    sys.exit("❌ gunicorn no arrancó:\n" + open(log.name).read())
+
+
+def children(pid):
+    pids = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return pids
+
+
+def open_db_handles(pid, db_path):
+    """Descriptores del proceso `pid` que apuntan al archivo de la base (o a su -wal/-shm)."""
+    handles = 0
+    try:
+        for fd in os.listdir(f"/proc/{pid}/fd"):
+            try:
+                if os.readlink(f"/proc/{pid}/fd/{fd}").startswith(db_path):
+                    handles += 1
+            except OSError:
+                pass
+    except OSError:
+        pass
+    return handles
+
+
+def client_session(base, index, product_id, reservations, results):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def call(path, data=None, json_body=None):
+        headers = {}
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            data = urllib.parse.urlencode(data).encode()
+        try:
+            with opener.open(urllib.request.Request(base + path, data=data, headers=headers), timeout=30) as r:
+                return r.status, r.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    email = f"multiworker{index}@example.com"
+    status, _ = call('/register_client', {'email': email, 'password': 'secreto123', 'confirm_password': 'secreto123'})
+    results.append(('registro', status, status == 200))
+    for n in range(reservations):
+        status, body = call('/api/reservations', json_body={'product_id': product_id, 'quantity': 1})
+        ok = status == 200 or (status == 400 and 'Stock insuficiente' in body.decode())
+        results.append(('reserva', status, ok))
+        path = '/' if n % 2 else "/api/businesses?limit=10&fields=id,name,rating"
+        status, _ = call(path)
+        results.append(('lectura', status, status == 200))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=24)
+    parser.add_argument('--reservations', type=int, default=10)
+    parser.add_argument('--stock', type=int, default=150)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='check_multiworker_')
+    proc = None
+    try:
+        db_path, product_id = prepare_database(workdir, args.stock)
+        port = free_port()
+        proc = start_server(workdir, db_path, port, args.workers)
+        base = f"http://127.0.0.1:{port}"
+        print(f"gunicorn con {args.workers} workers; {args.clients} clientes x "
+              f"{args.reservations} reservas del producto {product_id} (stock {args.stock})\n")
+
+        results = []
+        threads = [threading.Thread(target=client_session, args=(base, i, product_id, args.reservations, results))
+                   for i in range(args.clients)]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        master_handles = open_db_handles(proc.pid, db_path)
+        worker_handles = {pid: open_db_handles(pid, db_path) for pid in children(proc.pid)}
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    try:
+        with sqlite3.connect(db_path) as conn:
+            final_stock = conn.execute("SELECT stock FROM products WHERE id = ?", (product_id,)).fetchone()[0]
+            reserved = conn.execute("SELECT coalesce(sum(quantity), 0) FROM reservations WHERE product_id = ?",
+                                    (product_id,)).fetchone()[0]
+            users = conn.execute("SELECT count(*) FROM users WHERE email LIKE 'multiworker%'").fetchone()[0]
+            integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            fk_errors = conn.execute("PRAGMA foreign_key_check").fetchall()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'tipo':<10}{'peticiones':>12}{'fallidas':>10}")
+    for kind in ('registro', 'reserva', 'lectura'):
+        rows = [r for r in results if r[0] == kind]
+        print(f"{kind:<10}{len(rows):>12}{sum(not ok for _, _, ok in rows):>10}")
+    print(f"\n{len(results) / elapsed:.0f} peticiones/s; conexiones a la base: maestro {master_handles}, "
+          f"workers {sorted(worker_handles.values())}")
+    print(f"stock final {final_stock}, reservado {reserved}, usuarios creados {users}, "
+          f"integrity_check {integrity}, claves foráneas rotas {len(fk_errors)}")
+
+    failures = [r for r in results if not r[2]]
+    assert not failures, f"respuestas inesperadas: {failures[:5]}"
+    assert master_handles == 0, "el proceso maestro conserva conexiones a la base después del fork"
+    assert sum(1 for h in worker_handles.values() if h) >= 2, "menos de dos workers abrieron la base"
+    assert users == args.clients, "faltan usuarios registrados"
+    assert final_stock == args.stock - reserved and final_stock >= 0, "stock inconsistente con las reservas"
+    assert integrity == 'ok' and not fk_errors, "la base quedó inconsistente"
+    print("\n✅ Varios workers sobre la misma base: sin errores, sin conexiones compartidas y stock consistente.")
+
+
+if __name__ == '__main__':
+    main()
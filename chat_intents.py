@@ -0,0 +1,139 @@
+"""
+Intención y categoría de los mensajes del chat.
+
+Las palabras clave están en chat_intents.json y se compilan una sola vez al
+importar, en dos expresiones regulares: una para las intenciones (búsqueda y
+asistente) y otra para las categorías. `ChatMatcher.match()` recorre el
+mensaje una vez y devuelve la intención, el término a buscar y la categoría.
+
+Reglas:
+- Se compara en minúsculas y sin tildes ('dónde' = 'donde').
+- Las palabras clave coinciden con palabras completas, admitiendo el plural:
+  'producto' encuentra 'productos', pero 'hay' no encuentra 'hayas'.
+- Las categorías coinciden con el comienzo de una palabra del término:
+  'foto' encuentra 'fotografía' y 'laptop' encuentra 'laptops'.
+- Si coinciden varias, gana la que aparece primero en el archivo.
+"""
+import json
+import os
+import re
+import unicodedata
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chat_intents.json')
+
+# Letra acentuada -> letra base. Solo caracteres que se reducen a uno, así el texto
+# normalizado tiene la misma longitud y sus posiciones sirven para el original.
+_FOLD_TABLE = {}
+for _code in range(0xC0, 0x250):
+    _base = ''.join(c for c in unicodedata.normalize('NFKD', chr(_code)) if not unicodedata.combining(c))
+    if len(_base) == 1 and _base != chr(_code):
+        _FOLD_TABLE[_code] = _base
+
+_EDGE_PUNCTUATION = ' !.,¡¿?'
+
+
+def fold(value):
+    """Minúsculas y sin tildes, con la misma longitud que `value.lower()`."""
+    return value.lower().translate(_FOLD_TABLE)
+
+
+def _alternation(keywords):
+    return '|'.join(re.escape(keyword) for keyword in keywords)
+
+
+def _priorities(keywords):
+    """Palabra clave normalizada -> posición en la lista (la primera aparición gana)."""
+    priorities = {}
+    for index, keyword in enumerate(keywords):
+        priorities.setdefault(fold(keyword), index)
+    return priorities
+
+
+class ChatMatcher:
+
+    def __init__(self, data):
+        self.search_priority = _priorities(data['search_keywords'])
+        self.assistant_priority = _priorities(data['assistant_keywords'])
+        self.affirmatives = frozenset(fold(word) for word in data['affirmatives'])
+        self.stop_words = frozenset(fold(word) for word in data['stop_words'])
+        # Grupos de palabras de un mismo tema, para la búsqueda por significado (semantic_index.py)
+        self.related_terms = [tuple(fold(word) for word in group) for group in data.get('related_terms', [])]
+
+        search = _alternation(sorted(self.search_priority, key=self.search_priority.get))
+        assistant = _alternation(sorted(self.assistant_priority, key=self.assistant_priority.get))
+        # En cada inicio de palabra, como mucho una palabra clave de cada tipo: la de mayor prioridad
+        self._intent_re = re.compile(
+            rf"\b(?:(?=(?P<search>{search})(?P<plural>e?s)?\b))?(?:(?=(?P<assistant>{assistant})(?:e?s)?\b))?")
+
+        self.category_of = {}
+        category_keywords = []
+        for category, keywords in data['categories']:
+            for keyword in keywords:
+                keyword = fold(keyword)
+                if keyword not in self.category_of:
+                    self.category_of[keyword] = category
+                    category_keywords.append(keyword)
+        self._category_priority = {keyword: i for i, keyword in enumerate(category_keywords)}
+        self._category_re = re.compile(rf"\b({_alternation(category_keywords)})")
+
+    @classmethod
+    def from_file(cls, path=DATA_FILE):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def match(self, message):
+        """
+        Devuelve {'search', 'assistant', 'affirmative', 'term', 'own_term', 'category'}:
+        los tres indicadores de intención, el término de búsqueda (texto que
+        sigue a la palabra clave de búsqueda, sin palabras vacías; si no sigue
+        nada, el mensaje entero y `own_term` es False) y la categoría de ese
+        término ('' y None si no es una búsqueda). Un mensaje que pide consejo
+        y cuya palabra de búsqueda no trae qué buscar ("¿Cómo mejorar mis
+        ventas?") no es una búsqueda.
+        """
+        lowered = message.lower()
+        folded = lowered.translate(_FOLD_TABLE)
+
+        best_search = None  # (prioridad, fin de la palabra clave con su plural)
+        assistant = False
+        for m in self._intent_re.finditer(folded):
+            keyword = m.group('search')
+            if keyword is not None:
+                priority = self.search_priority[keyword]
+                if best_search is None or priority < best_search[0]:
+                    best_search = (priority, m.end('plural') if m.group('plural') else m.end('search'))
+            if m.group('assistant') is not None:
+                assistant = True
+
+        term = ''
+        own_term = False
+        category = None
+        if best_search is not None:
+            extracted = lowered[best_search[1]:]
+            words = [word for word in extracted.split() if fold(word) not in self.stop_words and len(word) > 1]
+            term = ' '.join(words).strip()
+            own_term = bool(term.strip(_EDGE_PUNCTUATION))
+            if not own_term and assistant:
+                best_search, term = None, ''
+            else:
+                term = term if own_term else message
+                category = self.category(term)
+
+        return {
+            'search': best_search is not None,
+            'assistant': assistant,
+            'affirmative': folded.strip(_EDGE_PUNCTUATION) in self.affirmatives,
+            'term': term,
+            'own_term': own_term,
+            'category': category,
+        }
+
+    def category(self, term):
+        """Categoría de la primera palabra clave (en el orden del archivo) con la que empieza alguna palabra."""
+        best = None  # (prioridad, palabra clave)
+        for m in self._category_re.finditer(fold(term)):
+            keyword = m.group(1)
+            priority = self._category_priority[keyword]
+            if best is None or priority < best[0]:
+                best = (priority, keyword)
+        return self.category_of[best[1]] if best else None
@@ -0,0 +1,154 @@
+"""
+Estado de la conversación del chat, por sesión.
+
+Cada visitante tiene un id de sesión (guardado en la cookie de Flask) y su
+estado: la última búsqueda, los ids de los últimos resultados y las últimas
+`max_turns` intervenciones (recortadas a `MAX_TEXT` caracteres). Así el "sí"
+de un usuario reintenta su propia búsqueda y no la de otro.
+
+Dos almacenamientos con la misma interfaz, ambos LRU con TTL y acotados a
+`max_sessions` (memoria constante con miles de usuarios):
+
+- MemoryChatStateStore: OrderedDict por proceso.
+- SQLiteChatStateStore: tabla `chat_sessions`, compartida por todos los
+  workers que usan la misma base de datos.
+"""
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+MAX_TEXT = 300          # caracteres guardados por intervención
+MAX_RESULT_IDS = 10
+
+
+def new_state():
+    return {'last_query': '', 'last_result_type': None, 'last_result_ids': [], 'history': []}
+
+
+def record_turn(state, role, message, max_turns):
+    """Añade una intervención ('user' o 'bot') y descarta las más antiguas."""
+    state['history'].append([role, message[:MAX_TEXT]])
+    del state['history'][:-max_turns]
+
+
+def set_results(state, result_type, ids):
+    state['last_result_type'] = result_type if ids else None
+    state['last_result_ids'] = list(ids)[:MAX_RESULT_IDS]
+
+
+class ChatStateStore:
+    """Interfaz común: load/save por id de sesión y métricas."""
+
+    def __init__(self, max_sessions=10000, ttl=30 * 60, max_turns=6):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+
+    def load(self, session_id):
+        """Estado de la sesión (uno nuevo si no existe o expiró). Se puede modificar y pasar a save()."""
+        state = self._load(session_id) if session_id else None
+        return state if state is not None else new_state()
+
+    def save(self, session_id, state):
+        if session_id:
+            self._save(session_id, state)
+
+    def stats(self):
+        return {'backend': self.backend, 'sessions': self.size(), 'max_sessions': self.max_sessions}
+
+
+class MemoryChatStateStore(ChatStateStore):
+    backend = 'memory'
+
+    def __init__(self, max_sessions=10000, ttl=30 * 60, max_turns=6):
+        super().__init__(max_sessions, ttl, max_turns)
+        self._lock = threading.Lock()
+        self._states = OrderedDict()  # session_id -> (estado en JSON, expires_at)
+
+    def _load(self, session_id):
+        with self._lock:
+            entry = self._states.get(session_id)
+            if entry is None:
+                return None
+            encoded, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._states[session_id]
+                return None
+            self._states.move_to_end(session_id)
+        # Se guarda serializado: cada petición recibe su propia copia
+        return json.loads(encoded)
+
+    def _save(self, session_id, state):
+        encoded = json.dumps(state, ensure_ascii=False)
+        with self._lock:
+            self._states[session_id] = (encoded, time.monotonic() + self.ttl)
+            self._states.move_to_end(session_id)
+            while len(self._states) > self.max_sessions:
+                self._states.popitem(last=False)
+
+    def size(self):
+        return len(self._states)
+
+
+class SQLiteChatStateStore(ChatStateStore):
+    """
+    Mismo almacenamiento sobre una tabla SQLite. `get_engine` devuelve el
+    engine de SQLAlchemy; cada operación usa su propia conexión.
+    """
+    backend = 'sqlite'
+    PRUNE_EVERY = 200  # escrituras entre limpiezas de sesiones expiradas/sobrantes
+
+    def __init__(self, get_engine, max_sessions=10000, ttl=30 * 60, max_turns=6):
+        super().__init__(max_sessions, ttl, max_turns)
+        self.get_engine = get_engine
+        self._ready = False
+        self._writes = itertools.count(1)  # next() es atómico: sin lock entre hilos
+
+    def _ensure_table(self, conn):
+        if self._ready:
+            return
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS chat_sessions (
+                session_id VARCHAR(64) PRIMARY KEY,
+                state      TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_chat_sessions_updated_at ON chat_sessions (updated_at)"))
+        self._ready = True
+
+    def _load(self, session_id):
+        with self.get_engine().begin() as conn:
+            self._ensure_table(conn)
+            encoded = conn.execute(text(
+                "SELECT state FROM chat_sessions WHERE session_id = :id AND updated_at >= :oldest"
+            ), {'id': session_id, 'oldest': time.time() - self.ttl}).scalar()
+        return json.loads(encoded) if encoded is not None else None
+
+    def _save(self, session_id, state):
+        now = time.time()
+        write_number = next(self._writes)
+        with self.get_engine().begin() as conn:
+            self._ensure_table(conn)
+            conn.execute(text(
+                "INSERT OR REPLACE INTO chat_sessions (session_id, state, updated_at) VALUES (:id, :state, :now)"
+            ), {'id': session_id, 'state': json.dumps(state, ensure_ascii=False), 'now': now})
+            if write_number % self.PRUNE_EVERY == 0:
+                self._prune(conn, now)
+
+    def _prune(self, conn, now):
+        conn.execute(text("DELETE FROM chat_sessions WHERE updated_at < :oldest"), {'oldest': now - self.ttl})
+        conn.execute(text(
+            "DELETE FROM chat_sessions WHERE session_id IN ("
+            "  SELECT session_id FROM chat_sessions"
+            "  ORDER BY updated_at DESC LIMIT -1 OFFSET :max_sessions)"
+        ), {'max_sessions': self.max_sessions})
+
+    def size(self):
+        with self.get_engine().begin() as conn:
+            self._ensure_table(conn)
+            return conn.execute(text("SELECT count(*) FROM chat_sessions")).scalar()
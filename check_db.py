@@ -6,7 +6,9 @@ import os
 
 # --- MEJORA: Reemplazar ruta fija por una dinámica ---
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
-from app import app, db, User, Business
+from app import init_app, db, User, Business
+
+app = init_app()
 
 # Arreglar usuarios sin business_id vinculado
 with app.app_context():
@@ -0,0 +1,239 @@
+"""
+Búsqueda tolerante a errores de tipeo ("pisa", "hamburgesa", "abogdo") sobre
+los nombres de productos y negocios.
+
+Comparar la consulta con `fuzz.ratio` contra todo el catálogo costaría una
+comparación cara por nombre. En su lugar:
+
+1. Cada palabra de los nombres se reduce a una clave fonética del español
+   (sin tildes, z/ce/ci -> s, v -> b, qu -> k, gue/gui -> ge/gi, sin h muda
+   ni letras dobles), así "pizza" y "pisa" quedan en "pisa".
+2. Un índice invertido de trigramas de caracteres (con bordes de palabra)
+   apunta de cada trigrama a los nombres que lo contienen.
+3. Para una consulta se cuentan los trigramas compartidos y solo los
+   `max_candidates` nombres con más coincidencias se puntúan con `fuzz.ratio`
+   palabra a palabra. La puntuación de un nombre es el promedio, por palabra
+   de la consulta, de la mejor similitud con alguna palabra del nombre.
+   Los trigramas se cuentan del menos al más frecuente y de cada lista se
+   leen como mucho MAX_POSTING nombres: un trigrama común (" pi" en miles
+   de pizzas) suma a los nombres que ya son candidatos y agrega solo una
+   muestra de nombres nuevos.
+4. Si se pasa el tiempo máximo (`max_ms`), al contar o al puntuar, se
+   devuelve lo puntuado hasta ahí.
+
+Como ProductSearchIndex, el índice es por worker, se construye en el primer
+uso y se actualiza de forma incremental (upsert/remove) desde las rutas que
+cambian nombres. Cada `max_age` segundos, o tras invalidate() (cambios que
+afectan a muchos nombres, como desactivar un negocio), se reconstruye en un
+hilo aparte mientras las búsquedas siguen usando el índice actual; los
+cambios que llegan durante la reconstrucción se repiten sobre el nuevo.
+"""
+import contextlib
+import itertools
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from thefuzz import fuzz
+
+from chat_intents import fold
+
+MIN_WORD = 3
+MAX_POSTING = 500  # nombres leídos de la lista de un trigrama
+KINDS = ('product', 'business')
+
+_PHONETIC_RULES = [
+    (re.compile(r'[^a-zñ0-9 ]'), ' '),
+    (re.compile(r'qu(?=[ei])'), 'k'),
+    (re.compile(r'gu(?=[ei])'), 'g'),
+    (re.compile(r'c(?=[ei])'), 's'),
+    (re.compile(r'z'), 's'),
+    (re.compile(r'v'), 'b'),
+    (re.compile(r'll'), 'y'),
+    (re.compile(r'(?<![cs])h'), ''),
+    (re.compile(r'(.)\1+'), r'\1'),
+]
+
+
+def phonetic_words(value, stop_words=()):
+    """Palabras de `value` (de al menos MIN_WORD letras) reducidas a su clave fonética."""
+    value = fold(value)
+    for pattern, replacement in _PHONETIC_RULES:
+        value = pattern.sub(replacement, value)
+    return [word for word in value.split() if len(word) >= MIN_WORD and word not in stop_words]
+
+
+def word_trigrams(word):
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _Names:
+    """Palabras y postings de una versión del índice (sin lock: lo protege FuzzyNameIndex)."""
+
+    def __init__(self):
+        self.words = {}  # (tipo, id) -> [palabras fonéticas]
+        self.postings = {kind: defaultdict(set) for kind in KINDS}  # tipo -> trigrama -> {(tipo, id)}
+
+    def add(self, kind, key_id, name):
+        key = (kind, key_id)
+        self.remove(kind, key_id)
+        words = phonetic_words(name or '')
+        if not words:
+            return
+        self.words[key] = words
+        postings = self.postings[kind]
+        for word in words:
+            for gram in word_trigrams(word):
+                postings[gram].add(key)
+
+    def remove(self, kind, key_id):
+        key = (kind, key_id)
+        words = self.words.pop(key, None)
+        if not words:
+            return
+        postings = self.postings[kind]
+        for word in words:
+            for gram in word_trigrams(word):
+                keys = postings.get(gram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del postings[gram]
+
+
+class FuzzyNameIndex:
+    """
+    Nombres de productos y negocios, por tipo ('product' o 'business') e id.
+    `app_context`, si se pasa, es el contexto de Flask con el que corre la reconstrucción
+    en segundo plano (la consulta de `load_rows` lo necesita).
+    """
+
+    def __init__(self, max_age=300, max_candidates=50, min_score=75, max_ms=30, stop_words=(), app_context=None):
+        self.max_age = max_age
+        self.max_candidates = max_candidates
+        self.min_score = min_score
+        self.max_ms = max_ms
+        self.stop_words = frozenset(stop_words)
+        self.app_context = app_context or contextlib.nullcontext
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()  # una construcción a la vez
+        self._built_at = None
+        self._invalidated = False
+        self._data = _Names()
+        self._pending = None  # cambios incrementales durante una reconstrucción: [(método, args)]
+        self._thread = None
+
+    def is_stale(self):
+        return (self._built_at is None or self._invalidated
+                or time.monotonic() - self._built_at > self.max_age)
+
+    def invalidate(self):
+        """Reconstruir en segundo plano en la próxima búsqueda (cambiaron muchos nombres a la vez)."""
+        self._invalidated = True
+
+    def ensure_built(self, load_rows):
+        """
+        La primera vez construye el índice en esta petición. Si caducó, lanza la
+        reconstrucción en un hilo y mientras tanto se sigue buscando en el actual.
+        """
+        if self._built_at is None:
+            with self._build_lock:
+                if self._built_at is None:
+                    self._rebuild(load_rows)
+        elif self.is_stale():
+            with self._lock:
+                if self._thread and self._thread.is_alive():
+                    return
+                self._pending = []  # anotar cambios desde ya, antes de que el hilo lea las filas
+                self._invalidated = False
+                self._thread = threading.Thread(target=self._rebuild_in_background, args=(load_rows,),
+                                                name='fuzzy-index', daemon=True)
+                self._thread.start()
+
+    def _rebuild_in_background(self, load_rows):
+        try:
+            with self.app_context():
+                with self._build_lock:
+                    self._rebuild(load_rows)
+        except Exception as e:
+            print('Advertencia: no se pudo reconstruir el índice de nombres:', e)
+            with self._lock:
+                self._pending = None
+                self._built_at = time.monotonic()  # reintentar en el próximo intervalo
+
+    def rebuild(self, rows):
+        """Construye el índice a partir de filas (tipo, id, nombre)."""
+        with self._build_lock:
+            self._rebuild(lambda: rows)
+
+    def _rebuild(self, load_rows):
+        # Anotar los cambios desde antes de leer las filas: los posteriores pueden no estar en ellas
+        with self._lock:
+            if self._pending is None:
+                self._pending = []
+        data = _Names()
+        for kind, key_id, name in load_rows():
+            data.add(kind, key_id, name)
+        with self._lock:
+            for method, args in self._pending:
+                getattr(data, method)(*args)
+            self._pending = None
+            self._data = data
+            self._built_at = time.monotonic()
+
+    def _apply(self, method, *args):
+        with self._lock:
+            getattr(self._data, method)(*args)
+            if self._pending is not None:
+                self._pending.append((method, args))
+
+    def upsert(self, kind, key_id, name):
+        """Añade o reemplaza un nombre (producto creado o editado, negocio editado)."""
+        if self._built_at is None and self._pending is None:
+            return  # Se cargará desde la base de datos al construir el índice
+        self._apply('add', kind, key_id, name)
+
+    def remove(self, kind, key_id):
+        self._apply('remove', kind, key_id)
+
+    def search(self, query, kind=None, limit=10):
+        """
+        Devuelve [(tipo, id, puntaje)] con puntaje >= min_score, mejor primero.
+        `kind` limita a 'product' o 'business'.
+        """
+        deadline = time.perf_counter() + self.max_ms / 1000
+        query_words = phonetic_words(query, self.stop_words)
+        if not query_words:
+            return []
+
+        with self._lock:
+            data = self._data
+            postings = [data.postings[k] for k in ((kind,) if kind else KINDS)]
+            lists = sorted((p[gram] for word in query_words for gram in word_trigrams(word)
+                            for p in postings if gram in p), key=len)
+            overlap = Counter()
+            for keys in lists:
+                if len(keys) > MAX_POSTING:
+                    # Trigrama común: suma a los candidatos que ya hay y agrega una muestra de nombres
+                    # nuevos (el trigrama más raro de la consulta puede ser el de otra palabra)
+                    for key in overlap:
+                        if key in keys:
+                            overlap[key] += 1
+                    overlap.update(key for key in itertools.islice(keys, MAX_POSTING) if key not in overlap)
+                else:
+                    overlap.update(keys)
+                if time.perf_counter() > deadline:
+                    break
+            candidates = [(key, data.words[key]) for key, _count in overlap.most_common(self.max_candidates)]
+
+        results = []
+        for key, words in candidates:
+            score = sum(max(fuzz.ratio(q, w) for w in words) for q in query_words) / len(query_words)
+            if score >= self.min_score:
+                results.append((key[0], key[1], round(score)))
+            if time.perf_counter() > deadline:
+                break
+        results.sort(key=lambda item: (-item[2], item[1]))
+        return results[:limit]
@@ -0,0 +1,212 @@
+"""
+Índice espacial (SQLite R*Tree) para buscar negocios cerca de un punto.
+
+La tabla virtual `business_geo` guarda un rectángulo degenerado (el punto)
+por cada negocio con latitud y longitud, con id = id del negocio. Los
+triggers la mantienen sincronizada con `businesses`, como business_fts.
+
+- Radio: se consulta el rectángulo que contiene el círculo y se descartan
+  las esquinas con la distancia haversine.
+- k más cercanos: se consulta un radio pequeño y se amplía x8 hasta tener k
+  negocios dentro del círculo (entonces ninguno de fuera puede estar más cerca).
+  Pasada la escala urbana, un círculo que alcanza una zona densa lejana la
+  contiene entera (desde La Paz, todo Santa Cruz), así que se sigue con una
+  búsqueda best-first: se divide el mundo en cuadrantes, se visita primero el
+  de menor distancia mínima al punto y se cuentan sus puntos con LIMIT (sin
+  leerlos): si tiene más de LEAF_ROWS se divide en cuatro, si no se leen sus
+  negocios. Solo se leen los negocios de los cuadrantes más cercanos.
+
+El R*Tree guarda coordenadas en float de 32 bits (~1 m de error); las
+distancias se calculan con las columnas de `businesses`.
+"""
+import heapq
+import math
+
+from sqlalchemy import text
+
+GEO_TABLE = 'business_geo'
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+CITY_RADIUS_KM = 200
+LEAF_ROWS = 32          # negocios por cuadrante antes de dividirlo (búsqueda best-first)
+MIN_CELL_DEGREES = 1e-5  # cuadrantes más chicos (~1 m) se leen enteros: muchos negocios en el mismo punto
+
+_INSERT_SQL = ("INSERT INTO business_geo (id, min_lat, max_lat, min_lng, max_lng) "
+               "SELECT {row}.id, {row}.latitude, {row}.latitude, {row}.longitude, {row}.longitude "
+               "WHERE {row}.latitude IS NOT NULL AND {row}.longitude IS NOT NULL;")
+
+_TRIGGERS = {
+    'business_geo_ai': "AFTER INSERT ON businesses BEGIN " + _INSERT_SQL.format(row='new') + " END",
+    'business_geo_au': ("AFTER UPDATE OF latitude, longitude ON businesses BEGIN "
+                        "DELETE FROM business_geo WHERE id = old.id; " + _INSERT_SQL.format(row='new') + " END"),
+    'business_geo_ad': "AFTER DELETE ON businesses BEGIN DELETE FROM business_geo WHERE id = old.id; END",
+}
+
+_BOX_SQL = text("""
+    SELECT b.id, b.latitude, b.longitude
+      FROM business_geo g JOIN businesses b ON b.id = g.id
+     WHERE g.max_lat >= :min_lat AND g.min_lat <= :max_lat
+       AND g.max_lng >= :min_lng AND g.min_lng <= :max_lng
+       AND b.is_active = 1
+""")
+# Para el cursor DB-API de la búsqueda best-first: cuántos puntos tiene un cuadrante (hasta
+# :limit, sin leerlos) y los negocios activos de un cuadrante pequeño
+_CELL_COUNT_SQL = """
+    SELECT count(*) FROM (SELECT 1 FROM business_geo
+                           WHERE max_lat >= :min_lat AND min_lat <= :max_lat
+                             AND max_lng >= :min_lng AND min_lng <= :max_lng LIMIT :limit)
+"""
+_CELL_ROWS_SQL = _BOX_SQL.text
+
+
+def setup_geo_index(session):
+    """
+    Crea la tabla R*Tree y sus triggers si no existen.
+    Devuelve False si el SQLite instalado no tiene R*Tree (no habrá búsqueda por cercanía).
+    """
+    exists = geo_ready(session)
+    try:
+        if not exists:
+            session.execute(text(
+                "CREATE VIRTUAL TABLE business_geo USING rtree(id, min_lat, max_lat, min_lng, max_lng)"))
+        for name, body in _TRIGGERS.items():
+            session.execute(text(f"CREATE TRIGGER IF NOT EXISTS {name} {body}"))
+        if not exists:
+            rebuild_geo_index(session)
+        session.commit()
+        return True
+    except Exception as e:
+        session.rollback()
+        print('Advertencia: R*Tree no disponible, no habrá búsqueda por cercanía:', e)
+        return False
+
+
+def geo_ready(session):
+    """True si la tabla R*Tree existe (setup_geo_index ya se aplicó con éxito)."""
+    return session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': GEO_TABLE}
+    ).first() is not None
+
+
+def rebuild_geo_index(session):
+    """Vuelve a llenar business_geo desde businesses (al crear la tabla)."""
+    session.execute(text("DELETE FROM business_geo"))
+    session.execute(text(
+        "INSERT INTO business_geo (id, min_lat, max_lat, min_lng, max_lng) "
+        "SELECT id, latitude, latitude, longitude, longitude FROM businesses "
+        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"))
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lng, radius_km):
+    """(min_lat, max_lat, min_lng, max_lng) que contiene el círculo. Cerca de los polos, todas las longitudes."""
+    dlat = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    cos_lat = min(math.cos(math.radians(min_lat)), math.cos(math.radians(max_lat)))
+    if cos_lat <= 1e-6 or radius_km / (KM_PER_DEGREE * cos_lat) >= 180:
+        return min_lat, max_lat, -180.0, 180.0
+    dlng = radius_km / (KM_PER_DEGREE * cos_lat)
+    return min_lat, max_lat, lng - dlng, lng + dlng
+
+
+def within_radius(session, lat, lng, radius_km):
+    """[(business_id, distancia_km)] de los negocios activos a menos de `radius_km`, más cercano primero."""
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+    boxes = [(min_lng, max_lng)]
+    # El rectángulo cruza el antimeridiano: partirlo en dos
+    if min_lng < -180:
+        boxes = [(min_lng + 360, 180.0), (-180.0, max_lng)]
+    elif max_lng > 180:
+        boxes = [(min_lng, 180.0), (-180.0, max_lng - 360)]
+
+    found = {}
+    for box_min_lng, box_max_lng in boxes:
+        rows = session.execute(_BOX_SQL, {'min_lat': min_lat, 'max_lat': max_lat,
+                                          'min_lng': box_min_lng, 'max_lng': box_max_lng})
+        for business_id, business_lat, business_lng in rows:
+            distance = haversine_km(lat, lng, business_lat, business_lng)
+            if distance <= radius_km:
+                found[business_id] = distance
+    return sorted(found.items(), key=lambda item: (item[1], item[0]))
+
+
+def nearest(session, lat, lng, k, max_radius_km=None, start_radius_km=1.0):
+    """
+    Los `k` negocios activos más cercanos [(business_id, distancia_km)], opcionalmente dentro de `max_radius_km`.
+    El radio crece x8 mientras sea de escala urbana (< CITY_RADIUS_KM); si aun así faltan negocios,
+    sigue la búsqueda best-first por cuadrantes (`nearest_best_first`).
+    """
+    limit = max_radius_km if max_radius_km is not None else math.pi * EARTH_RADIUS_KM
+    radius = min(start_radius_km, limit)
+    while True:
+        found = within_radius(session, lat, lng, radius)
+        if len(found) >= k or radius >= limit:
+            return found[:k]
+        if radius * 8 < CITY_RADIUS_KM:
+            radius = min(radius * 8, limit)
+        elif limit <= CITY_RADIUS_KM:
+            radius = limit
+        else:
+            return nearest_best_first(session, lat, lng, k, limit)
+
+
+def box_distance_km(lat, lng, min_lat, max_lat, min_lng, max_lng):
+    """Distancia mínima (círculo máximo) del punto a un rectángulo de latitud/longitud."""
+    if min_lng <= lng <= max_lng:
+        # Misma franja de meridianos: el punto más cercano está en el mismo meridiano
+        return max(0.0, min_lat - lat, lat - max_lat) * KM_PER_DEGREE
+    # Fuera de la franja: el punto más cercano está en el meridiano del borde más próximo
+    edge = min((min_lng, max_lng), key=lambda edge_lng: abs((edge_lng - lng + 180) % 360 - 180))
+    dlng = math.radians(edge - lng)
+    # Latitud del meridiano del borde más cercana al punto; si cae fuera del rectángulo, un extremo
+    closest = math.degrees(math.atan2(math.sin(math.radians(lat)), math.cos(math.radians(lat)) * math.cos(dlng)))
+    candidates = {min(max_lat, max(min_lat, closest)), min_lat, max_lat}
+    return min(haversine_km(lat, lng, candidate, edge) for candidate in candidates)
+
+
+def nearest_best_first(session, lat, lng, k, limit_km):
+    """
+    k más cercanos recorriendo cuadrantes por distancia mínima creciente: un negocio sale del
+    montículo cuando ya no queda ningún cuadrante sin leer que pueda tener uno más cercano.
+    """
+    # Son decenas de consultas diminutas: el cursor DB-API de la conexión de la sesión evita el
+    # costo de SQLAlchemy por sentencia (~70 µs, más que la consulta en sí)
+    cursor = session.connection().connection.cursor()
+    heap = [(box_distance_km(lat, lng, -90.0, 90.0, -180.0, 180.0), 0, 0, (-90.0, 90.0, -180.0, 180.0))]
+    cells = 1
+    seen = set()
+    found = []
+    while heap and len(found) < k:
+        distance, is_business, key, cell = heapq.heappop(heap)
+        if is_business:
+            found.append((key, distance))
+            continue
+        min_lat, max_lat, min_lng, max_lng = cell
+        params = {'min_lat': min_lat, 'max_lat': max_lat, 'min_lng': min_lng, 'max_lng': max_lng}
+        points = cursor.execute(_CELL_COUNT_SQL, dict(params, limit=LEAF_ROWS + 1)).fetchone()[0]
+        if points <= LEAF_ROWS or max_lat - min_lat < MIN_CELL_DEGREES:
+            # Un negocio en el borde de dos cuadrantes aparece en ambos
+            rows = cursor.execute(_CELL_ROWS_SQL, params).fetchall() if points else ()
+            for business_id, business_lat, business_lng in rows:
+                if business_id not in seen:
+                    seen.add(business_id)
+                    business_distance = haversine_km(lat, lng, business_lat, business_lng)
+                    if business_distance <= limit_km:
+                        heapq.heappush(heap, (business_distance, 1, business_id, None))
+            continue
+        mid_lat, mid_lng = (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+        for child in ((min_lat, mid_lat, min_lng, mid_lng), (min_lat, mid_lat, mid_lng, max_lng),
+                      (mid_lat, max_lat, min_lng, mid_lng), (mid_lat, max_lat, mid_lng, max_lng)):
+            # Un poco menos: el redondeo no debe poner al cuadrante detrás de un negocio que contiene
+            child_distance = box_distance_km(lat, lng, *child) - 1e-9
+            if child_distance <= limit_km:
+                cells += 1
+                heapq.heappush(heap, (child_distance, 0, cells, child))
+    return found
@@ -0,0 +1,45 @@
+"""
+Configuración de gunicorn para producción.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Cada valor se puede cambiar con variables de entorno (GUNICORN_WORKERS,
+GUNICORN_THREADS, GUNICORN_BIND...). La configuración de la app se pasa con
+variables FLASK_*, p. ej. FLASK_SQLALCHEMY_DATABASE_URI=sqlite:////ruta/comuni_ia.db
+
+Con varios workers conviene FLASK_CHAT_STATE_BACKEND=sqlite: cada mensaje del
+chat puede llegar a un worker distinto y así todos ven la misma conversación.
+"""
+import multiprocessing
+import os
+
+# Dirección donde escucha el servidor
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Procesos worker. SQLite admite un solo escritor a la vez (WAL + busy_timeout
+# en sqlite_profile.py), así que más workers que núcleos no ayuda.
+workers = int(os.environ.get('GUNICORN_WORKERS', min(4, multiprocessing.cpu_count() * 2)))
+
+# Hilos por worker: el chat responde por streaming (SSE) y mantiene la
+# conexión abierta mientras Gemini genera; con hilos no bloquea al worker entero.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Cargar la app en el maestro antes del fork: el esquema se aplica una sola vez
+# y los workers comparten en memoria el código importado. init_app() cierra
+# las conexiones del maestro y cada worker descarta las heredadas al hacer fork
+# (os.register_at_fork), así que ningún handle de SQLite se comparte entre procesos.
+preload_app = True
+
+# Una respuesta de Gemini puede tardar; más que eso es un worker colgado
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Reciclar workers de vez en cuando para acotar el crecimiento de memoria
+max_requests = 1000
+max_requests_jitter = 100
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
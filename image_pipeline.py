@@ -0,0 +1,177 @@
+"""
+Procesamiento de imágenes subidas (logos y productos).
+
+Después de guardar el original, cada imagen se procesa en un pool de
+procesos (para no bloquear la petición):
+
+- Se orienta según su EXIF y se descartan los metadatos (EXIF/GPS).
+- Se generan variantes de ancho fijo (200/400/800 px) en WebP y JPEG, en
+  static/uploads/variants/<archivo>-<ancho>.<ext>.
+- Se calcula un placeholder borroso diminuto (data URI) para mostrar
+  mientras carga la imagen.
+- Se guarda un manifiesto JSON con los anchos generados y el placeholder.
+
+Las plantillas usan el helper `responsive_image`, que emite <picture> con
+srcset/sizes si el manifiesto existe, o el original si aún no se procesó.
+"""
+import base64
+import io
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageFilter, ImageOps
+
+VARIANT_WIDTHS = (200, 400, 800)
+VARIANTS_DIR = 'variants'
+PLACEHOLDER_WIDTH = 16
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp')
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+
+def variant_path(filename, width, ext):
+    """
+    Ruta relativa a uploads de una variante. Se conserva la extensión original
+    en el nombre porque hay originales que solo difieren en ella (unnamed.jpg/.png).
+    """
+    return f"{VARIANTS_DIR}/{filename}-{width}.{ext}"
+
+
+def manifest_path(filename):
+    return f"{VARIANTS_DIR}/{filename}.json"
+
+
+def _flatten(image):
+    """RGB sin transparencia (JPEG no admite canal alfa): fondo blanco."""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    return image.convert('RGB')
+
+
+def process_image(uploads_dir, filename):
+    """
+    Genera variantes, placeholder y manifiesto de `filename` (relativo a uploads_dir).
+    Se ejecuta en los procesos del pool; devuelve el manifiesto.
+    """
+    source = os.path.join(uploads_dir, filename)
+    os.makedirs(os.path.join(uploads_dir, VARIANTS_DIR), exist_ok=True)
+
+    with Image.open(source) as original:
+        image = _flatten(ImageOps.exif_transpose(original))
+    width, height = image.size
+
+    widths = [w for w in VARIANT_WIDTHS if w < width] or [width]
+    if width < VARIANT_WIDTHS[-1] and width not in widths:
+        widths.append(width)  # El ancho original como variante más grande
+    for w in widths:
+        resized = image if w == width else image.resize((w, max(1, round(height * w / width))), Image.LANCZOS)
+        for ext, fmt, options in FORMATS:
+            # Al no pasar exif=..., Pillow no copia los metadatos originales
+            resized.save(os.path.join(uploads_dir, variant_path(filename, w, ext)), fmt, **options)
+
+    tiny = image.resize((PLACEHOLDER_WIDTH, max(1, round(height * PLACEHOLDER_WIDTH / width))), Image.BILINEAR)
+    tiny = tiny.filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    tiny.save(buffer, 'JPEG', quality=60)
+    placeholder = 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+    manifest = {'width': width, 'height': height, 'widths': widths, 'placeholder': placeholder}
+    tmp = os.path.join(uploads_dir, manifest_path(filename) + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(uploads_dir, manifest_path(filename)))
+    return manifest
+
+
+class ImagePipeline:
+
+    def __init__(self, uploads_dir, workers=2, enabled=True):
+        self.uploads_dir = uploads_dir
+        self.workers = workers
+        self.enabled = enabled
+        self._executor = None
+        self._lock = threading.Lock()
+        self._manifests = {}
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def after_fork(self):
+        """En un proceso hijo (fork) el pool del padre no sirve: se crea otro al primer uso."""
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, filename):
+        """Encola el procesamiento de una imagen recién guardada."""
+        if not filename:
+            return None
+        self._manifests.pop(filename, None)
+        if not self.enabled:
+            return process_image(self.uploads_dir, filename)
+        future = self._pool().submit(process_image, self.uploads_dir, filename)
+
+        def report_failure(done):
+            if done.exception():
+                print(f"Advertencia: no se pudo procesar la imagen {filename}: {done.exception()}")
+
+        future.add_done_callback(report_failure)
+        return future
+
+    def manifest(self, filename):
+        """Manifiesto de la imagen, o None si todavía no se procesó."""
+        if not filename:
+            return None
+        manifest = self._manifests.get(filename)
+        if manifest is None:
+            path = os.path.join(self.uploads_dir, manifest_path(filename))
+            try:
+                with open(path, encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                return None
+            self._manifests[filename] = manifest
+        return manifest
+
+    def remove(self, filename):
+        """Borra las variantes y el manifiesto de una imagen eliminada."""
+        if not filename:
+            return
+        manifest = self.manifest(filename)
+        self._manifests.pop(filename, None)
+        paths = [manifest_path(filename)]
+        for w in (manifest or {}).get('widths', ()):
+            paths.extend(variant_path(filename, w, ext) for ext, _fmt, _options in FORMATS)
+        for path in paths:
+            try:
+                os.remove(os.path.join(self.uploads_dir, path))
+            except OSError:
+                pass
+
+    def backfill(self, force=False):
+        """Procesa las imágenes existentes en uploads que no tienen variantes. Devuelve (ok, errores)."""
+        pending = [
+            name for name in sorted(os.listdir(self.uploads_dir))
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+            and os.path.isfile(os.path.join(self.uploads_dir, name))
+            and (force or not os.path.exists(os.path.join(self.uploads_dir, manifest_path(name))))
+        ]
+        done, errors = 0, []
+        futures = {name: self._pool().submit(process_image, self.uploads_dir, name) for name in pending}
+        for name, future in futures.items():
+            try:
+                future.result()
+                done += 1
+            except Exception as e:
+                errors.append((name, str(e)))
+        self._manifests.clear()
+        return done, errors
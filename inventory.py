@@ -0,0 +1,22 @@
+"""
+Movimientos de stock atómicos.
+
+Cada operación es una sola sentencia UPDATE condicional: la base de datos
+comprueba y modifica el stock a la vez, así dos reservas concurrentes del
+mismo producto no pueden leer el mismo valor y vender de más. El número de
+filas afectadas indica si la operación se hizo.
+"""
+from sqlalchemy import text
+
+_TAKE_SQL = text("UPDATE products SET stock = stock - :quantity WHERE id = :id AND stock >= :quantity")
+_RETURN_SQL = text("UPDATE products SET stock = stock + :quantity WHERE id = :id")
+
+
+def take_stock(session, product_id, quantity):
+    """Descuenta `quantity` unidades si hay suficientes. Devuelve True si se descontaron."""
+    return session.execute(_TAKE_SQL, {'id': product_id, 'quantity': quantity}).rowcount == 1
+
+
+def return_stock(session, product_id, quantity):
+    """Devuelve `quantity` unidades al stock (p. ej. al rechazar una reserva). False si el producto ya no existe."""
+    return session.execute(_RETURN_SQL, {'id': product_id, 'quantity': quantity}).rowcount == 1
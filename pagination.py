@@ -0,0 +1,32 @@
+"""
+Cursores opacos para paginación por clave (keyset).
+
+En lugar de OFFSET, cada página pide "los que vienen después de la última
+fila vista"; el cursor guarda los valores de esa fila (p. ej. su id, o su
+puntaje y su id) codificados en base64 URL-safe, así el cliente lo reenvía
+tal cual sin depender de su formato.
+"""
+import base64
+import binascii
+import json
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, required=()):
+    """Devuelve el dict del cursor, o lanza InvalidCursor si está mal formado."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, binascii.Error, UnicodeError) as e:
+        raise InvalidCursor(str(e)) from None
+    if not isinstance(values, dict) or any(key not in values for key in required):
+        raise InvalidCursor('faltan campos en el cursor')
+    return values
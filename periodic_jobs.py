@@ -0,0 +1,123 @@
+"""
+Tareas periódicas sin cron (recalcular las recomendaciones, ...).
+
+Cada worker llama a `maybe_start()` desde las peticiones que usan el
+resultado de la tarea. Como mucho cada `check_every` segundos se mira la
+tabla scheduled_jobs: si la última ejecución empezó hace más de `interval`
+segundos, se reclama con un UPDATE condicional (solo un proceso consigue
+cambiar la fila) y ese proceso la ejecuta en un hilo. Si la tarea falla, se
+reintenta en el siguiente intervalo.
+
+La misma tarea se puede ejecutar a mano o desde cron con `run_now()` (cada
+tarea tiene su comando de flask).
+
+`get_engine` devuelve el engine de SQLAlchemy y `app_context`, si se pasa,
+el contexto de Flask con el que corre el hilo (db.engine lo necesita).
+"""
+import contextlib
+import threading
+import time
+import traceback
+
+from sqlalchemy import text
+
+
+class PeriodicJob:
+
+    def __init__(self, name, interval, run, get_engine, check_every=60, app_context=None):
+        self.name = name
+        self.interval = interval
+        self.run = run
+        self.get_engine = get_engine
+        self.check_every = check_every
+        self.app_context = app_context or contextlib.nullcontext
+        self._ready = False
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_table(self, conn):
+        if self._ready:
+            return
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS scheduled_jobs (
+                name        VARCHAR(60) PRIMARY KEY,
+                started_at  REAL NOT NULL DEFAULT 0,
+                finished_at REAL,
+                duration_ms REAL,
+                last_error  TEXT
+            )
+        """))
+        self._ready = True
+
+    def claim(self, force=False):
+        """Marca la tarea como empezada si le toca (o siempre, con `force`). True si este proceso debe ejecutarla."""
+        now = time.time()
+        with self.get_engine().begin() as conn:
+            self._ensure_table(conn)
+            conn.execute(text("INSERT OR IGNORE INTO scheduled_jobs (name) VALUES (:name)"), {'name': self.name})
+            claimed = conn.execute(text(
+                "UPDATE scheduled_jobs SET started_at = :now WHERE name = :name AND started_at <= :due"
+            ), {'name': self.name, 'now': now, 'due': now if force else now - self.interval})
+            return claimed.rowcount == 1
+
+    def maybe_start(self):
+        """Lanza la tarea en un hilo si le toca (barato: como mucho una consulta cada `check_every` s)."""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_every:
+            return False
+        with self._lock:
+            if now - self._checked_at < self.check_every or (self._thread and self._thread.is_alive()):
+                return False
+            self._checked_at = now
+            try:
+                if not self.claim():
+                    return False
+            except Exception as e:
+                print(f'Advertencia: no se pudo comprobar la tarea {self.name}:', e)
+                return False
+            self._thread = threading.Thread(target=self._execute_in_context, name=f'job-{self.name}', daemon=True)
+            self._thread.start()
+            return True
+
+    def run_now(self):
+        """Ejecuta la tarea ya, en este hilo, y la registra (comando de flask / cron)."""
+        self.claim(force=True)
+        return self._execute(raise_errors=True)
+
+    def _execute_in_context(self):
+        with self.app_context():
+            self._execute()
+
+    def _execute(self, raise_errors=False):
+        started = time.perf_counter()
+        error = None
+        result = None
+        try:
+            result = self.run()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if raise_errors:
+                raise
+            print(f'Advertencia: la tarea {self.name} falló:', error)
+            traceback.print_exc()
+        finally:
+            try:
+                with self.get_engine().begin() as conn:
+                    self._ensure_table(conn)
+                    conn.execute(text(
+                        "UPDATE scheduled_jobs SET finished_at = :now, "
+                        "duration_ms = :duration, last_error = :error WHERE name = :name"
+                    ), {'name': self.name, 'now': time.time(), 'error': error,
+                        'duration': round((time.perf_counter() - started) * 1000, 1)})
+            except Exception as e:
+                print(f'Advertencia: no se pudo registrar la tarea {self.name}:', e)
+        return result
+
+    def status(self):
+        with self.get_engine().begin() as conn:
+            self._ensure_table(conn)
+            row = conn.execute(text(
+                "SELECT started_at, finished_at, duration_ms, last_error FROM scheduled_jobs WHERE name = :name"
+            ), {'name': self.name}).mappings().first()
+        return dict(row) if row else None
@@ -9,9 +9,11 @@ import random
 # --- MEJORA: Añadir la ruta del proyecto al path de Python ---
 # Esto asegura que el script siempre pueda encontrar el módulo 'app'
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
-from app import app, db, User, Business, Product
+from app import init_app, db, User, Business, Product
 from werkzeug.security import generate_password_hash
 
+app = init_app()
+
 # Datos de negocios organizados por categoría
 negocios_data = [
     # GASTRONOMÍA
@@ -0,0 +1,268 @@
+"""
+Índice invertido en memoria para la búsqueda de productos del chat (/api/chat).
+
+El chat puntúa los productos con comprobaciones de subcadena ("piz" está en
+"pizza"), así que las listas de postings se indexan por trigramas de
+caracteres del texto en minúsculas: si una palabra aparece dentro de un
+campo, todos sus trigramas aparecen en ese campo. Intersecar las listas de
+postings de los trigramas da un conjunto pequeño de candidatos que luego se
+puntúa con `score_product`, la misma regla 10/8/5/3/2 de siempre.
+
+Con términos de menos de 3 letras ("tv") no hay trigramas que filtren: la
+regla de siempre puntúa todo el catálogo (all([]) es True), así que se
+recorren los productos directamente, igual que antes del índice.
+
+El índice se construye una vez por worker (en la primera búsqueda) y se
+actualiza de forma incremental desde las rutas que modifican productos. Como
+cada worker tiene su propia copia, cada `max_age` segundos se reconstruye
+para recoger los cambios hechos por otros procesos: en un hilo aparte, sobre
+un objeto nuevo, mientras las búsquedas siguen usando el índice actual. Los
+cambios incrementales que llegan durante la reconstrucción se anotan y se
+repiten sobre el índice nuevo antes de reemplazar la referencia.
+"""
+import contextlib
+import threading
+import time
+from collections import defaultdict
+
+MIN_SCORE = 3
+
+
+def trigrams(value):
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def score_product(search_term, search_words, name, description, business_name):
+    """
+    Puntuación de coincidencia de un producto (todos los textos en minúsculas).
+    Es la misma lógica que usaba chat() recorriendo todo el catálogo.
+    """
+    long_words = [word for word in search_words if len(word) > 2]
+    score = 0
+
+    # Coincidencia exacta en nombre (máxima prioridad)
+    if search_term in name:
+        score += 10
+    # Coincidencia con todas las palabras en nombre
+    elif all(word in name for word in long_words):
+        score += 8
+    # Coincidencia con alguna palabra en nombre
+    elif any(word in name for word in long_words):
+        score += 5
+    # Coincidencia en descripción
+    if search_term in description:
+        score += 3
+    # Coincidencia con palabras en descripción
+    elif any(word in description for word in long_words):
+        score += 2
+    # Coincidencia en nombre del negocio
+    if search_term in business_name:
+        score += 2
+    return score
+
+
+class _Postings:
+    """Documentos y postings de una versión del índice (sin lock: lo protege ProductSearchIndex)."""
+
+    def __init__(self):
+        # product_id -> [name, description, stock, business_id]  (textos en minúsculas)
+        self.docs = {}
+        self.business_names = {}
+        self.products_by_business = defaultdict(set)
+        self.postings = {'name': defaultdict(set), 'description': defaultdict(set)}
+
+    def add(self, product_id, name, description, stock, business_id, business_name):
+        self.remove(product_id)
+        name = (name or "").lower()
+        description = (description or "").lower()
+        self.docs[product_id] = [name, description, stock, business_id]
+        self.business_names[business_id] = (business_name or "").lower()
+        self.products_by_business[business_id].add(product_id)
+        for gram in trigrams(name):
+            self.postings['name'][gram].add(product_id)
+        for gram in trigrams(description):
+            self.postings['description'][gram].add(product_id)
+
+    def remove(self, product_id):
+        doc = self.docs.pop(product_id, None)
+        if not doc:
+            return
+        name, description, _stock, business_id = doc
+        for field, value in (('name', name), ('description', description)):
+            postings = self.postings[field]
+            for gram in trigrams(value):
+                ids = postings.get(gram)
+                if ids is not None:
+                    ids.discard(product_id)
+                    if not ids:
+                        del postings[gram]
+        self.products_by_business[business_id].discard(product_id)
+
+    def set_stock(self, product_id, stock):
+        doc = self.docs.get(product_id)
+        if doc:
+            doc[2] = stock
+
+    def rename_business(self, business_id, business_name):
+        if business_id in self.business_names:
+            self.business_names[business_id] = (business_name or "").lower()
+
+    def remove_business(self, business_id):
+        for product_id in list(self.products_by_business.get(business_id, ())):
+            self.remove(product_id)
+        self.business_names.pop(business_id, None)
+
+    def containing(self, field, value):
+        """Productos cuyo campo contiene todos los trigramas de `value` (intersección)."""
+        postings = self.postings[field]
+        lists = []
+        for gram in trigrams(value):
+            ids = postings.get(gram)
+            if not ids:
+                return set()
+            lists.append(ids)
+        lists.sort(key=len)
+        result = set(lists[0])
+        for ids in lists[1:]:
+            result &= ids
+            if not result:
+                break
+        return result
+
+
+class ProductSearchIndex:
+    """
+    Índice de productos con stock, con postings por trigrama en nombre y descripción.
+    `app_context`, si se pasa, es el contexto de Flask con el que corre la reconstrucción
+    en segundo plano (la consulta de `load_rows` lo necesita).
+    """
+
+    def __init__(self, max_age=300, app_context=None):
+        self.max_age = max_age
+        self.app_context = app_context or contextlib.nullcontext
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()  # una construcción a la vez
+        self._built_at = None
+        self._data = _Postings()
+        self._pending = None  # cambios incrementales durante una reconstrucción: [(método, args)]
+        self._thread = None
+
+    # --- Construcción y mantenimiento ---
+
+    def is_stale(self):
+        return self._built_at is None or time.monotonic() - self._built_at > self.max_age
+
+    def ensure_built(self, load_rows):
+        """
+        La primera vez construye el índice en esta petición. Si caducó, lanza la
+        reconstrucción en un hilo y mientras tanto se sigue buscando en el actual.
+        """
+        if self._built_at is None:
+            with self._build_lock:
+                if self._built_at is None:
+                    self._rebuild(load_rows)
+        elif self.is_stale():
+            with self._lock:
+                if self._thread and self._thread.is_alive():
+                    return
+                self._pending = []  # anotar cambios desde ya, antes de que el hilo lea las filas
+                self._thread = threading.Thread(target=self._rebuild_in_background, args=(load_rows,),
+                                                name='product-index', daemon=True)
+                self._thread.start()
+
+    def _rebuild_in_background(self, load_rows):
+        try:
+            with self.app_context():
+                with self._build_lock:
+                    self._rebuild(load_rows)
+        except Exception as e:
+            print('Advertencia: no se pudo reconstruir el índice de productos:', e)
+            with self._lock:
+                self._pending = None
+                self._built_at = time.monotonic()  # reintentar en el próximo intervalo
+
+    def rebuild(self, rows):
+        """
+        Construye el índice completo a partir de filas
+        (product_id, name, description, stock, business_id, business_name).
+        """
+        with self._build_lock:
+            self._rebuild(lambda: rows)
+
+    def _rebuild(self, load_rows):
+        # Anotar los cambios desde antes de leer las filas: los posteriores pueden no estar en ellas
+        with self._lock:
+            if self._pending is None:
+                self._pending = []
+        data = _Postings()
+        for row in load_rows():
+            data.add(*row)
+        with self._lock:
+            for method, args in self._pending:
+                getattr(data, method)(*args)
+            self._pending = None
+            self._data = data
+            self._built_at = time.monotonic()
+
+    def _apply(self, method, *args):
+        with self._lock:
+            getattr(self._data, method)(*args)
+            if self._pending is not None:
+                self._pending.append((method, args))
+
+    def upsert(self, product_id, name, description, stock, business_id, business_name):
+        """Añade o reemplaza un producto (add_product / manage_product PUT)."""
+        if self._built_at is None and self._pending is None:
+            return  # Se cargará desde la base de datos al construir el índice
+        self._apply('add', product_id, name, description, stock, business_id, business_name)
+
+    def remove(self, product_id):
+        """Quita un producto (manage_product DELETE)."""
+        self._apply('remove', product_id)
+
+    def set_stock(self, product_id, stock):
+        """Actualiza el stock tras una reserva."""
+        self._apply('set_stock', product_id, stock)
+
+    def rename_business(self, business_id, business_name):
+        self._apply('rename_business', business_id, business_name)
+
+    def remove_business(self, business_id):
+        self._apply('remove_business', business_id)
+
+    # --- Consulta ---
+
+    def search(self, search_term):
+        """
+        Devuelve [(product_id, score)] con score >= 3, ordenado como el
+        recorrido original (mejor puntuación primero, empates por id).
+        """
+        search_term = search_term.lower()
+        search_words = search_term.split()
+        long_words = [word for word in search_words if len(word) > 2]
+
+        with self._lock:
+            data = self._data
+            if long_words:
+                # Con score >= 3 siempre hay alguna palabra en el nombre o en la descripción
+                candidates = set()
+                for word in long_words:
+                    candidates |= data.containing('name', word)
+                    candidates |= data.containing('description', word)
+                docs = ((product_id, data.docs[product_id]) for product_id in candidates)
+            else:
+                # Sin palabras largas all([]) es True: el recorrido original daba 8 puntos
+                # a todos los productos y los trigramas no filtran nada; recorrerlos todos.
+                docs = data.docs.items()
+
+            results = []
+            for product_id, (name, description, stock, business_id) in docs:
+                if stock <= 0:
+                    continue
+                score = score_product(search_term, search_words, name, description,
+                                      data.business_names.get(business_id, ""))
+                if score >= MIN_SCORE:
+                    results.append((product_id, score))
+
+        results.sort(key=lambda item: (-item[1], item[0]))
+        return results
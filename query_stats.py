@@ -0,0 +1,186 @@
+"""
+Contador de consultas SQL por petición y detector de N+1.
+
+Se engancha a los eventos `before/after_cursor_execute` de SQLAlchemy y
+acumula, para cada petición, el número de sentencias, el tiempo en base de
+datos y cuántas veces se repite cada "forma" de sentencia (el SQL con los
+literales y las listas IN normalizados). Una forma repetida muchas veces en
+la misma petición es casi siempre un N+1 (una consulta por fila).
+
+Configuración (app.config):
+    QUERY_STATS_N_PLUS_ONE_THRESHOLD  repeticiones para marcar un N+1 (5)
+    QUERY_BUDGETS                     {'endpoint': máximo de consultas}
+    QUERY_BUDGET_STRICT               si es True, exceder el presupuesto lanza
+                                      QueryBudgetExceeded (por defecto app.testing)
+
+Uso en pruebas:
+    with assert_max_queries(3):
+        client.get('/')
+"""
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACES_RE = re.compile(r'\s+')
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def statement_shape(statement):
+    """SQL normalizado: mismos parámetros distintos -> misma forma."""
+    shape = _STRING_RE.sub('?', statement)
+    shape = _NUMBER_RE.sub('?', shape)
+    shape = _IN_LIST_RE.sub('(?)', shape)
+    return _SPACES_RE.sub(' ', shape).strip()
+
+
+class QueryRecorder:
+    """Consultas registradas durante una petición o un bloque `count_queries()`."""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.time += elapsed
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold):
+        """Formas repetidas al menos `threshold` veces (probables N+1)."""
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= threshold]
+
+
+def _active_recorders():
+    recorders = list(getattr(_local, 'stack', ()))
+    if has_request_context():
+        recorder = g.get('_query_recorder')
+        if recorder is not None:
+            recorders.append(recorder)
+    return recorders
+
+
+# El inicio se guarda en el contexto de ejecución de cada sentencia (y no en una pila
+# de la conexión): si la sentencia falla, after_cursor_execute no se dispara y el
+# contexto se descarta con ella, sin dejar tiempos huérfanos.
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_query_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    for recorder in _active_recorders():
+        recorder.record(statement, elapsed)
+
+
+@contextmanager
+def count_queries():
+    """Cuenta las consultas ejecutadas dentro del bloque (también fuera de una petición)."""
+    recorder = QueryRecorder()
+    stack = _local.__dict__.setdefault('stack', [])
+    stack.append(recorder)
+    try:
+        yield recorder
+    finally:
+        stack.remove(recorder)
+
+
+@contextmanager
+def assert_max_queries(max_queries):
+    """Falla si el bloque ejecuta más de `max_queries` sentencias."""
+    with count_queries() as recorder:
+        yield recorder
+    if recorder.count > max_queries:
+        raise QueryBudgetExceeded(
+            f"{recorder.count} consultas (presupuesto {max_queries}): "
+            + "; ".join(f"{n}x {shape}" for shape, n in recorder.shapes.most_common(3))
+        )
+
+
+class QueryStats:
+    """Extensión Flask: estadísticas de consultas por endpoint."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('QUERY_STATS_N_PLUS_ONE_THRESHOLD', 5)
+        app.config.setdefault('QUERY_BUDGETS', {})
+        app.config.setdefault('QUERY_BUDGET_STRICT', None)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.extensions['query_stats'] = self
+        self.app = app
+
+    def _start_request(self):
+        g._query_recorder = QueryRecorder()
+
+    def _finish_request(self, response):
+        recorder = g.pop('_query_recorder', None)
+        if recorder is None:
+            return response
+        endpoint = request.endpoint or request.path
+        threshold = self.app.config['QUERY_STATS_N_PLUS_ONE_THRESHOLD']
+        offenders = recorder.repeated(threshold)
+
+        with self._lock:
+            stats = self.endpoints.setdefault(endpoint, {
+                'requests': 0, 'queries': 0, 'time_ms': 0.0,
+                'max_queries': 0, 'n_plus_one': 0,
+            })
+            stats['requests'] += 1
+            stats['queries'] += recorder.count
+            stats['time_ms'] += recorder.time * 1000
+            stats['max_queries'] = max(stats['max_queries'], recorder.count)
+            if offenders:
+                stats['n_plus_one'] += 1
+
+        for shape, n in offenders:
+            self.app.logger.warning('Posible N+1 en %s: %d veces -> %s', endpoint, n, shape)
+
+        response.headers['Server-Timing'] = (
+            f'db;dur={recorder.time * 1000:.1f};desc="{recorder.count} consultas"'
+        )
+
+        budget = self.app.config['QUERY_BUDGETS'].get(endpoint)
+        if budget is not None and recorder.count > budget:
+            message = f"{endpoint}: {recorder.count} consultas (presupuesto {budget})"
+            strict = self.app.config['QUERY_BUDGET_STRICT']
+            if strict if strict is not None else self.app.testing:
+                raise QueryBudgetExceeded(message)
+            self.app.logger.warning('Presupuesto de consultas excedido en %s', message)
+        return response
+
+    def snapshot(self):
+        """Copia de las estadísticas acumuladas, con promedios por petición."""
+        with self._lock:
+            result = {}
+            for endpoint, stats in self.endpoints.items():
+                result[endpoint] = dict(stats,
+                                        avg_queries=round(stats['queries'] / stats['requests'], 2),
+                                        avg_time_ms=round(stats['time_ms'] / stats['requests'], 2),
+                                        time_ms=round(stats['time_ms'], 2))
+            return result
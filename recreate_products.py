@@ -1,6 +1,8 @@
-from app import app, db
+from app import init_app, db
 from sqlalchemy import text
 
+app = init_app()
+
 def recreate_products_table():
     with app.app_context():
         try:
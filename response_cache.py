@@ -0,0 +1,186 @@
+"""
+Caché de respuestas de Gemini para los modos asistente y general del chat.
+
+La clave es el modo más el mensaje normalizado (minúsculas, sin tildes ni
+puntuación, espacios colapsados), así "¿Cómo mejorar mis ventas?" y
+"como mejorar mis ventas" comparten respuesta. Hay dos almacenamientos con
+la misma interfaz, ambos LRU con TTL y tamaño acotado:
+
+- MemoryResponseCache: OrderedDict por proceso.
+- SQLiteResponseCache: tabla `chat_response_cache`, compartida por todos los
+  workers que usan la misma base de datos.
+
+Cada entrada guarda cuánto tardó Gemini en generarla; en cada acierto esa
+latencia se suma a `saved_ms`.
+"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]', re.UNICODE)
+_SPACES_RE = re.compile(r'\s+')
+
+
+def normalize_message(message):
+    """Minúsculas, sin tildes ni puntuación y con los espacios colapsados."""
+    decomposed = unicodedata.normalize('NFKD', message.lower())
+    without_accents = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    without_punctuation = _PUNCTUATION_RE.sub(' ', without_accents).replace('_', ' ')
+    return _SPACES_RE.sub(' ', without_punctuation).strip()
+
+
+def cache_key(mode, message):
+    normalized = normalize_message(message)
+    return f"{mode}:{normalized}" if normalized else None
+
+
+class ResponseCache:
+    """Interfaz común: get/set y métricas de aciertos."""
+
+    def __init__(self, max_entries=1000, ttl=6 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._stats_lock = threading.Lock()  # get() se llama desde varios hilos a la vez
+        self.hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+
+    def get(self, key):
+        value = self._get(key)
+        if value is None:
+            with self._stats_lock:
+                self.misses += 1
+            return None
+        reply, latency_ms = value
+        with self._stats_lock:
+            self.hits += 1
+            self.saved_ms += latency_ms
+        return reply
+
+    def set(self, key, reply, latency_ms):
+        self._set(key, reply, latency_ms)
+
+    def stats(self):
+        with self._stats_lock:
+            hits, misses, saved_ms = self.hits, self.misses, self.saved_ms
+        lookups = hits + misses
+        return {
+            'backend': self.backend,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+            'saved_ms': round(saved_ms, 1),
+            'entries': self.size(),
+        }
+
+
+class MemoryResponseCache(ResponseCache):
+    backend = 'memory'
+
+    def __init__(self, max_entries=1000, ttl=6 * 3600):
+        super().__init__(max_entries, ttl)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (reply, latency_ms, expires_at)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            reply, latency_ms, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return reply, latency_ms
+
+    def _set(self, key, reply, latency_ms):
+        with self._lock:
+            self._entries[key] = (reply, latency_ms, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def size(self):
+        return len(self._entries)
+
+
+class SQLiteResponseCache(ResponseCache):
+    """
+    Misma caché sobre una tabla SQLite. `get_engine` devuelve el engine de
+    SQLAlchemy (p. ej. `lambda: db.engine`); cada operación usa su propia
+    conexión, independiente de la sesión de la petición.
+    """
+    backend = 'sqlite'
+    TOUCH_INTERVAL = 60  # segundos: no reescribir last_used_at en cada acierto
+
+    def __init__(self, get_engine, max_entries=1000, ttl=6 * 3600):
+        super().__init__(max_entries, ttl)
+        self.get_engine = get_engine
+        self._ready = False
+
+    def _ensure_table(self, conn):
+        if self._ready:
+            return
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS chat_response_cache (
+                cache_key    VARCHAR(64) PRIMARY KEY,
+                reply        TEXT NOT NULL,
+                latency_ms   REAL NOT NULL,
+                created_at   REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+        """))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_chat_response_cache_last_used "
+            "ON chat_response_cache (last_used_at)"
+        ))
+        self._ready = True
+
+    @staticmethod
+    def _hash(key):
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _get(self, key):
+        now = time.time()
+        with self.get_engine().begin() as conn:
+            self._ensure_table(conn)
+            row = conn.execute(text(
+                "SELECT reply, latency_ms, last_used_at FROM chat_response_cache "
+                "WHERE cache_key = :key AND created_at >= :oldest"
+            ), {'key': self._hash(key), 'oldest': now - self.ttl}).first()
+            if row is None:
+                return None
+            if now - row.last_used_at > self.TOUCH_INTERVAL:
+                conn.execute(text(
+                    "UPDATE chat_response_cache SET last_used_at = :now WHERE cache_key = :key"
+                ), {'now': now, 'key': self._hash(key)})
+            return row.reply, row.latency_ms
+
+    def _set(self, key, reply, latency_ms):
+        now = time.time()
+        with self.get_engine().begin() as conn:
+            self._ensure_table(conn)
+            conn.execute(text(
+                "INSERT OR REPLACE INTO chat_response_cache "
+                "(cache_key, reply, latency_ms, created_at, last_used_at) "
+                "VALUES (:key, :reply, :latency_ms, :now, :now)"
+            ), {'key': self._hash(key), 'reply': reply, 'latency_ms': latency_ms, 'now': now})
+            # Mantener el tamaño acotado: quitar expiradas y las menos usadas recientemente
+            conn.execute(text("DELETE FROM chat_response_cache WHERE created_at < :oldest"),
+                         {'oldest': now - self.ttl})
+            conn.execute(text(
+                "DELETE FROM chat_response_cache WHERE cache_key IN ("
+                "  SELECT cache_key FROM chat_response_cache"
+                "  ORDER BY last_used_at DESC LIMIT -1 OFFSET :max_entries)"
+            ), {'max_entries': self.max_entries})
+
+    def size(self):
+        with self.get_engine().begin() as conn:
+            self._ensure_table(conn)
+            return conn.execute(text("SELECT count(*) FROM chat_response_cache")).scalar()
@@ -0,0 +1,136 @@
+"""
+Índice de texto completo (SQLite FTS5) para la búsqueda de negocios.
+
+Cada negocio tiene una fila en la tabla virtual `business_fts` (rowid = id del
+negocio) con su nombre, su descripción y el texto de todos sus productos.
+Los triggers de SQLite mantienen el índice sincronizado con `businesses` y
+`products`, incluso con borrados masivos (`Query.delete()`) que no pasan por
+los eventos del ORM.
+
+El tokenizador `unicode61 remove_diacritics 2` ignora mayúsculas y tildes,
+así "cafe" encuentra "Café".
+"""
+import re
+from sqlalchemy import Float, Integer, text
+
+FTS_TABLE = 'business_fts'
+
+# Peso de cada columna para bm25(): nombre, descripción, productos
+BM25_WEIGHTS = (10.0, 4.0, 2.0)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Reconstruye la fila de un negocio a partir de las tablas base.
+_REFRESH_SQL = """
+    DELETE FROM business_fts WHERE rowid = {id};
+    INSERT INTO business_fts(rowid, name, description, products)
+    SELECT b.id, b.name, b.description,
+           (SELECT group_concat(p.name || ' ' || coalesce(p.description, ''), ' ')
+              FROM products p WHERE p.business_id = b.id)
+      FROM businesses b WHERE b.id = {id};
+"""
+
+_TRIGGERS = {
+    'business_fts_ai': "AFTER INSERT ON businesses BEGIN" + _REFRESH_SQL.format(id='new.id') + "END",
+    'business_fts_au': "AFTER UPDATE OF name, description ON businesses BEGIN" + _REFRESH_SQL.format(id='new.id') + "END",
+    'business_fts_ad': "AFTER DELETE ON businesses BEGIN DELETE FROM business_fts WHERE rowid = old.id; END",
+    'product_fts_ai': "AFTER INSERT ON products BEGIN" + _REFRESH_SQL.format(id='new.business_id') + "END",
+    'product_fts_au': ("AFTER UPDATE OF name, description, business_id ON products BEGIN"
+                       + _REFRESH_SQL.format(id='old.business_id')
+                       + _REFRESH_SQL.format(id='new.business_id') + "END"),
+    'product_fts_ad': "AFTER DELETE ON products BEGIN" + _REFRESH_SQL.format(id='old.business_id') + "END",
+}
+
+
+def setup_fts(session):
+    """
+    Crea la tabla FTS5 y sus triggers si no existen.
+    Devuelve False si el SQLite instalado no tiene FTS5 (se usará LIKE).
+    """
+    exists = session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': FTS_TABLE}
+    ).first()
+    try:
+        if not exists:
+            session.execute(text(
+                "CREATE VIRTUAL TABLE business_fts USING fts5("
+                "name, description, products, "
+                "tokenize = 'unicode61 remove_diacritics 2')"
+            ))
+        for name, body in _TRIGGERS.items():
+            session.execute(text(f"CREATE TRIGGER IF NOT EXISTS {name} {body}"))
+        if not exists:
+            rebuild_fts(session)
+        session.commit()
+        return True
+    except Exception as e:
+        session.rollback()
+        print('Advertencia: FTS5 no disponible, la búsqueda usará LIKE:', e)
+        return False
+
+
+def fts_ready(session):
+    """True si la tabla FTS5 existe (setup_fts ya se aplicó con éxito)."""
+    return session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': FTS_TABLE}
+    ).first() is not None
+
+
+def rebuild_fts(session):
+    """Vuelve a poblar el índice completo desde businesses/products."""
+    session.execute(text("DELETE FROM business_fts"))
+    session.execute(text("""
+        INSERT INTO business_fts(rowid, name, description, products)
+        SELECT b.id, b.name, b.description,
+               (SELECT group_concat(p.name || ' ' || coalesce(p.description, ''), ' ')
+                  FROM products p WHERE p.business_id = b.id)
+          FROM businesses b
+    """))
+
+
+def build_match_query(search_query):
+    """
+    Convierte el texto del usuario en una expresión MATCH segura:
+    cada palabra entre comillas y como prefijo ("piz" encuentra "pizza").
+    """
+    tokens = _TOKEN_RE.findall(search_query)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_business_ids(session, search_query, limit=None):
+    """Devuelve los ids de negocios que coinciden, ordenados por relevancia BM25."""
+    match = build_match_query(search_query)
+    if not match:
+        return []
+    sql = (
+        "SELECT rowid FROM business_fts WHERE business_fts MATCH :match "
+        f"ORDER BY bm25(business_fts, {', '.join(str(w) for w in BM25_WEIGHTS)})"
+    )
+    params = {'match': match}
+    if limit:
+        sql += " LIMIT :limit"
+        params['limit'] = limit
+    return [row[0] for row in session.execute(text(sql), params)]
+
+
+def ranked_subquery(search_query, name='fts'):
+    """
+    Subconsulta (id, score) con los negocios que coinciden y su puntaje BM25
+    (menor = más relevante), para unirla a `businesses` y paginar por
+    (score, id). Devuelve None si la búsqueda no tiene palabras.
+    """
+    match = build_match_query(search_query)
+    if not match:
+        return None
+    return (
+        text(
+            "SELECT rowid AS id, "
+            f"bm25(business_fts, {', '.join(str(w) for w in BM25_WEIGHTS)}) AS score "
+            "FROM business_fts WHERE business_fts MATCH :match"
+        )
+        .bindparams(match=match)
+        .columns(id=Integer, score=Float)
+        .subquery(name)
+    )
@@ -0,0 +1,371 @@
+"""
+Búsqueda de productos por significado para el chat, sin red: "dolor de
+espalda" encuentra el masaje cuya descripción habla de la espalda o el
+negocio que trata contracturas, aunque el nombre del producto no coincida.
+
+- Cada producto es un vector TF-IDF de sus raíces (las primeras STEM letras
+  de cada palabra sin tildes, así 'dolores' = 'dolor') y de los pares de
+  raíces seguidas, con peso por campo: nombre, descripción del producto y
+  descripción del negocio. Las raíces se llevan a N_FEATURES columnas con
+  un hash (crc32), así no hay vocabulario que mantener al añadir productos.
+- La consulta suma, con menos peso, los términos relacionados de
+  chat_intents.json ('dolor' -> 'masaje', 'tensión', 'relajante'...): así
+  "algo para el dolor de espalda" llega al masaje o al reiki aunque ningún
+  texto de la base hable de dolor.
+- La matriz se guarda por columnas (CSC) en archivos .npy: puntuar una
+  consulta es un único producto matriz-vector sobre las columnas de sus
+  términos (np.bincount), sin recorrer los productos en Python.
+- Los archivos se abren con mmap en modo lectura, así todos los workers
+  comparten las mismas páginas. El primero que encuentra la matriz vieja
+  (más de `max_age` segundos, o anterior a un `invalidate()`) la reconstruye
+  en un hilo aparte bajo un lock de archivo y la publica como una nueva
+  generación; mientras tanto las búsquedas siguen con la generación cargada,
+  y los demás workers la recargan al verla. Solo se construye dentro de la
+  petición cuando todavía no hay ninguna generación publicada.
+- Los cambios de productos se aplican al momento en el worker que los hace:
+  la fila vieja se oculta y la nueva queda en memoria (`_delta`) hasta la
+  próxima reconstrucción.
+"""
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from chat_intents import fold
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos
+    fcntl = None
+
+FORMAT_VERSION = 1
+N_FEATURES = 2 ** 18
+STEM = 5
+MIN_WORD = 3
+FIELD_WEIGHTS = (2.0, 1.0, 0.5)  # nombre, descripción del producto, descripción del negocio
+RELATED_WEIGHT = 0.3
+RELOAD_CHECK_EVERY = 5           # segundos entre comprobaciones de una generación nueva
+ARRAYS = ('indptr', 'rows', 'data', 'ids', 'idf')
+
+# Palabras frecuentes que no dicen nada del producto (además de las del chat)
+STOP_WORDS = frozenset("""
+    algo alguien alla aqui asi cada como con cual cuando del desde donde esta este esto estos hay las los
+    mas mis muy nos nuestra nuestro otro para pero poco por porque que quien sea ser sin sobre son sus tan
+    tengo tiene todo todos tus una uno unos usted
+""".split())
+
+_WORD_RE = re.compile(r'[a-zñ0-9]+')
+
+
+def stems(value, stop_words=STOP_WORDS):
+    """Raíces de las palabras de `value` (sin tildes, sin palabras vacías)."""
+    return [word[:STEM] for word in _WORD_RE.findall(fold(value or ''))
+            if len(word) >= MIN_WORD and word not in stop_words]
+
+
+def feature(term):
+    """Columna de un término; crc32 da el mismo valor en todos los procesos (hash() no)."""
+    return zlib.crc32(term.encode('utf-8')) % N_FEATURES
+
+
+def add_terms(weights, words, weight):
+    """Suma `weight` a cada raíz y a cada par de raíces seguidas."""
+    for i, word in enumerate(words):
+        f = feature(word)
+        weights[f] = weights.get(f, 0.0) + weight
+        if i:
+            f = feature(f"{words[i - 1]} {word}")
+            weights[f] = weights.get(f, 0.0) + weight
+
+
+class SemanticProductIndex:
+    """Matriz TF-IDF de productos persistida en `directory`; ver el docstring del módulo."""
+
+    def __init__(self, directory, max_age=300, stop_words=(), related_terms=(), app_context=None):
+        self.directory = directory
+        self.max_age = max_age
+        self.app_context = app_context or contextlib.nullcontext
+        self.stop_words = STOP_WORDS | frozenset(stop_words)
+        self._related = {}
+        for group in related_terms:
+            group_stems = {stem for term in group for stem in stems(term, self.stop_words)}
+            for stem in group_stems:
+                self._related.setdefault(stem, set()).update(group_stems - {stem})
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()  # una construcción a la vez en este worker
+        self._arrays = None       # arrays mmap de la generación cargada
+        self._meta = None
+        self._row_of = {}         # product_id -> fila de la matriz
+        self._hidden = None       # filas reemplazadas o borradas en este worker
+        self._delta = {}          # product_id -> (columnas, pesos, time.time()) o None si se borró
+        self._checked_at = 0.0
+        self._invalidated_at = 0.0  # time.time() del último invalidate(); las generaciones anteriores no sirven
+        self._thread = None
+
+    # --- Construcción y carga ---
+
+    def _doc_weights(self, name, description, business_description):
+        weights = {}
+        for text, weight in zip((name, description, business_description), FIELD_WEIGHTS):
+            add_terms(weights, stems(text, self.stop_words), weight)
+        return weights
+
+    def _vector(self, weights, idf):
+        """Pesos por término -> (columnas, valores) TF-IDF normalizados (tf sublineal: log(1 + peso))."""
+        if not weights:
+            return np.zeros(0, np.int64), np.zeros(0, np.float32)
+        columns = np.fromiter(weights, np.int64, len(weights))
+        values = np.log1p(np.fromiter(weights.values(), np.float32, len(weights))) * idf[columns]
+        norm = np.linalg.norm(values)
+        return columns, (values / norm if norm else values).astype(np.float32)
+
+    def build(self, rows):
+        """
+        Construye y publica una generación nueva a partir de filas
+        (product_id, name, description, business_description).
+        """
+        started = time.time()  # los cambios posteriores pueden faltar en las filas
+        docs = [(product_id, self._doc_weights(name, description, business_description))
+                for product_id, name, description, business_description in rows]
+        df = np.zeros(N_FEATURES, np.int64)
+        for _product_id, weights in docs:
+            df[np.fromiter(weights, np.int64, len(weights))] += 1
+        idf = (np.log((1 + len(docs)) / (1 + df)) + 1).astype(np.float32)
+
+        row_parts, column_parts, value_parts = [], [], []
+        for row, (_product_id, weights) in enumerate(docs):
+            columns, values = self._vector(weights, idf)
+            row_parts.append(np.full(len(columns), row, np.int32))
+            column_parts.append(columns)
+            value_parts.append(values)
+        rows_ = np.concatenate(row_parts) if docs else np.zeros(0, np.int32)
+        columns = np.concatenate(column_parts) if docs else np.zeros(0, np.int64)
+        values = np.concatenate(value_parts) if docs else np.zeros(0, np.float32)
+
+        # Ordenar por columna: las filas de cada término quedan contiguas (CSC)
+        order = np.argsort(columns, kind='stable')
+        indptr = np.zeros(N_FEATURES + 1, np.int64)
+        np.cumsum(np.bincount(columns, minlength=N_FEATURES), out=indptr[1:])
+        arrays = {
+            'indptr': indptr,
+            'rows': rows_[order],
+            'data': values[order],
+            'ids': np.array([product_id for product_id, _weights in docs], np.int64),
+            'idf': idf,
+        }
+        meta = {'version': FORMAT_VERSION, 'generation': str(time.time_ns()), 'built_at': started,
+                'rows': len(docs), 'nnz': int(len(order))}
+        self._publish(arrays, meta)
+        return meta
+
+    def _publish(self, arrays, meta):
+        os.makedirs(self.directory, exist_ok=True)
+        for name, array in arrays.items():
+            path = self._path(meta['generation'], name)
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(path + '.tmp', path)
+        # meta.json al final: quien lo lea encuentra todos los arrays ya escritos
+        tmp = os.path.join(self.directory, 'meta.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.directory, 'meta.json'))
+        # Las generaciones anteriores siguen abiertas (mmap) en otros workers: se borra
+        # desde la antepenúltima, un archivo abierto sigue siendo legible tras borrarlo
+        generations = sorted({name.split('.', 1)[0] for name in os.listdir(self.directory)
+                              if name.endswith('.npy')})
+        for old in generations[:-2]:
+            for name in ARRAYS:
+                try:
+                    os.remove(self._path(old, name))
+                except OSError:
+                    pass
+
+    def _path(self, generation, name):
+        return os.path.join(self.directory, f"{generation}.{name}.npy")
+
+    def _read_meta(self):
+        try:
+            with open(os.path.join(self.directory, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get('version') == FORMAT_VERSION else None
+
+    def _load(self, meta):
+        """Abre con mmap la generación de `meta`. False si sus archivos ya no están."""
+        try:
+            arrays = {name: np.load(self._path(meta['generation'], name), mmap_mode='r') for name in ARRAYS}
+        except (OSError, ValueError):
+            return False
+        row_of = {product_id: row for row, product_id in enumerate(arrays['ids'].tolist())}
+        with self._lock:
+            self._arrays = arrays
+            self._meta = meta
+            self._row_of = row_of
+            self._hidden = np.zeros(meta['rows'], bool)
+            # Los cambios hechos después de empezar la construcción pueden no estar en ella
+            self._delta = {product_id: change for product_id, change in self._delta.items()
+                           if change is None or change[2] >= meta['built_at']}
+            for product_id in self._delta:
+                row = self._row_of.get(product_id)
+                if row is not None:
+                    self._hidden[row] = True
+        return True
+
+    def is_stale(self, meta):
+        """Sin generación, más vieja que `max_age` o empezada antes del último invalidate()."""
+        return (meta is None or time.time() - meta['built_at'] > self.max_age
+                or meta['built_at'] <= self._invalidated_at)
+
+    def ensure_built(self, load_rows):
+        """
+        Carga la última generación publicada. Si no hay ninguna la construye en
+        esta petición; si es vieja, la reconstruye en un hilo y mientras tanto se
+        sigue buscando en la cargada.
+        """
+        now = time.monotonic()
+        if self._arrays is not None and now - self._checked_at < RELOAD_CHECK_EVERY:
+            return
+        self._checked_at = now
+        meta = self._read_meta()
+        if self._arrays is None and (meta is None or not self._load(meta)):
+            with self._build_lock:
+                if self._arrays is None:
+                    meta = self._rebuild_locked(load_rows, blocking=True)
+                    if not self._load(meta):
+                        self._load(self.build(load_rows()))
+            return
+        if meta and meta['generation'] != self._meta['generation']:
+            self._load(meta)
+        if self.is_stale(meta):
+            with self._lock:
+                if self._thread and self._thread.is_alive():
+                    return
+                self._thread = threading.Thread(target=self._rebuild_in_background, args=(load_rows,),
+                                                name='semantic-index', daemon=True)
+                self._thread.start()
+
+    def _rebuild_in_background(self, load_rows):
+        # Si otro proceso tiene el lock de archivo no se espera: su generación se carga al verla
+        # y, si empezó antes de un invalidate(), sigue vieja y se reconstruye en la próxima comprobación
+        try:
+            with self.app_context():
+                with self._build_lock:
+                    meta = self._rebuild_locked(load_rows, blocking=False)
+            if meta is not None:
+                self._load(meta)
+        except Exception as e:
+            print('Advertencia: no se pudo reconstruir el índice semántico:', e)
+
+    def _rebuild_locked(self, load_rows, blocking):
+        """Reconstruye bajo el lock de archivo. Si otro proceso ya lo hace y no hace falta esperar, None."""
+        if fcntl is None:
+            return self.build(load_rows())
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return None
+            try:
+                # Otro proceso pudo terminar mientras se esperaba el lock
+                meta = self._read_meta()
+                if not self.is_stale(meta):
+                    return meta
+                return self.build(load_rows())
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def invalidate(self):
+        """
+        Reconstruir en segundo plano en la próxima comprobación (cambió un texto que afecta
+        a muchos productos). Llamar después del commit: la generación nueva debe leerlo.
+        """
+        self._invalidated_at = time.time()
+        self._checked_at = 0.0
+
+    # --- Cambios incrementales ---
+
+    def upsert(self, product_id, name, description, business_description):
+        """Añade o reemplaza un producto en este worker (add_product / manage_product PUT)."""
+        with self._lock:
+            if self._arrays is None:
+                return  # Se cargará al construir la matriz
+            columns, values = self._vector(self._doc_weights(name, description, business_description),
+                                           self._arrays['idf'])
+            self._delta[product_id] = (columns, values, time.time())
+            self._hide(product_id)
+
+    def remove(self, product_id):
+        with self._lock:
+            if self._arrays is None:
+                return
+            self._delta[product_id] = None
+            self._hide(product_id)
+
+    def _hide(self, product_id):
+        row = self._row_of.get(product_id)
+        if row is not None:
+            self._hidden[row] = True
+
+    # --- Consulta ---
+
+    def query_vector(self, query):
+        """Columnas y pesos de la consulta, con los términos relacionados a menor peso."""
+        words = stems(query, self.stop_words)
+        weights = {}
+        add_terms(weights, words, 1.0)
+        related = set().union(*(self._related.get(word, ()) for word in words)) - set(words)
+        for word in related:
+            f = feature(word)
+            weights[f] = weights.get(f, 0.0) + RELATED_WEIGHT
+        return self._vector(weights, self._arrays['idf'])
+
+    def search(self, query, limit=10, min_score=0.15):
+        """Devuelve [(product_id, similitud coseno)] con similitud >= min_score, mejor primero."""
+        with self._lock:
+            if self._arrays is None:
+                return []
+            arrays, hidden, delta = self._arrays, self._hidden, dict(self._delta)
+        columns, weights = self.query_vector(query)
+        if not len(columns):
+            return []
+
+        # Producto matriz-vector sobre las columnas de la consulta: juntar sus tramos
+        # de la matriz CSC y sumar por fila con bincount
+        starts = arrays['indptr'][columns]
+        lengths = arrays['indptr'][columns + 1] - starts
+        total = int(lengths.sum())
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        scores = np.bincount(arrays['rows'][positions],
+                             weights=arrays['data'][positions] * np.repeat(weights, lengths),
+                             minlength=len(hidden))
+        scores[hidden] = 0
+
+        candidates = np.flatnonzero(scores >= min_score)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        results = [(int(arrays['ids'][row]), float(scores[row])) for row in candidates]
+
+        # Filas cambiadas en este worker
+        query_weights = dict(zip(columns.tolist(), weights.tolist()))
+        for product_id, change in delta.items():
+            if change is not None:
+                score = sum(query_weights.get(c, 0.0) * v for c, v in zip(change[0].tolist(), change[1].tolist()))
+                if score >= min_score:
+                    results.append((product_id, score))
+
+        results.sort(key=lambda item: (-item[1], item[0]))
+        return results[:limit]
+
+    def stats(self):
+        meta = self._meta or {}
+        return {'generation': meta.get('generation'), 'rows': meta.get('rows', 0), 'nnz': meta.get('nnz', 0),
+                'age_s': round(time.time() - meta['built_at']) if meta else None,
+                'local_changes': len(self._delta)}
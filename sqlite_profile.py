@@ -0,0 +1,67 @@
+"""
+Perfil de conexión para SQLite.
+
+Cada conexión nueva del pool recibe los PRAGMA de `SQLITE_PRAGMAS` a través
+del evento `connect` del engine:
+
+- journal_mode=WAL: los lectores no esperan a los escritores (y viceversa).
+- synchronous=NORMAL: seguro con WAL; solo un corte de luz puede perder las
+  últimas transacciones, nunca corromper la base.
+- busy_timeout: esperar el bloqueo de escritura en lugar de fallar con
+  "database is locked".
+- mmap_size, cache_size y temp_store=MEMORY: menos lecturas de disco.
+- foreign_keys=ON: SQLite no valida las claves foráneas si no se activa.
+
+`engine_options()` da la configuración del pool para SQLALCHEMY_ENGINE_OPTIONS.
+"""
+from sqlalchemy import event
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,          # ms
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,          # negativo = KiB (~20 MB por conexión)
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'ON',
+}
+
+# journal_mode es persistente en el archivo y cambiarlo requiere que no haya
+# otra conexión en medio de una transacción: se aplica primero y, si falla,
+# se sigue con el resto.
+_FIRST = ('busy_timeout', 'journal_mode')
+
+
+def engine_options(pragmas=None, pool_size=10, max_overflow=20, pool_timeout=30):
+    """Opciones de create_engine: pool acotado y el mismo busy_timeout en el driver."""
+    busy_timeout_ms = (pragmas or DEFAULT_PRAGMAS).get('busy_timeout', 5000)
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        'connect_args': {'timeout': busy_timeout_ms / 1000, 'check_same_thread': False},
+    }
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    ordered = [k for k in _FIRST if k in pragmas] + [k for k in pragmas if k not in _FIRST]
+    cursor = dbapi_connection.cursor()
+    try:
+        for name in ordered:
+            try:
+                cursor.execute(f"PRAGMA {name} = {pragmas[name]}")
+            except Exception as e:
+                print(f"Advertencia: no se pudo aplicar PRAGMA {name}:", e)
+    finally:
+        cursor.close()
+
+
+def install(engine, pragmas=None):
+    """Registra el evento `connect` que aplica los PRAGMA. Ignora engines que no son SQLite."""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, _connection_record):
+        apply_pragmas(dbapi_connection, pragmas)
@@ -30,6 +30,87 @@
     return div;
   };
 
+  const renderReply = (el, html) => {
+    el.className = 'msg-bot';
+    el.innerHTML = html ? html.replace(/\n/g, '<br>') : 'Sin respuesta';
+    msgs.scrollTop = msgs.scrollHeight;
+  };
+
+  // UBICACIÓN: solo se pide si el mensaje habla de cercanía ("cerca de mí"),
+  // una vez por página; si el usuario no la da, se busca sin ella
+  let locationPromise = null;
+  const getLocation = () => {
+    if (!navigator.geolocation) return Promise.resolve(null);
+    if (!locationPromise) {
+      locationPromise = new Promise(resolve => {
+        navigator.geolocation.getCurrentPosition(
+          pos => resolve({lat: pos.coords.latitude, lng: pos.coords.longitude}),
+          () => resolve(null),
+          {timeout: 5000, maximumAge: 10 * 60 * 1000}
+        );
+      });
+    }
+    return locationPromise;
+  };
+
+  const chatBody = async (text) => {
+    const body = {message: text};
+    if (/cerca|near/i.test(text)) Object.assign(body, await getLocation());
+    return JSON.stringify(body);
+  };
+
+  // RESPUESTA COMPLETA (JSON, respaldo si el navegador no soporta streaming)
+  const askJson = async (text, el) => {
+    const resp = await fetch('/api/chat', {
+      method: 'POST',
+      headers: {'Content-Type': 'application/json'},
+      body: await chatBody(text)
+    });
+    const data = await resp.json();
+    renderReply(el, data.reply || data.error);
+  };
+
+  // RESPUESTA EN STREAMING (Server-Sent Events): se muestra a medida que llega.
+  // `progress.received` indica si ya llegó algún fragmento de la respuesta.
+  const askStream = async (text, el, progress) => {
+    const resp = await fetch('/api/chat/stream', {
+      method: 'POST',
+      headers: {'Content-Type': 'application/json', 'Accept': 'text/event-stream'},
+      body: await chatBody(text)
+    });
+    if (!resp.ok || !(resp.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
+      const data = await resp.json();
+      renderReply(el, data.error);
+      return;
+    }
+
+    const reader = resp.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let html = '';
+    for (;;) {
+      const {value, done} = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, {stream: true});
+      // Los eventos SSE se separan con una línea en blanco
+      let sep;
+      while ((sep = buffer.indexOf('\n\n')) >= 0) {
+        const raw = buffer.slice(0, sep);
+        buffer = buffer.slice(sep + 2);
+        const event = (raw.match(/^event: (.*)$/m) || [])[1];
+        const data = JSON.parse((raw.match(/^data: (.*)$/m) || [])[1] || '{}');
+        if (event === 'chunk') {
+          progress.received = true;
+          html += data.html;
+        }
+        else if (event === 'replace') html = data.html;
+        else if (event === 'done') break;
+        renderReply(el, html);
+      }
+    }
+    if (!html) renderReply(el, '');
+  };
+
   // ENVIAR
   const ask = async () => {
     const text = (input.value || '').trim();
@@ -38,21 +119,26 @@
     pushMsg(text.replace(/\n/g, '<br>'), 'user');
     input.value = '';
     const thinking = pushMsg('Pensando...', 'bot');
+    const progress = {received: false};
 
     try {
-      const resp = await fetch('/api/chat', {
-        method: 'POST',
-        headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({message: text})
-      });
-      const data = await resp.json();
-      
-      thinking.className = 'msg-bot';
-      thinking.innerHTML = data.reply ? 
-        data.reply.replace(/\n/g, '<br>') : 
-        'Sin respuesta';
+      if (window.ReadableStream && window.TextDecoder) {
+        await askStream(text, thinking, progress);
+      } else {
+        await askJson(text, thinking);
+      }
     } catch(e) {
-      thinking.innerHTML = 'Error de conexión';
+      // Si la respuesta ya había empezado, el servidor procesó el mensaje: reenviarlo
+      // lo registraría dos veces en la conversación (y podría llamar al modelo otra vez)
+      if (progress.received) {
+        thinking.insertAdjacentHTML('beforeend', '<br><em>Se cortó la respuesta. Intenta de nuevo.</em>');
+        return;
+      }
+      try {
+        await askJson(text, thinking);
+      } catch(e2) {
+        thinking.innerHTML = 'Error de conexión';
+      }
     }
   };
 
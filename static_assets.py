@@ -0,0 +1,178 @@
+"""
+Recursos estáticos con huella (fingerprint) y caché de larga duración.
+
+Al arrancar (o con `flask build-assets`) cada archivo de static/css y
+static/js se copia a static/dist con el hash de su contenido en el nombre
+(`css/styles.css` -> `dist/css/styles.3f9c2a1b7e.css`), junto con versiones
+precomprimidas `.gz` y, si está instalado el paquete `brotli`, `.br`. El
+manifiesto `static/dist/manifest.json` relaciona el nombre original con el
+de la huella.
+
+- `url_for('static', filename='css/styles.css')` devuelve la URL con huella
+  (ver `StaticAssets.init_app`), así que las plantillas no cambian.
+- Las URLs con huella se sirven con `Cache-Control: immutable` de un año y
+  en la codificación precomprimida que acepte el navegador.
+- Las imágenes subidas llevan un ETag fuerte basado en su contenido (el
+  nombre ya es el hash para las subidas nuevas; ver upload_store.py).
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+
+from flask import abort, request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # Opcional: sin brotli solo se generan los .gz
+    brotli = None
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+SOURCE_DIRS = ('css', 'js')
+HASH_LENGTH = 10
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# (extensión, Content-Encoding) en orden de preferencia
+ENCODINGS = (('.br', 'br'), ('.gz', 'gzip'))
+
+_SHA256_NAME_LENGTH = 64
+
+
+def fingerprint_name(path, digest):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{digest[:HASH_LENGTH]}{ext}"
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build_assets(static_dir):
+    """
+    Genera las copias con huella y sus versiones comprimidas, y escribe el
+    manifiesto. Los archivos que ya existen no se reescriben (su nombre
+    depende del contenido). Devuelve el manifiesto {original: huella}.
+    """
+    dist = os.path.join(static_dir, DIST_DIR)
+    manifest = {}
+    for source_dir in SOURCE_DIRS:
+        for root, _dirs, files in os.walk(os.path.join(static_dir, source_dir)):
+            for name in sorted(files):
+                source = os.path.join(root, name)
+                relative = os.path.relpath(source, static_dir).replace(os.sep, '/')
+                with open(source, 'rb') as f:
+                    data = f.read()
+                hashed = fingerprint_name(relative, hashlib.sha256(data).hexdigest())
+                target = os.path.join(dist, hashed)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if not os.path.exists(target):
+                    _write_atomic(target, data)
+                    _write_atomic(target + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+                    if brotli is not None:
+                        _write_atomic(target + '.br', brotli.compress(data, quality=11))
+                manifest[relative] = f"{DIST_DIR}/{hashed}"
+
+    os.makedirs(dist, exist_ok=True)
+    _write_atomic(os.path.join(dist, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+class StaticAssets:
+    """
+    Extensión de Flask: reescribe las URLs de `static` según el manifiesto y
+    reemplaza la vista `static` para servir las huellas y las subidas con
+    las cabeceras de caché adecuadas.
+    """
+
+    def __init__(self, app=None, uploads_prefix='uploads/'):
+        self.uploads_prefix = uploads_prefix
+        self.manifest = {}
+        self._fingerprinted = set()
+        self._etags = {}  # ruta -> (mtime, tamaño, etag)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('STATIC_ASSETS_BUILD_ON_STARTUP', True)
+        self.static_dir = app.static_folder
+        if app.config['STATIC_ASSETS_BUILD_ON_STARTUP']:
+            try:
+                self.load(build_assets(self.static_dir))
+            except OSError as e:
+                print('Advertencia: no se pudieron generar los recursos con huella:', e)
+        else:
+            self.load_manifest()
+        app.url_defaults(self._fingerprint_url)
+        app.view_functions['static'] = self.send_static_file
+        app.extensions['static_assets'] = self
+
+    def load(self, manifest):
+        self.manifest = manifest
+        self._fingerprinted = set(manifest.values())
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.static_dir, DIST_DIR, MANIFEST), encoding='utf-8') as f:
+                self.load(json.load(f))
+        except (OSError, ValueError):
+            self.load({})
+
+    def _fingerprint_url(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.manifest.get(values['filename'], values['filename'])
+
+    def send_static_file(self, filename):
+        if filename in self._fingerprinted:
+            return self._send_fingerprinted(filename)
+        if filename.startswith(self.uploads_prefix):
+            return self._send_upload(filename)
+        return send_from_directory(self.static_dir, filename)
+
+    def _send_fingerprinted(self, filename):
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        for suffix, encoding in ENCODINGS:
+            if request.accept_encodings[encoding] and os.path.exists(os.path.join(self.static_dir, filename + suffix)):
+                response = send_from_directory(self.static_dir, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(self.static_dir, filename)
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def _send_upload(self, filename):
+        """
+        ETag fuerte según el contenido. Las subidas nombradas por su hash
+        (`<sha256>.<ext>`) no cambian nunca: se marcan como inmutables.
+        """
+        path = safe_join(self.static_dir, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        if len(stem) == _SHA256_NAME_LENGTH and os.path.dirname(filename) == self.uploads_prefix.rstrip('/'):
+            etag, cache_control = stem, IMMUTABLE
+        else:
+            etag, cache_control = self._content_etag(path), 'no-cache'
+        response = send_from_directory(self.static_dir, filename, etag=etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
+
+    def _content_etag(self, path):
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._etags.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        with open(path, 'rb') as f:
+            etag = hashlib.sha256(f.read()).hexdigest()[:32]
+        with self._lock:
+            self._etags[path] = (stat.st_mtime_ns, stat.st_size, etag)
+        return etag
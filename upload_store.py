@@ -0,0 +1,248 @@
+"""
+Almacén de subidas direccionado por contenido, con conteo de referencias.
+
+Cada imagen subida se guarda en static/uploads con el nombre
+`<sha256>.<ext>`: si ya existe un archivo con el mismo contenido se reutiliza
+en lugar de crear `foto_1.jpg`, `foto_2.jpg`...
+
+La tabla `upload_blobs` lleva, por archivo, cuántas filas lo usan
+(`businesses.logo` y `products.image_url`). La mantienen triggers de SQLite,
+así que también cuentan los borrados masivos (`Query.delete()`) y los
+cambios hechos fuera del ORM. Las rutas ya no borran archivos: al quedar en
+cero referencias, `UploadStore.collect()` (comando `flask gc-uploads`) borra
+el archivo y sus variantes pasado un periodo de gracia.
+
+Los archivos anteriores a este esquema conservan su nombre; se registran
+con su hash al crear la tabla para que las subidas nuevas iguales los
+reutilicen, y `UploadStore.dedupe()` apunta las copias repetidas a una sola.
+"""
+import hashlib
+import os
+import time
+
+from flask_uploads import UploadNotAllowed, extension
+from sqlalchemy import text
+
+BLOB_TABLE = 'upload_blobs'
+DEFAULT_GRACE = 3600  # segundos sin referencias antes de poder borrar un archivo
+
+_NOW = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+# Suma o resta una referencia al archivo {f} (las filas sin imagen tienen NULL)
+_ACQUIRE_SQL = f"""
+    INSERT OR IGNORE INTO upload_blobs(filename, ref_count, last_seen_at)
+    SELECT {{f}}, 0, {_NOW} WHERE {{f}} IS NOT NULL;
+    UPDATE upload_blobs SET ref_count = ref_count + 1 WHERE filename = {{f}};
+"""
+_RELEASE_SQL = f"""
+    UPDATE upload_blobs SET ref_count = ref_count - 1, last_seen_at = {_NOW} WHERE filename = {{f}};
+"""
+
+_TRIGGERS = {
+    'upload_ref_business_ai': "AFTER INSERT ON businesses BEGIN" + _ACQUIRE_SQL.format(f='new.logo') + "END",
+    'upload_ref_business_au': ("AFTER UPDATE OF logo ON businesses WHEN old.logo IS NOT new.logo BEGIN"
+                               + _RELEASE_SQL.format(f='old.logo') + _ACQUIRE_SQL.format(f='new.logo') + "END"),
+    'upload_ref_business_ad': "AFTER DELETE ON businesses BEGIN" + _RELEASE_SQL.format(f='old.logo') + "END",
+    'upload_ref_product_ai': "AFTER INSERT ON products BEGIN" + _ACQUIRE_SQL.format(f='new.image_url') + "END",
+    'upload_ref_product_au': ("AFTER UPDATE OF image_url ON products WHEN old.image_url IS NOT new.image_url BEGIN"
+                              + _RELEASE_SQL.format(f='old.image_url') + _ACQUIRE_SQL.format(f='new.image_url') + "END"),
+    'upload_ref_product_ad': "AFTER DELETE ON products BEGIN" + _RELEASE_SQL.format(f='old.image_url') + "END",
+}
+
+
+def file_sha256(path_or_stream, chunk_size=1 << 16):
+    """Hash SHA-256 (hex) de un archivo en disco o de un stream ya abierto."""
+    digest = hashlib.sha256()
+    if isinstance(path_or_stream, str):
+        with open(path_or_stream, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    else:
+        for chunk in iter(lambda: path_or_stream.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def setup_upload_refs(session):
+    """
+    Crea la tabla `upload_blobs` y sus triggers si no existen.
+    La primera vez calcula los conteos desde las tablas actuales.
+    Devuelve True si la tabla se acaba de crear.
+    """
+    exists = session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': BLOB_TABLE}
+    ).first()
+    try:
+        session.execute(text("""
+            CREATE TABLE IF NOT EXISTS upload_blobs (
+                filename     VARCHAR(500) PRIMARY KEY,
+                sha256       VARCHAR(64),
+                size         INTEGER,
+                ref_count    INTEGER NOT NULL DEFAULT 0,
+                last_seen_at INTEGER NOT NULL
+            )
+        """))
+        session.execute(text("CREATE INDEX IF NOT EXISTS ix_upload_blobs_sha256 ON upload_blobs (sha256)"))
+        for name, body in _TRIGGERS.items():
+            session.execute(text(f"CREATE TRIGGER IF NOT EXISTS {name} {body}"))
+        if not exists:
+            rebuild_ref_counts(session)
+        session.commit()
+        return not exists
+    except Exception as e:
+        session.rollback()
+        print('Advertencia: no se pudo preparar el conteo de referencias de subidas:', e)
+        return False
+
+
+def rebuild_ref_counts(session):
+    """Recalcula ref_count de todos los archivos desde businesses/products."""
+    session.execute(text(f"""
+        INSERT OR IGNORE INTO upload_blobs(filename, ref_count, last_seen_at)
+        SELECT logo, 0, {_NOW} FROM businesses WHERE logo IS NOT NULL
+        UNION
+        SELECT image_url, 0, {_NOW} FROM products WHERE image_url IS NOT NULL
+    """))
+    session.execute(text("""
+        UPDATE upload_blobs SET ref_count =
+            (SELECT count(*) FROM businesses WHERE logo = upload_blobs.filename)
+          + (SELECT count(*) FROM products WHERE image_url = upload_blobs.filename)
+    """))
+
+
+class UploadStore:
+    """
+    Guarda subidas por contenido y recolecta las que ya nadie referencia.
+    `get_engine` devuelve el engine de SQLAlchemy (p. ej. `lambda: db.engine`):
+    el registro de cada archivo se confirma en su propia transacción, así un
+    archivo guardado en una petición que luego falla queda registrado con cero
+    referencias y el GC lo recupera.
+    """
+
+    def __init__(self, upload_set, get_engine, pipeline=None, grace=DEFAULT_GRACE):
+        self.upload_set = upload_set
+        self.get_engine = get_engine
+        self.pipeline = pipeline
+        self.grace = grace
+
+    def path(self, filename):
+        return self.upload_set.path(filename)
+
+    def save(self, storage):
+        """
+        Guarda un FileStorage y devuelve el nombre a usar en logo/image_url.
+        Si ya hay un archivo con el mismo contenido, devuelve ese nombre.
+        """
+        basename = self.upload_set.get_basename(storage.filename or '')
+        if not self.upload_set.file_allowed(storage, basename):
+            raise UploadNotAllowed()
+        storage.stream.seek(0)
+        digest = file_sha256(storage.stream)
+        size = storage.stream.tell()
+        storage.stream.seek(0)
+
+        with self.get_engine().begin() as conn:
+            existing = [row.filename for row in conn.execute(
+                text("SELECT filename FROM upload_blobs WHERE sha256 = :sha ORDER BY ref_count DESC, filename"),
+                {'sha': digest})]
+            filename = next((name for name in existing if os.path.exists(self.path(name))), None)
+            created = filename is None
+            if created:
+                filename = f"{digest}.{extension(basename).lower()}"
+                if not os.path.exists(self.path(filename)):
+                    filename = self.upload_set.save(storage, name=filename)
+            # Renovar last_seen_at: el GC no debe borrarlo antes de que la petición guarde la referencia
+            conn.execute(text(
+                "INSERT INTO upload_blobs(filename, sha256, size, ref_count, last_seen_at) "
+                "VALUES (:filename, :sha, :size, 0, :now) "
+                "ON CONFLICT(filename) DO UPDATE SET sha256 = excluded.sha256, size = excluded.size, "
+                "last_seen_at = excluded.last_seen_at"
+            ), {'filename': filename, 'sha': digest, 'size': size, 'now': int(time.time())})
+
+        if created and self.pipeline is not None:
+            self.pipeline.submit(filename)
+        return filename
+
+    def hash_missing(self):
+        """Calcula el hash de los archivos registrados que aún no lo tienen (anteriores a este esquema)."""
+        with self.get_engine().begin() as conn:
+            names = conn.execute(text("SELECT filename FROM upload_blobs WHERE sha256 IS NULL")).scalars().all()
+            hashed = 0
+            for name in names:
+                path = self.path(name)
+                if not os.path.isfile(path):
+                    continue
+                conn.execute(text("UPDATE upload_blobs SET sha256 = :sha, size = :size WHERE filename = :filename"),
+                             {'sha': file_sha256(path), 'size': os.path.getsize(path), 'filename': name})
+                hashed += 1
+        return hashed
+
+    def dedupe(self):
+        """
+        Apunta las filas que usan copias idénticas de un archivo a una sola copia
+        (la más referenciada). Las copias quedan sin referencias para el GC.
+        Devuelve {copia: archivo_conservado}.
+        """
+        self.hash_missing()
+        replaced = {}
+        with self.get_engine().begin() as conn:
+            rows = conn.execute(text("""
+                SELECT filename, sha256 FROM upload_blobs
+                 WHERE sha256 IN (SELECT sha256 FROM upload_blobs WHERE sha256 IS NOT NULL
+                                   GROUP BY sha256 HAVING count(*) > 1)
+                 ORDER BY sha256, ref_count DESC, length(filename), filename
+            """)).all()
+            keep = {}
+            for row in rows:
+                if row.sha256 not in keep:
+                    keep[row.sha256] = row.filename
+                    continue
+                params = {'keep': keep[row.sha256], 'copy': row.filename}
+                conn.execute(text("UPDATE businesses SET logo = :keep WHERE logo = :copy"), params)
+                conn.execute(text("UPDATE products SET image_url = :keep WHERE image_url = :copy"), params)
+                replaced[row.filename] = keep[row.sha256]
+        return replaced
+
+    def collect(self, dry_run=False, grace=None):
+        """
+        Borra los archivos (y sus variantes) sin referencias desde hace más de
+        `grace` segundos. Devuelve la lista de archivos borrados.
+        """
+        cutoff = int(time.time()) - (self.grace if grace is None else grace)
+        params = {'cutoff': cutoff}
+        condition = "ref_count <= 0 AND last_seen_at <= :cutoff"
+        with self.get_engine().connect() as conn:
+            candidates = conn.execute(text(f"SELECT filename FROM upload_blobs WHERE {condition}"),
+                                      params).scalars().all()
+        if dry_run:
+            return candidates
+
+        removed = []
+        for name in candidates:
+            with self.get_engine().connect() as conn, conn.begin() as transaction:
+                # Volver a comprobar: una subida igual pudo reutilizarlo mientras tanto
+                deleted = conn.execute(text(f"DELETE FROM upload_blobs WHERE filename = :filename AND {condition}"),
+                                       dict(params, filename=name)).rowcount
+                if not deleted:
+                    continue
+                try:
+                    os.remove(self.path(name))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"Advertencia: no se pudo borrar {name}: {e}")
+                    transaction.rollback()
+                    continue
+            if self.pipeline is not None:
+                self.pipeline.remove(name)
+            removed.append(name)
+        return removed
+
+    def stats(self):
+        with self.get_engine().connect() as conn:
+            row = conn.execute(text(
+                "SELECT count(*) AS files, coalesce(sum(size), 0) AS bytes, "
+                "sum(ref_count <= 0) AS unreferenced FROM upload_blobs"
+            )).one()
+        return {'files': row.files, 'bytes': row.bytes, 'unreferenced': row.unreferenced or 0}
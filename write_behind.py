@@ -0,0 +1,154 @@
+"""
+Buffer de escritura diferida (write-behind) para eventos de alto volumen.
+
+Las rutas encolan eventos en una cola acotada en memoria y responden sin
+tocar la base de datos; un hilo en segundo plano vacía la cola cada
+`interval_ms` milisegundos o cuando se juntan `batch_size` eventos, y llama
+a `flush_fn(eventos)` para escribirlos en una sola transacción.
+
+- Si la cola se llena, quien encola vacía la cola él mismo (contrapresión);
+  si aun así no hay lugar en `put_timeout` segundos, el evento se descarta y
+  se cuenta en `stats()['dropped']` en lugar de fallar la petición.
+- Un lote que no se puede escribir se reintenta una vez; si vuelve a fallar,
+  sus eventos se cuentan en `stats()['lost']`.
+- `on_lost(eventos)`, si se pasa, recibe los eventos descartados o perdidos,
+  para que quien los encoló deje de tratarlos como pendientes.
+- Al terminar el proceso (atexit) se escriben los eventos pendientes.
+- El hilo se arranca en el primer evento de cada proceso, así cada worker
+  de un servidor prefork tiene el suyo.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+
+    def __init__(self, flush_fn, interval_ms=500, batch_size=200, maxsize=10000, enabled=True, put_timeout=1.0,
+                 on_lost=None):
+        self.flush_fn = flush_fn
+        self.on_lost = on_lost
+        self.interval = interval_ms / 1000.0
+        self.batch_size = batch_size
+        self.enabled = enabled
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'written': 0, 'retried': 0, 'lost': 0, 'dropped': 0}
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.close)
+
+    def put(self, event):
+        if not self.enabled:
+            # Modo síncrono (scripts, pruebas): escribir de inmediato
+            self._write([event])
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.flush()
+            try:
+                self._queue.put(event, timeout=self.put_timeout)
+            except queue.Full:
+                self._count('dropped')
+                logger.warning('Cola de eventos diferidos llena: se descartó un evento')
+                self._notify_lost([event])
+
+    def flush(self):
+        """Escribe todo lo pendiente en el hilo actual."""
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                return
+            self._write(batch)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._thread.join(timeout=self.interval * 4)
+        self.flush()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        """Eventos escritos, lotes reintentados, eventos perdidos tras reintentar y descartados con la cola llena."""
+        with self._stats_lock:
+            return {**self._stats, 'pending': self.pending()}
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self._stats[name] += n
+
+    def _thread_running(self):
+        return self._pid == os.getpid() and self._thread is not None and self._thread.is_alive()
+
+    def _ensure_thread(self):
+        if self._thread_running():
+            return
+        with self._start_lock:
+            if not self._thread_running():
+                self._pid = os.getpid()
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = []
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        with self._flush_lock:
+            for attempt in range(2):
+                try:
+                    self.flush_fn(batch)
+                    self._count('written', len(batch))
+                    return
+                except Exception:
+                    if attempt == 0:
+                        # Un lock de SQLite ocupado suele liberarse enseguida: reintentar una vez
+                        logger.warning('No se pudieron escribir %d eventos diferidos; reintentando', len(batch))
+                        self._count('retried')
+                        time.sleep(min(self.interval, 1.0))
+                    else:
+                        logger.exception('Se perdieron %d eventos diferidos', len(batch))
+                        self._count('lost', len(batch))
+                        self._notify_lost(batch)
+
+    def _notify_lost(self, events):
+        if self.on_lost is None:
+            return
+        try:
+            self.on_lost(events)
+        except Exception:
+            logger.exception('Error en on_lost de los eventos diferidos')
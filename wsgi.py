@@ -0,0 +1,11 @@
+"""
+Punto de entrada WSGI.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+`flask run` y los comandos `flask ...` también cargan este archivo
+automáticamente, así que la app siempre pasa por init_app().
+"""
+from app import init_app
+
+app = init_app()